@@ -48,6 +48,7 @@ bencode_ENABLED = True
 cython_bencode_ENABLED = True
 rencode_ENABLED = True
 cymaths_ENABLED = True
+cyregion_ENABLED = True
 cyxor_ENABLED = True
 clipboard_ENABLED = True
 Xdummy_ENABLED = None           #none means auto-detect
@@ -89,7 +90,7 @@ SWITCHES = ("enc_x264", "x264_static",
             "clipboard",
             "server", "client", "x11",
             "gtk2", "gtk3", "qt4", "html5",
-            "sound", "cyxor", "cymaths", "opengl", "argb",
+            "sound", "cyxor", "cymaths", "cyregion", "opengl", "argb",
             "warn", "strict", "shadow", "debug", "PIC", "Xdummy", "verbose")
 HELP = "-h" in sys.argv or "--help" in sys.argv
 if HELP:
@@ -146,6 +147,9 @@ if "clean" not in sys.argv:
     if cymaths_ENABLED and not server_ENABLED:
         print("Warning: cymaths requires server to be enabled!")
         cymaths_ENABLED = False
+    if cyregion_ENABLED and not server_ENABLED:
+        print("Warning: cyregion requires server to be enabled!")
+        cyregion_ENABLED = False
     if x11_ENABLED and WIN32:
         print("Warning: enabling x11 on MS Windows is unlikely to work!")
     if client_ENABLED and not gtk2_ENABLED and not gtk3_ENABLED and not qt4_ENABLED:
@@ -505,7 +509,10 @@ if 'clean' in sys.argv or 'sdist' in sys.argv:
                    "xpra/codecs/csc_cython/colorspace_converter.c",
                    "xpra/codecs/xor/cyxor.c",
                    "xpra/codecs/argb/argb.c",
+                   "xpra/codecs/argb/convert.c",
+                   "xpra/codecs/argb/checksum.c",
                    "xpra/server/stats/cymaths.c",
+                   "xpra/server/cyregion.c",
                    "etc/xpra/xpra.conf"]
     if sys.platform.startswith("win"):
         #on win32, the build creates ".pyd" files, clean those too:
@@ -1013,6 +1020,10 @@ if argb_ENABLED:
     toggle_packages(True, "xpra.codecs.argb")
     cython_add(Extension("xpra.codecs.argb.argb",
                 ["xpra/codecs/argb/argb.pyx"]))
+    cython_add(Extension("xpra.codecs.argb.convert",
+                ["xpra/codecs/argb/convert.pyx"]))
+    cython_add(Extension("xpra.codecs.argb.checksum",
+                ["xpra/codecs/argb/checksum.pyx"]))
 
 toggle_packages(client_ENABLED, "xpra.client", "xpra.client.notifications")
 toggle_packages(client_ENABLED and gtk2_ENABLED or gtk3_ENABLED, "xpra.client.gtk_base")
@@ -1041,6 +1052,11 @@ if cymaths_ENABLED:
                 ["xpra/server/stats/cymaths.pyx"],
                 **pkgconfig()))
 
+if cyregion_ENABLED:
+    cython_add(Extension("xpra.server.cyregion",
+                ["xpra/server/cyregion.pyx"],
+                **pkgconfig()))
+
 
 
 toggle_packages(csc_opencl_ENABLED, "xpra.codecs.csc_opencl")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Pixel format conversion benchmark:
+compares the conversion module (xpra.codecs.argb.convert) with the routes used before it:
+PIL frombuffer(..).tostring() and the argb module functions (which ignore the rowstride).
+For each conversion used by the server (rgb_encode, mmap_send) and the client (paint_rgb*),
+and for each image size, it checks that the routes agree and reports the time per frame.
+"""
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+#(source format, destination format, argb module function name)
+CONVERSIONS = (
+               ("BGRX", "RGB",  "bgra_to_rgb"),
+               ("BGRX", "RGBX", None),
+               ("BGRA", "RGBA", "bgra_to_rgba"),
+               ("XRGB", "RGB",  "argb_to_rgb"),
+               ("BGR",  "RGB",  None),
+               ("BGRA", "BGRX", None),
+               )
+SIZES = ((64, 64), (512, 512), (1920, 1080), (2560, 1600))
+#rows are padded like the X11 server does:
+ROWSTRIDE_PADDING = 64
+
+
+def get_PIL():
+    try:
+        from PIL import Image   #@UnresolvedImport
+        return Image
+    except ImportError:
+        try:
+            import Image        #@UnresolvedImport @Reimport
+            return Image
+        except ImportError:
+            return None
+
+def timeit(fn, loops):
+    fn()
+    start = time.time()
+    for _ in range(loops):
+        fn()
+    return (time.time()-start)/loops
+
+
+def benchmark(loops, threads):
+    from xpra.codecs.argb.convert import convert, CONVERT_THREADS       #@UnresolvedImport
+    try:
+        from xpra.codecs.argb import argb       #@UnresolvedImport
+    except ImportError:
+        argb = None
+    Image = get_PIL()
+    if threads<=0:
+        threads = CONVERT_THREADS
+    print("conversion threads=%s, PIL=%s, argb=%s" % (threads, Image is not None, argb is not None))
+    print("%-14s %-10s %12s %12s %12s %12s %12s" % ("conversion", "size", "convert", "convert*%s" % threads, "re-use", "PIL", "argb"))
+    for src_format, dst_format, argb_fn in CONVERSIONS:
+        for w, h in SIZES:
+            rowstride = w*len(src_format)+ROWSTRIDE_PADDING
+            pixels = os.urandom(rowstride*h)
+            results = {}
+            def engine(t, out=None):
+                results["convert"] = convert(pixels, w, h, rowstride, src_format, dst_format, out, 0, t)[0]
+            single = timeit(lambda : engine(1), loops)
+            multi = timeit(lambda : engine(threads), loops)
+            out = bytearray(w*h*len(dst_format))
+            reuse = timeit(lambda : engine(threads, out), loops)
+            expected = str(results["convert"])
+            pil = None
+            if Image and src_format!="BGR" and dst_format in ("RGB", "RGBA", "RGBX"):
+                def pil_route():
+                    img = Image.frombuffer(dst_format, (w, h), pixels, "raw", src_format, rowstride)
+                    results["PIL"] = img.tostring("raw", dst_format)
+                pil = timeit(pil_route, loops)
+                if dst_format!="RGBX":
+                    assert results["PIL"]==expected, "PIL and convert disagree for %s to %s" % (src_format, dst_format)
+            argb_time = None
+            if argb and argb_fn:
+                #the argb functions ignore the rowstride, so give them unpadded pixels:
+                unpadded = "".join(pixels[i*rowstride:i*rowstride+w*len(src_format)] for i in range(h))
+                fn = getattr(argb, argb_fn)
+                def argb_route():
+                    results["argb"] = fn(unpadded)
+                argb_time = timeit(argb_route, loops)
+                assert str(results["argb"])==expected, "argb.%s and convert disagree" % argb_fn
+            def ms(v):
+                if v is None:
+                    return "-"
+                return "%.2fms" % (v*1000.0)
+            print("%-14s %-10s %12s %12s %12s %12s %12s" % ("%s>%s" % (src_format, dst_format), "%sx%s" % (w, h),
+                                                            ms(single), ms(multi), ms(reuse), ms(pil), ms(argb_time)))
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-n", "--loops", type="int", dest="loops", default=20, help="number of conversions to time for each test")
+    parser.add_option("-t", "--threads", type="int", dest="threads", default=0, help="number of conversion threads (default: XPRA_CONVERT_THREADS)")
+    options, _ = parser.parse_args()
+    try:
+        benchmark(options.loops, options.threads)
+    except ImportError, e:
+        print("cannot run the benchmark: %s" % e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
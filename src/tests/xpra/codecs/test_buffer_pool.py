@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import time
+from xpra.codecs.buffer_pool import BufferPool, get_bucket_size, MIN_BUFFER_SIZE
+
+
+def test_bucket_size():
+    assert get_bucket_size(1)==MIN_BUFFER_SIZE
+    assert get_bucket_size(MIN_BUFFER_SIZE)==MIN_BUFFER_SIZE
+    assert get_bucket_size(1920*1080*4)==8388608
+    for size in (4097, 5000, 65535, 65536, 100000, 1920*1080*3, 12345678):
+        bsize = get_bucket_size(size)
+        #never smaller, at most 1/16th larger, and stable:
+        assert bsize>=size and bsize-size<=size//16+1, "%s -> %s" % (size, bsize)
+        assert get_bucket_size(bsize)==bsize
+
+def test_reuse():
+    pool = BufferPool(max_size=1024*1024, idle_timeout=10)
+    buf = pool.get(10000)
+    assert type(buf)==bytearray and len(buf)==get_bucket_size(10000)
+    pool.release(buf)
+    #a similar size uses the same bucket:
+    assert pool.get(10100) is buf
+    assert pool.hits==1 and pool.misses==1
+    #a different size does not:
+    assert pool.get(50000) is not buf
+    #buffers which are not ours are ignored:
+    pool.release(bytearray(10000))
+    pool.release("not a bytearray")
+    assert len(pool)==0 and pool.size==0
+
+def test_copy():
+    pool = BufferPool(max_size=1024*1024, idle_timeout=10)
+    pixels = "".join(chr(i%256) for i in range(5000))
+    buf, size = pool.copy(pixels)
+    assert size==len(pixels) and len(buf)>=size
+    assert str(buffer(buf, 0, size))==pixels
+
+def test_max_size():
+    pool = BufferPool(max_size=3*MIN_BUFFER_SIZE, idle_timeout=10)
+    buffers = [pool.get(MIN_BUFFER_SIZE) for _ in range(5)]
+    for buf in buffers:
+        pool.release(buf)
+    assert len(pool)==3 and pool.size==3*MIN_BUFFER_SIZE
+    assert pool.dropped==2
+
+def test_expire():
+    pool = BufferPool(max_size=1024*1024, idle_timeout=0.05)
+    pool.release(pool.get(MIN_BUFFER_SIZE))
+    time.sleep(0.1)
+    pool.expire(time.time())
+    assert len(pool)==0 and pool.size==0 and pool.expired==1
+    pool.release(pool.get(MIN_BUFFER_SIZE))
+    pool.clear()
+    assert len(pool)==0 and pool.size==0
+
+
+def main():
+    test_bucket_size()
+    test_reuse()
+    test_copy()
+    test_max_size()
+    test_expire()
+    print("BufferPool tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+from xpra.codecs.delta_cache import DeltaCache
+
+
+def test_lru_slots():
+    cache = DeltaCache(max_size=1024, max_slots=2)
+    assert cache.add("a", "A", 10)==[]
+    assert cache.add("b", "B", 10)==[]
+    #"a" is now the most recently used:
+    assert cache.get("a")=="A"
+    removed = cache.add("c", "C", 10)
+    assert removed==[("b", "B")], "expected 'b' to be evicted but got %s" % removed
+    assert cache.get("b") is None
+    assert len(cache)==2 and cache.size==20
+    assert cache.evictions==1
+
+def test_replace():
+    cache = DeltaCache(max_size=1024, max_slots=4)
+    cache.add("a", "old", 100)
+    #replacing a slot is not an eviction, but the old value is still returned:
+    assert cache.add("a", "new", 200)==[("a", "old")]
+    assert cache.get("a")=="new"
+    assert cache.size==200 and cache.evictions==0
+
+def test_size_budget():
+    cache = DeltaCache(max_size=1000, max_slots=16)
+    for i in range(4):
+        cache.add(i, i, 300)
+    #only 3 fit in the budget, the oldest was evicted:
+    assert sorted(cache.slots.keys())==[1, 2, 3]
+    assert cache.size==900
+    #too big to ever fit, nothing is evicted:
+    assert cache.add("huge", None, 2000)==[]
+    assert len(cache)==3
+    cache.remove(2)
+    cache.remove(2)
+    assert cache.size==600
+    cache.clear()
+    assert len(cache)==0 and cache.size==0
+
+class DeltaSimulator(object):
+    """ does what WindowSource.make_data_packet and WindowBackingBase.process_delta do with the delta caches """
+
+    def __init__(self, max_slots=4):
+        from xpra.client.window_backing_base import WindowBackingBase
+        self.backing = WindowBackingBase.__new__(WindowBackingBase)
+        self.backing._delta_cache = DeltaCache(max_size=1024*1024, max_slots=max_slots)
+        self.server = DeltaCache(max_size=1024*1024, max_slots=max_slots)
+        self.packet_sequence = 1
+
+    def send(self, w, h, pixels=None):
+        """ sends one packet, returns the options used """
+        from xpra.codecs.xor import xor_str
+        pixels = pixels or os.urandom(w*h*3)
+        key = (w, h, "rgb24")
+        #each packet gets its own store id:
+        store = self.packet_sequence
+        self.packet_sequence += 1
+        options = {"store" : store}
+        data = pixels
+        last = self.server.get(key)
+        if last is not None:
+            options["delta"] = last[0]
+            data = xor_str(pixels, last[1])
+        removed = self.server.add(key, (store, pixels), len(pixels))
+        evict = [value[0] for _, value in removed]
+        if evict:
+            options["evict"] = evict
+        rgb_data = self.backing.process_delta(data, w, h, w*3, options)
+        assert str(rgb_data)==pixels, "packet %s does not match" % store
+        #the client holds the same slots as the server:
+        client_slots = sorted(self.backing._delta_cache.slots.keys())
+        server_slots = sorted([v[2][0] for v in self.server.slots.values()])
+        assert client_slots==server_slots, "client slots %s, server slots %s" % (client_slots, server_slots)
+        return options
+
+def test_client_evicts_after_delta():
+    #the server replaces the slot it xors with, so the slot the delta
+    #refers to is also in the "evict" list of the same packet:
+    #the client must apply the delta before evicting anything
+    sim = DeltaSimulator()
+    for i in range(5):
+        options = sim.send(16, 4)
+        if i>0:
+            assert options["delta"] in options["evict"]
+
+def test_sub_images():
+    #a damage sent as several packets (scroll bands, tiles) of different sizes,
+    #each one must get its own slot on both ends:
+    sim = DeltaSimulator(max_slots=3)
+    for _ in range(4):
+        for w, h in ((64, 64), (128, 64), (64, 32), (64, 64)):
+            sim.send(w, h)
+
+
+def main():
+    test_lru_slots()
+    test_replace()
+    test_size_budget()
+    test_client_evicts_after_delta()
+    test_sub_images()
+    print("DeltaCache tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Network protocol throughput benchmark:
+pushes synthetic packet mixes through two Protocol instances connected with a socketpair,
+for each combination of packet encoder, compressor and cipher,
+and reports packets/s, MB/s, per-packet latency percentiles and CPU time per MB.
+The payloads are generated from a fixed seed so runs can be compared with each other.
+"""
+
+import os
+import sys
+import time
+import socket
+import random
+import threading
+from collections import deque
+from optparse import OptionParser
+
+from xpra.net.protocol import Protocol, Compressed, has_lz4, has_rencode, has_bencode, AES
+from xpra.net.bytestreams import SocketConnection
+
+SEED = 20131218
+CIPHER_ARGS = ("AES", "0000000000000000", "benchmark-password", "benchmark-salt", 1000)
+#zero disables compression:
+ZLIB_LEVELS = (0, 1, 3, 6)
+DEFAULT_PACKETS = 1000
+
+
+class ThreadScheduler(object):
+    """ the protocol only needs idle_add and timeout_add, we don't need a main loop for that """
+
+    def idle_add(self, fn, *args):
+        self.timeout_add(0, fn, *args)
+
+    def timeout_add(self, delay, fn, *args):
+        t = threading.Timer(delay/1000.0, fn, args)
+        t.daemon = True
+        t.start()
+
+
+def make_data(rnd, size, redundancy=0.5):
+    """ returns a string which compresses roughly by 'redundancy' """
+    chunks = []
+    total = 0
+    while total<size:
+        n = rnd.randint(16, 256)
+        if rnd.random()<redundancy and chunks:
+            chunk = rnd.choice(chunks)[:n]
+        else:
+            chunk = ("%0*x" % (2*n, rnd.getrandbits(8*n))).decode("hex")
+        chunks.append(chunk)
+        total += len(chunk)
+    return "".join(chunks)[:size]
+
+def draw_packet(rnd, coding, size):
+    w, h = rnd.choice([(640, 480), (1280, 720), (1920, 1080), (64, 64)])
+    return ["draw", 1, 0, 0, w, h, coding, Compressed(coding, make_data(rnd, size, 0.1)), 0, w*4, {}]
+
+def metadata_packet(rnd):
+    return ["window-metadata", rnd.randint(1, 100), {
+                "title"         : "user@host: ~/%s" % make_data(rnd, 12).encode("hex"),
+                "class-instance": ["xterm", "XTerm"],
+                "size-constraints" : {"minimum-size" : (25, 17), "base-size" : (19, 4), "increment" : (6, 13)},
+                "pid"           : rnd.randint(1000, 32000),
+                }]
+
+def cursor_packet(rnd):
+    #32x32 ARGB cursor, mostly transparent:
+    pixels = make_data(rnd, 32*32*4, 0.9)
+    return ["cursor", rnd.randint(0, 1920), rnd.randint(0, 1080), 32, 32, 4, 4, rnd.randint(1, 10000), pixels, "left_ptr"]
+
+def clipboard_packet(rnd):
+    text = make_data(rnd, rnd.randint(64, 16*1024), 0.8)
+    return ["clipboard-contents", rnd.randint(1, 1000), "CLIPBOARD", "UTF8_STRING", 8, "bytes", text]
+
+MIXES = {
+    "draw-rgb"  : lambda rnd : draw_packet(rnd, "rgb24", rnd.randint(64*1024, 1024*1024)),
+    "draw-png"  : lambda rnd : draw_packet(rnd, "png", rnd.randint(8*1024, 128*1024)),
+    "draw-video": lambda rnd : draw_packet(rnd, "h264", rnd.randint(512, 16*1024)),
+    "metadata"  : metadata_packet,
+    "cursor"    : cursor_packet,
+    "clipboard" : clipboard_packet,
+    }
+#a typical session: mostly small video frames and control packets
+MIXED_WEIGHTS = (("draw-rgb", 1), ("draw-png", 4), ("draw-video", 20), ("metadata", 2), ("cursor", 3), ("clipboard", 1))
+
+def make_packets(mix, count):
+    rnd = random.Random(SEED)
+    packets = []
+    for _ in range(count):
+        m = mix
+        if mix=="mixed":
+            m = weighted_choice(rnd, MIXED_WEIGHTS)
+        packets.append(MIXES[m](rnd))
+    return packets
+
+def weighted_choice(rnd, choices):
+    total = sum([w for _,w in choices])
+    v = rnd.uniform(0, total)
+    for c, w in choices:
+        v -= w
+        if v<=0:
+            return c
+    return choices[-1][0]
+
+
+def get_encoders():
+    encoders = []
+    if has_bencode:
+        encoders.append("bencode")
+    if has_rencode:
+        encoders.append("rencode")
+    return encoders
+
+def get_compressors():
+    compressors = [("zlib", level) for level in ZLIB_LEVELS]
+    if has_lz4:
+        compressors.append(("lz4", 1))
+    return compressors
+
+def get_ciphers():
+    if AES:
+        return (False, True)
+    return (False, )
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values)*p/100.0))]
+
+
+def run(packets, encoder, compressor, cipher, timeout=60):
+    """ sends all the packets from one protocol instance to the other and returns the results """
+    a, b = socket.socketpair()
+    scheduler = ThreadScheduler()
+    #the protocol modifies the packets it sends, so use copies:
+    queue = [list(x) for x in packets]
+    #the time each packet is handed to the protocol, for each packet type:
+    #(packets of different types may be re-ordered by the write lanes)
+    sent_at = {}
+    latencies = []
+    done = threading.Event()
+    def get_packet():
+        packet = queue.pop(0)
+        sent_at.setdefault(packet[0], deque()).append(time.time())
+        return packet, None, None, len(queue)>0
+    def process_packet(proto, packet):
+        if packet[0] in ("connection-lost", "gibberish"):
+            done.set()
+            return
+        latencies.append(time.time()-sent_at[packet[0]].popleft())
+        if len(latencies)==len(packets):
+            done.set()
+    def ignore_packet(proto, packet):
+        pass
+    sender = Protocol(scheduler, SocketConnection(a, "sender", "receiver", "receiver", "benchmark"), ignore_packet, get_packet)
+    receiver = Protocol(scheduler, SocketConnection(b, "receiver", "sender", "sender", "benchmark"), process_packet)
+    receiver.max_packet_size = 64*1024*1024
+    if encoder=="rencode":
+        sender.enable_rencode()
+    else:
+        sender.enable_bencode()
+    #measure the compressor this row names, not the adaptive choice:
+    sender._adaptive_compression = None
+    receiver._adaptive_compression = None
+    algo, level = compressor
+    sender.set_compression_level(level)
+    if algo=="lz4":
+        sender.peer_lz4 = True
+        sender.enable_lz4()
+    if cipher:
+        sender.set_cipher_out(*CIPHER_ARGS)
+        receiver.set_cipher_in(*CIPHER_ARGS)
+    cpu_start = sum(os.times()[:2])
+    start = time.time()
+    sender.start()
+    receiver.start()
+    sender.source_has_more()
+    done.wait(timeout)
+    elapsed = time.time()-start
+    cpu = sum(os.times()[:2])-cpu_start
+    bytecount = sender._conn.output_bytecount
+    sender.close()
+    receiver.close()
+    count = len(latencies)
+    mbytes = bytecount/1024.0/1024.0
+    return {
+            "packets"   : count,
+            "complete"  : count==len(packets),
+            "packets/s" : count/elapsed,
+            "MB/s"      : mbytes/elapsed,
+            "p50_ms"    : 1000.0*percentile(latencies, 50),
+            "p99_ms"    : 1000.0*percentile(latencies, 99),
+            "cpu_ms/MB" : 1000.0*cpu/max(mbytes, 0.001),
+            "bytes"     : bytecount,
+            }
+
+
+COLUMNS = ("packets/s", "MB/s", "p50_ms", "p99_ms", "cpu_ms/MB")
+
+def print_header():
+    print("%-12s %-8s %-8s %-6s %10s %10s %10s %10s %10s" % (("mix", "encoder", "compress", "cipher")+COLUMNS))
+
+def print_result(mix, encoder, compressor, cipher, result):
+    values = tuple([result[x] for x in COLUMNS])
+    warning = ""
+    if not result["complete"]:
+        warning = "  (only %s packets received!)" % result["packets"]
+    print("%-12s %-8s %-8s %-6s %10.1f %10.2f %10.2f %10.2f %10.1f%s" %
+          ((mix, encoder, "%s%s" % compressor, ["off", "on"][cipher]) + values + (warning,)))
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--packets", type="int", dest="packets", default=DEFAULT_PACKETS,
+                      help="Number of packets to send for each test. Default: %default.")
+    parser.add_option("-m", "--mix", action="append", dest="mixes", default=[],
+                      help="Packet mix to test, can be repeated: %s or mixed. Default: all of them." % ", ".join(sorted(MIXES.keys())))
+    parser.add_option("--quick", action="store_true", dest="quick", default=False,
+                      help="Only test the default configuration (first encoder, zlib level 1, no cipher).")
+    options, _ = parser.parse_args()
+    mixes = options.mixes or (sorted(MIXES.keys())+["mixed"])
+    for m in mixes:
+        if m!="mixed" and m not in MIXES:
+            parser.error("invalid mix: %s" % m)
+    encoders = get_encoders()
+    compressors = get_compressors()
+    ciphers = get_ciphers()
+    if options.quick:
+        encoders, compressors, ciphers = encoders[:1], [("zlib", 1)], (False, )
+    print_header()
+    for mix in mixes:
+        packets = make_packets(mix, options.packets)
+        for encoder in encoders:
+            for compressor in compressors:
+                for cipher in ciphers:
+                    result = run(packets, encoder, compressor, cipher)
+                    print_result(mix, encoder, compressor, cipher, result)
+                    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+from xpra.net.adaptive_compression import AdaptiveCompression, NONE
+
+
+def feed(ac, packet_type, bandwidth, count, results):
+    """ records the given ratio and speed for each option chosen """
+    choices = []
+    for _ in range(count):
+        option = ac.choose(packet_type, 6, True, False, bandwidth)
+        choices.append(option)
+        if option is not None:
+            ratio, elapsed = results[option]
+            ac.record(packet_type, option, 100000, int(100000*ratio), elapsed)
+    return choices
+
+#ratio and time to compress 100KB for each option:
+RESULTS = {NONE         : (1.0, 0.0),
+           ("lz4", 1)   : (0.5, 0.0005),
+           ("zlib", 1)  : (0.3, 0.002),
+           ("zlib", 6)  : (0.2, 0.02)}
+
+def test_unknown_bandwidth():
+    ac = AdaptiveCompression()
+    #no link rate, no choice: the caller uses the level it was given
+    assert feed(ac, "draw", 0, 5, RESULTS)==[None]*5
+    #once we have a choice, we keep it while the link rate is unknown:
+    choices = feed(ac, "draw", 100*1000*1000, 30, RESULTS)
+    best = choices[-1]
+    assert best is not None
+    assert feed(ac, "draw", 0, 5, RESULTS)==[best]*5
+    info = {}
+    ac.add_stats(info)
+    assert info["bandwidth"]==100*1000*1000
+
+def test_link_rate():
+    #fast link: don't spend time compressing
+    ac = AdaptiveCompression()
+    choices = feed(ac, "draw", 1000*1000*1000, 30, RESULTS)
+    assert choices[-1]==NONE, "got %s" % choices[-1]
+    #slow link: compress as much as possible
+    ac = AdaptiveCompression()
+    choices = feed(ac, "draw", 10*1000, 30, RESULTS)
+    assert choices[-1]==("zlib", 6), "got %s" % choices[-1]
+
+def test_options_changed():
+    ac = AdaptiveCompression()
+    feed(ac, "draw", 10*1000, 30, RESULTS)
+    #the zlib level 6 choice is not available at level 1:
+    assert ac.choose("draw", 1, True, False, 0) is None
+
+
+def main():
+    test_unknown_bandwidth()
+    test_link_rate()
+    test_options_changed()
+    print("AdaptiveCompression tests passed")
+
+
+if __name__ == "__main__":
+    main()
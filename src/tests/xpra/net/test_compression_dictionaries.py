@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import zlib
+from xpra.net.bencode import bencode
+from xpra.net.compression_dictionaries import CompressionDictionaries, SAMPLE_PACKETS, DICTIONARY_ALIASES
+
+
+PACKETS = {
+    "cursor"            : ["cursor", 600, 400, 24, 24, 12, 12, 1057, "", "xterm"],
+    "window-metadata"   : ["window-metadata", 9, {"title" : "user@host: ~/src", "class-instance" : ["xterm", "XTerm"]}],
+    "pointer-position"  : ["pointer-position", 3, (100, 200), ["mod2"], []],
+    "ping"              : ["ping", 1386248399999],
+    "ping_echo"         : ["ping_echo", 1386248399999, 110, 90, 70, 10],
+    }
+
+def test_round_trip():
+    #each end of the connection has its own instance:
+    sender = CompressionDictionaries()
+    receiver = CompressionDictionaries()
+    matching = sender.get_matching(receiver.get_caps())
+    for packet_type, packet in PACKETS.items():
+        dictionary_id = matching.get(packet_type)
+        assert dictionary_id, "no dictionary for %s" % packet_type
+        data = bencode(packet)
+        for level in (1, 6, 9):
+            #the compressors are re-used, make sure the state does not leak between packets:
+            for _ in range(2):
+                cdata = sender.compress(dictionary_id, data, level)
+                assert receiver.decompress(dictionary_id, cdata)==data
+        #the dictionary should make small packets smaller:
+        with_dict = len(sender.compress(dictionary_id, data, 6))
+        without = len(zlib.compress(data, 6))
+        assert with_dict<without, "%s: %s bytes with the dictionary, %s without" % (packet_type, with_dict, without)
+
+def test_matching():
+    d = CompressionDictionaries()
+    caps = d.get_caps()
+    assert len(caps)==len(SAMPLE_PACKETS)
+    #the ids are stable and follow the order of the sample packets:
+    for i, (packet_type, _) in enumerate(SAMPLE_PACKETS):
+        assert caps[packet_type][0]==i+1
+    matching = d.get_matching(caps)
+    for alias, packet_type in DICTIONARY_ALIASES.items():
+        assert matching[alias]==matching[packet_type]
+    #dictionaries with a different checksum are not used:
+    remote = dict(caps)
+    remote["cursor"] = [caps["cursor"][0], caps["cursor"][1]^1]
+    del remote["ping"]
+    matching = d.get_matching(remote)
+    assert "cursor" not in matching
+    assert "ping" not in matching and "ping_echo" not in matching
+    assert "window-metadata" in matching
+    assert d.get_matching(None)=={}
+
+
+def main():
+    test_round_trip()
+    test_matching()
+    print("CompressionDictionaries tests passed")
+
+
+if __name__ == "__main__":
+    main()
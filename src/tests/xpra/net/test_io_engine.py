@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import socket
+import threading
+
+from xpra.net.bytestreams import SocketConnection
+from xpra.net.io_engine import EventProtocol, IO_WORKERS
+
+
+class ThreadScheduler(object):
+
+    def idle_add(self, fn, *args):
+        self.timeout_add(0, fn, *args)
+
+    def timeout_add(self, delay, fn, *args):
+        t = threading.Timer(delay/1000.0, fn, args)
+        t.daemon = True
+        t.start()
+
+
+def make_sender(scheduler, sock, packets):
+    def get_packet():
+        packet = packets.pop(0)
+        return packet, None, None, len(packets)>0
+    def ignore_packet(proto, packet):
+        pass
+    proto = EventProtocol(scheduler, SocketConnection(sock, "sender", "receiver", "receiver", "test"), ignore_packet, get_packet)
+    proto.enable_bencode()
+    proto.set_compression_level(0)
+    return proto
+
+def test_stalled_peers():
+    #peers which never read fill their socket buffers and then their write lanes,
+    #this must not block the worker threads used by the other connections
+    scheduler = ThreadScheduler()
+    stalled = []
+    for i in range(IO_WORKERS*2):
+        a, b = socket.socketpair()
+        packets = [["draw", 1, 0, 0, 512, 512, "rgb24", os.urandom(512*1024), j, 0, {}] for j in range(32)]
+        sender = make_sender(scheduler, a, packets)
+        sender.start()
+        stalled.append((sender, b))
+    #give them time to fill the socket buffers:
+    threading.Event().wait(1)
+    a, b = socket.socketpair()
+    received = threading.Event()
+    def process_packet(proto, packet):
+        if packet[0]=="hello":
+            received.set()
+    from xpra.net.protocol import Protocol
+    receiver = Protocol(scheduler, SocketConnection(b, "receiver", "sender", "sender", "test"), process_packet)
+    receiver.start()
+    sender = make_sender(scheduler, a, [["hello", {"test" : True}]])
+    sender.start()
+    received.wait(5)
+    assert received.isSet(), "the healthy connection did not get its packet"
+    for p, s in stalled:
+        p.close()
+        s.close()
+    sender.close()
+    receiver.close()
+
+
+def main():
+    test_stalled_peers()
+    print("io engine tests passed")
+
+
+if __name__ == "__main__":
+    main()
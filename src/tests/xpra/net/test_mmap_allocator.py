@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import mmap
+import random
+import threading
+from xpra.net.mmap_pipe import MmapAllocator, mmap_read
+
+SIZE = 64*1024
+START = 4096
+
+
+def make_allocator():
+    area = mmap.mmap(-1, SIZE)
+    return area, MmapAllocator(area, SIZE, alignment=64, start=START)
+
+def read(area, chunks):
+    return str(bytearray(mmap_read(area, chunks)))
+
+
+def test_write_release():
+    area, allocator = make_allocator()
+    chunks, free = allocator.write("hello", (1, 1))
+    assert chunks==[(START, 5)], "unexpected chunks: %s" % chunks
+    #slots are aligned:
+    assert free==SIZE-START-64
+    assert read(area, chunks)=="hello"
+    chunks2, _ = allocator.write("world", (1, 2))
+    assert chunks2==[(START+64, 5)]
+    assert read(area, chunks)=="hello" and read(area, chunks2)=="world"
+    assert allocator.release((1, 1))
+    assert not allocator.release((1, 1)), "released twice"
+    assert allocator.release((1, 2))
+    assert allocator.get_free_size()==SIZE-START
+    assert allocator.free_list==[[START, SIZE-START]]
+
+def test_stale_tag():
+    _, allocator = make_allocator()
+    allocator.write("x"*100, (1, 1))
+    #the same tag again: the old slot is freed
+    allocator.write("y"*100, (1, 1))
+    assert len(allocator.slots)==1
+    allocator.release((1, 1))
+    assert allocator.get_free_size()==SIZE-START
+
+def test_full_and_wrap_around():
+    area, allocator = make_allocator()
+    chunk = 1024*10
+    tags = []
+    seq = 0
+    while True:
+        seq += 1
+        chunks, _ = allocator.write(chr(65+seq%26)*chunk, (1, seq))
+        if chunks is None:
+            break
+        tags.append((seq, chunks))
+    assert allocator.failed==1
+    assert len(tags)==(SIZE-START)//chunk
+    #release the first slot, the next write re-uses the start of the area:
+    first_seq, first_chunks = tags.pop(0)
+    allocator.release((1, first_seq))
+    chunks, _ = allocator.write("z"*chunk, (1, 1000))
+    assert chunks==[(first_chunks[0][0], chunk)], "expected %s but got %s" % (first_chunks, chunks)
+    #the other slots are untouched:
+    for s, c in tags:
+        assert read(area, c)==chr(65+s%26)*chunk
+    #out of order releases, all the space is merged back into one extent:
+    allocator.release((1, 1000))
+    random.Random(0).shuffle(tags)
+    for s, _ in tags:
+        assert allocator.release((1, s))
+    assert allocator.free_list==[[START, SIZE-START]]
+
+def test_random():
+    _, allocator = make_allocator()
+    rnd = random.Random(0)
+    live = []
+    for i in range(5000):
+        if live and (rnd.random()<0.5 or len(live)>20):
+            allocator.release(live.pop(rnd.randint(0, len(live)-1)))
+        else:
+            tag = (2, i)
+            chunks, _ = allocator.write("a"*rnd.randint(1, 8192), tag)
+            if chunks:
+                live.append(tag)
+    for tag in live:
+        allocator.release(tag)
+    assert allocator.free_list==[[START, SIZE-START]]
+
+def test_threads():
+    #concurrent writers must not corrupt each other's slots:
+    area, allocator = make_allocator()
+    errors = []
+    def writer(wid):
+        for i in range(200):
+            data = chr(48+wid)*(100+wid*10)
+            chunks, _ = allocator.write(data, (wid, i))
+            if chunks is None:
+                continue
+            if read(area, chunks)!=data:
+                errors.append((wid, i))
+            allocator.release((wid, i))
+    threads = [threading.Thread(target=writer, args=(x,)) for x in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, "corrupted slots: %s" % errors
+
+
+def main():
+    test_write_release()
+    test_stale_tag()
+    test_full_and_wrap_around()
+    test_random()
+    test_threads()
+    print("MmapAllocator tests passed")
+
+
+if __name__ == "__main__":
+    main()
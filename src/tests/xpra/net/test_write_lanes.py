@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import socket
+import threading
+from xpra.net.write_lanes import WriteLanes, get_packet_lane, REALTIME, NORMAL, BULK
+
+
+def test_priority():
+    lanes = WriteLanes(2)
+    lanes.put("draw1", BULK)
+    lanes.put("draw2", BULK)
+    lanes.put("metadata", NORMAL)
+    lanes.put("ping", REALTIME)
+    order = [lanes.get() for _ in range(4)]
+    assert order==["ping", "metadata", "draw1", "draw2"], "unexpected order: %s" % order
+    assert lanes.empty()
+
+def test_blocking_put():
+    lanes = WriteLanes(1)
+    lanes.put("draw1", BULK)
+    #the bulk lane is full, so this must block until we get() something:
+    t = threading.Thread(target=lanes.put, args=("draw2", BULK))
+    t.start()
+    t.join(0.2)
+    assert t.isAlive()
+    #other lanes are not affected:
+    lanes.put("cursor", REALTIME)
+    assert lanes.get()=="cursor"
+    assert lanes.get()=="draw1"
+    t.join(1)
+    assert not t.isAlive()
+    assert lanes.get()=="draw2"
+
+def test_try_put():
+    lanes = WriteLanes(1)
+    assert lanes.try_put("draw1", BULK)
+    #the bulk lane is full, but the other lanes are not:
+    assert not lanes.try_put("draw2", BULK)
+    assert lanes.try_put("metadata", NORMAL)
+    assert lanes.get()=="metadata"
+    assert lanes.get()=="draw1"
+    assert lanes.try_put("draw2", BULK)
+
+def test_lane_bytes():
+    lanes = WriteLanes(4, 1000)
+    #small items fill the lane up to 'lane_size':
+    for i in range(4):
+        assert lanes.try_put("cursor%s" % i, REALTIME, 100)
+    assert not lanes.try_put("cursor4", REALTIME, 100)
+    #a large item always fits in an empty lane, but nothing else does after it:
+    assert lanes.try_put("draw1", BULK, 5000)
+    assert not lanes.try_put("draw2", BULK, 10)
+    assert lanes.get_size()==5400
+    for _ in range(5):
+        lanes.get()
+    assert lanes.get_size()==0
+    assert lanes.try_put("draw2", BULK, 10)
+
+def test_coalesce():
+    from xpra.net.bytestreams import SocketConnection
+    from xpra.net.protocol import Protocol
+    a, b = socket.socketpair()
+    conn = SocketConnection(a, "sender", "receiver", "receiver", "test")
+    proto = Protocol(object(), conn, None, None)
+    proto.enable_bencode()
+    proto.set_compression_level(0)
+    #a burst of small packets is queued before the write thread gets to it:
+    for i in range(10):
+        proto._add_packet_to_queue(["pointer-position", 1, (i, i), [], []])
+    assert proto.output_packetcount==10
+    proto._write()
+    #and it is written out in one go:
+    assert proto._write_queue.empty()
+    assert proto.output_raw_packetcount<10, "%s writes for 10 packets" % proto.output_raw_packetcount
+    assert conn.output_bytecount==len(b.recv(65536))
+    a.close()
+    b.close()
+
+class SlowConnection(object):
+    """ only writes 16KB at a time """
+
+    def __init__(self):
+        self.output_bytecount = 0
+
+    def writev(self, buffers):
+        written = min(16*1024, sum([len(b) for b in buffers]))
+        self.output_bytecount += written
+        return written
+
+    def get_send_queue_size(self):
+        return 0
+
+def test_start_callbacks():
+    from xpra.net.protocol import Protocol, WRITE_COALESCE_SIZE
+    conn = SlowConnection()
+    proto = Protocol(object(), conn, None, None)
+    events = []
+    def item(name, size):
+        def start_cb(pos):
+            events.append(("start", name, pos, conn.output_bytecount))
+        def end_cb(pos):
+            events.append(("end", name, pos, conn.output_bytecount))
+        return ("x"*size, start_cb, end_cb)
+    large = 4*WRITE_COALESCE_SIZE
+    proto.write_items([item("large", large), item("small1", 100), item("empty", 0), item("small2", 100)])
+    starts = dict([(name, (pos, written)) for event, name, pos, written in events if event=="start"])
+    assert starts["large"]==(0, 0)
+    #the small items are only started once we get near the end of the large one:
+    for name in ("small1", "small2"):
+        pos, written = starts[name]
+        assert written>=large-WRITE_COALESCE_SIZE, "%s started after %s bytes" % (name, written)
+    assert starts["small1"][0]==large and starts["empty"][0]==starts["small2"][0]==large+100
+    #each item starts before it ends:
+    order = [(event, name) for event, name, _, _ in events]
+    for name in ("large", "small1", "empty", "small2"):
+        assert order.index(("start", name))<order.index(("end", name))
+    assert conn.output_bytecount==large+200
+
+def test_packet_lanes():
+    assert get_packet_lane("ping_echo")==REALTIME
+    assert get_packet_lane("draw")==BULK
+    assert get_packet_lane("window-metadata")==NORMAL
+
+def test_stats():
+    lanes = WriteLanes(1)
+    lanes.put("ping", REALTIME)
+    lanes.get()
+    info = {}
+    lanes.add_stats(info, "net.output.")
+    print("stats=%s" % info)
+    assert info["net.output.lane.realtime.queued"]==1
+    assert info["net.output.lane.bulk.depth"]==0
+
+
+def main():
+    test_priority()
+    test_blocking_put()
+    test_try_put()
+    test_lane_bytes()
+    test_coalesce()
+    test_start_callbacks()
+    test_packet_lanes()
+    test_stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import time
+import threading
+from xpra.server.frame_cache import EncodedFrameCache
+
+
+def make_encoder(data, delay=0):
+    calls = []
+    def encode():
+        calls.append(time.time())
+        if delay>0:
+            time.sleep(delay)
+        return ("png", data, {}, 10, 10, 40, 24)
+    return encode, calls
+
+def test_hit():
+    cache = EncodedFrameCache(max_size=1024, ttl=10)
+    encode, calls = make_encoder("x"*100)
+    v1 = cache.get_or_encode("key", encode)
+    v2 = cache.get_or_encode("key", encode)
+    assert v1==v2 and len(calls)==1
+    assert cache.hits==1 and cache.misses==1 and cache.bytes_saved==100
+    #another key is encoded separately:
+    cache.get_or_encode("other", encode)
+    assert len(calls)==2
+
+def test_concurrent_encode():
+    #clients encoding the same frame at the same time only compress it once:
+    cache = EncodedFrameCache(max_size=1024, ttl=10)
+    encode, calls = make_encoder("y"*100, delay=0.1)
+    results = []
+    def run():
+        results.append(cache.get_or_encode("key", encode))
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls)==1, "encoded %s times" % len(calls)
+    assert len(results)==4 and len([x for x in results if x is results[0]])==4
+
+def test_failed_encode():
+    cache = EncodedFrameCache(max_size=1024, ttl=10)
+    assert cache.get_or_encode("key", lambda : None) is None
+    #failures are not cached:
+    assert len(cache.entries)==0
+    encode, calls = make_encoder("z"*10)
+    assert cache.get_or_encode("key", encode)[1]=="z"*10
+    assert len(calls)==1
+
+def test_size_limit():
+    cache = EncodedFrameCache(max_size=250, ttl=10)
+    for i in range(5):
+        encode, _ = make_encoder("a"*100)
+        cache.get_or_encode(i, encode)
+    #the oldest frames are dropped first:
+    assert sorted(cache.entries.keys())==[3, 4]
+    assert cache.size==200
+
+def test_expiry():
+    cache = EncodedFrameCache(max_size=1024, ttl=0.05)
+    encode, calls = make_encoder("b"*10)
+    cache.get_or_encode("key", encode)
+    time.sleep(0.1)
+    cache.get_or_encode("key", encode)
+    assert len(calls)==2, "expired frame was re-used"
+
+def test_users():
+    cache = EncodedFrameCache(max_size=1024, ttl=10)
+    assert not cache.is_active()
+    cache.add_user()
+    cache.add_user()
+    assert cache.is_active()
+    encode, _ = make_encoder("c"*10)
+    cache.get_or_encode("key", encode)
+    #only one client left, nothing to share:
+    cache.remove_user()
+    assert not cache.is_active()
+    assert len(cache.entries)==0 and cache.size==0
+
+
+def main():
+    test_hit()
+    test_concurrent_encode()
+    test_failed_encode()
+    test_size_limit()
+    test_expiry()
+    test_users()
+    print("EncodedFrameCache tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import random
+import time
+from xpra.server import pyregion
+from xpra.server import region as default_region
+
+
+def covered(rectangles):
+    pixels = set()
+    for r in rectangles:
+        for x in range(r.x, r.x+r.width):
+            for y in range(r.y, r.y+r.height):
+                pixels.add((x, y))
+    return pixels
+
+def test_operations(module, count=200):
+    rnd = random.Random(0)
+    for _ in range(count):
+        region = module.new_region()
+        expected = set()
+        for _ in range(rnd.randint(1, 15)):
+            x, y, w, h = rnd.randint(0, 40), rnd.randint(0, 40), rnd.randint(1, 20), rnd.randint(1, 20)
+            pixels = covered([module.rectangle(x, y, w, h)])
+            if rnd.random()<0.7:
+                module.add_rectangle(region, x, y, w, h)
+                expected |= pixels
+            else:
+                module.subtract_rectangle(region, x, y, w, h)
+                expected -= pixels
+        rects = module.get_rectangles(region)
+        #no overlaps and the exact same pixels:
+        assert sum([r.width*r.height for r in rects])==len(expected)
+        assert covered(rects)==expected
+        module.merge_rectangles(region, 50)
+        rects = module.get_rectangles(region)
+        pixels = covered(rects)
+        assert sum([r.width*r.height for r in rects])==len(pixels)
+        assert expected.issubset(pixels)
+    print("%s: %s random regions verified" % (module.__name__, count))
+
+def test_merge_speed(module, count=300):
+    rnd = random.Random(0)
+    region = module.new_region()
+    for _ in range(count):
+        module.add_rectangle(region, rnd.randint(0, 1900), rnd.randint(0, 1000), rnd.randint(1, 50), rnd.randint(1, 20))
+    before = len(module.get_rectangles(region))
+    start = time.time()
+    module.merge_rectangles(region, 1024)
+    end = time.time()
+    print("%s: merged %s rectangles into %s in %.1fms" % (module.__name__, before, len(module.get_rectangles(region)), 1000.0*(end-start)))
+
+
+def main():
+    modules = [pyregion]
+    if default_region.has_cyregion:
+        from xpra.server import cyregion
+        modules.append(cyregion)
+    for m in modules:
+        test_operations(m)
+        test_merge_speed(m)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import random
+from xpra.server.scroll_detect import detect_scroll, ScrollStats, MAX_MISSES, PROBE_INTERVAL, BAND_MERGE_GAP
+
+
+def make_rows(count, rnd):
+    return [rnd.getrandbits(32) for _ in range(count)]
+
+def apply_scroll(old, new, scroll):
+    """ does what the client does: copies the rows, then paints the bands """
+    dy, copies, bands = scroll
+    result = list(old)
+    for start, end in copies:
+        for i in range(start, end):
+            result[i] = old[i-dy]
+    for start, end in bands:
+        for i in range(start, end):
+            result[i] = new[i]
+    return result
+
+def test_scroll_down_and_up():
+    rnd = random.Random(0)
+    old = make_rows(200, rnd)
+    for dy in (-30, -1, 1, 17, 50):
+        if dy>0:
+            new = make_rows(dy, rnd) + old[:-dy]
+        else:
+            new = old[-dy:] + make_rows(-dy, rnd)
+        scroll = detect_scroll(old, new)
+        assert scroll, "scroll by %s not detected" % dy
+        assert scroll[0]==dy, "expected dy=%s but got %s" % (dy, scroll[0])
+        assert apply_scroll(old, new, scroll)==new
+        #the new rows are sent as a single band:
+        assert len(scroll[2])==1 and scroll[2][0][1]-scroll[2][0][0]==abs(dy)
+
+def test_no_scroll():
+    rnd = random.Random(1)
+    old = make_rows(100, rnd)
+    assert detect_scroll(old, list(old)) is None
+    assert detect_scroll(old, make_rows(100, rnd)) is None
+    #different heights or not enough rows:
+    assert detect_scroll(old, old[:50]) is None
+    assert detect_scroll(old[:1], old[:1]) is None
+    #not enough of the rows moved by the same offset:
+    new = old[:10] + make_rows(90, rnd)
+    new[50:60] = old[40:50]
+    assert detect_scroll(old, new) is None
+
+def test_unknown_and_repeated_rows():
+    rnd = random.Random(2)
+    old = make_rows(100, rnd)
+    #blank lines are repeated too often to tell us anything:
+    old[20:40] = [0]*20
+    new = old[10:] + make_rows(10, rnd)
+    #rows we know nothing about:
+    for i in range(60, 70):
+        old[i] = None
+    scroll = detect_scroll(old, new)
+    assert scroll and scroll[0]==-10
+    assert apply_scroll(old, new, scroll)==new
+
+def test_band_merge():
+    rnd = random.Random(3)
+    old = make_rows(200, rnd)
+    new = old[5:] + make_rows(5, rnd)
+    #two changed rows close together are sent as one band:
+    new[100] = 1
+    new[100+BAND_MERGE_GAP-1] = 2
+    scroll = detect_scroll(old, new)
+    assert scroll and scroll[0]==-5
+    assert (100, 100+BAND_MERGE_GAP) in scroll[2], "bands: %s" % (scroll[2],)
+    assert apply_scroll(old, new, scroll)==new
+
+def test_stats():
+    stats = ScrollStats()
+    for _ in range(MAX_MISSES):
+        assert stats.should_checksum()
+        stats.record(None)
+    #no scrolling found: only probe now and again
+    results = [stats.should_checksum() for _ in range(PROBE_INTERVAL*2)]
+    assert results.count(True)==4, "%s" % results
+    stats.record((1, [(1, 10)], []))
+    assert stats.should_checksum()
+    info = {}
+    stats.add_stats(info)
+    assert info["detected"]==1 and info["skipped_updates"]==PROBE_INTERVAL*2-4
+
+
+def main():
+    test_scroll_down_and_up()
+    test_no_scroll()
+    test_unknown_and_repeated_rows()
+    test_band_merge()
+    test_stats()
+    print("scroll detection tests passed")
+
+
+if __name__ == "__main__":
+    main()
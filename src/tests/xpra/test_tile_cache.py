@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+from xpra.server import tile_cache
+from xpra.server.tile_cache import TileChecksumCache, get_tile_checksums, PROBE_INTERVAL
+
+
+class FakeImage(object):
+
+    def __init__(self, x, y, w, h, pixels, rowstride, pixel_format="BGRX"):
+        self.geometry = (x, y, w, h, 32)
+        self.pixels = pixels
+        self.rowstride = rowstride
+        self.pixel_format = pixel_format
+
+    def get_geometry(self):
+        return self.geometry
+
+    def get_pixels(self):
+        return self.pixels
+
+    def get_rowstride(self):
+        return self.rowstride
+
+    def get_pixel_format(self):
+        return self.pixel_format
+
+
+def make_image(x, y, w, h, pixels=None):
+    rowstride = w*4+16
+    pixels = pixels or os.urandom(rowstride*h)
+    return FakeImage(x, y, w, h, pixels, rowstride)
+
+def modify(image, px, py):
+    """ returns a copy of the image with the pixel at px, py (window coordinates) changed """
+    x, y = image.geometry[:2]
+    data = bytearray(image.pixels)
+    data[(py-y)*image.rowstride+(px-x)*4] ^= 0xff
+    return FakeImage(x, y, image.geometry[2], image.geometry[3], str(data), image.rowstride)
+
+def check_geometry(tiles, x, y, w, h, tile_size):
+    pixels = 0
+    for (col, row), (tx, ty, tw, th, _) in tiles.items():
+        #each tile is the part of the grid cell covered by the image:
+        assert tx==max(x, col*tile_size) and ty==max(y, row*tile_size)
+        assert tx+tw==min(x+w, (col+1)*tile_size) and ty+th==min(y+h, (row+1)*tile_size)
+        pixels += tw*th
+    assert pixels==w*h
+
+def test_checksums(implementations):
+    for impl in implementations:
+        tile_cache.tile_checksums = impl
+        for x, y, w, h in ((0, 0, 256, 128), (10, 70, 100, 33), (63, 63, 2, 2), (100, 5, 1, 1)):
+            image = make_image(x, y, w, h)
+            tiles = get_tile_checksums(image, 64)
+            check_geometry(tiles, x, y, w, h, 64)
+            #the same pixels give the same checksums:
+            assert get_tile_checksums(make_image(x, y, w, h, image.pixels), 64)==tiles
+            #only the tile containing the modified pixel changes:
+            px, py = x+w-1, y+h//2
+            changed = get_tile_checksums(modify(image, px, py), 64)
+            diff = [k for k in tiles.keys() if tiles[k]!=changed[k]]
+            assert diff==[(px//64, py//64)], "expected tile %s to change, got %s" % ((px//64, py//64), diff)
+    print("tile checksums verified with %s" % (implementations, ))
+
+def test_cache():
+    cache = TileChecksumCache(tile_size=64)
+    image = make_image(0, 0, 256, 128)
+    tiles = get_tile_checksums(image, 64)
+    #nothing sent yet:
+    assert sorted(cache.get_changed(tiles))==sorted(tiles.keys())
+    cache.update(tiles)
+    assert cache.get_changed(tiles)==[]
+    changed = get_tile_checksums(modify(image, 130, 10), 64)
+    assert cache.get_changed(changed)==[(2, 0)]
+    #the client may have lost its copy of those tiles:
+    cache.invalidate(60, 60, 10, 10)
+    assert sorted(cache.get_changed(tiles))==[(0, 0), (0, 1), (1, 0), (1, 1)]
+    cache.clear()
+    assert len(cache.get_changed(tiles))==len(tiles)
+
+def test_max_tiles():
+    cache = TileChecksumCache(tile_size=64, max_tiles=10)
+    tiles = get_tile_checksums(make_image(0, 0, 256, 128), 64)
+    cache.update(tiles)
+    assert len(cache.tiles)==8
+    #no room for the next 8 tiles, the cache is cleared:
+    cache.update(get_tile_checksums(make_image(0, 128, 256, 128), 64))
+    assert len(cache.tiles)==8
+    assert sorted(cache.get_changed(tiles))==sorted(tiles.keys())
+
+def test_hit_rate():
+    cache = TileChecksumCache(tile_size=64)
+    assert cache.get_hit_rate()==100
+    #a video: the tiles always change
+    for _ in range(2):
+        assert cache.should_checksum()
+        tiles = get_tile_checksums(make_image(0, 0, 128, 128), 64)
+        cache.get_changed(tiles)
+        cache.update(tiles)
+    assert cache.get_hit_rate()==0
+    #we only probe two updates in a row now and again:
+    results = [cache.should_checksum() for _ in range(PROBE_INTERVAL*2)]
+    assert results.count(True)==4, "%s" % results
+    assert cache.skipped_updates==PROBE_INTERVAL*2-4
+    #static content again: the probes find unchanged tiles and we start checking again
+    static = get_tile_checksums(make_image(0, 0, 128, 128), 64)
+    for _ in range(2):
+        cache.get_changed(static)
+        cache.update(static)
+    assert cache.get_hit_rate()>=tile_cache.MIN_HIT_RATE
+    assert cache.should_checksum()
+
+
+def main():
+    implementations = [None]
+    if tile_cache.tile_checksums:
+        implementations.append(tile_cache.tile_checksums)
+    try:
+        test_checksums(implementations)
+        test_cache()
+        test_max_tiles()
+        test_hit_rate()
+    finally:
+        tile_cache.tile_checksums = implementations[-1]
+    print("TileChecksumCache tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,7 +16,7 @@ from xpra.log import Logger
 log = Logger()
 
 from xpra.net.protocol import Protocol, use_lz4, use_rencode, get_network_caps
-from xpra.scripts.config import ENCRYPTION_CIPHERS
+from xpra.scripts.config import ENCRYPTION_CIPHERS, parse_bandwidth_limit
 from xpra.version_util import version_compat_check, add_version_info, get_platform_info
 from xpra.platform.features import GOT_PASSWORD_PROMPT_SUGGESTION
 from xpra.platform.info import get_name
@@ -57,6 +57,8 @@ class XpraClientBase(object):
     def __init__(self):
         self.exit_code = None
         self.compression_level = 0
+        self.fixed_compression = False
+        self.bandwidth_limit = 0
         self.display = None
         self.username = None
         self.password_file = None
@@ -89,6 +91,7 @@ class XpraClientBase(object):
 
     def init(self, opts):
         self.compression_level = opts.compression_level
+        self.fixed_compression = opts.fixed_compression
         self.display = opts.display
         self.username = opts.username
         self.password_file = opts.password_file
@@ -98,6 +101,7 @@ class XpraClientBase(object):
         self.min_quality = opts.min_quality
         self.speed = opts.speed
         self.min_speed = opts.min_speed
+        self.bandwidth_limit = parse_bandwidth_limit(opts.bandwidth_limit)
 
     def timeout_add(self, *args):
         raise Exception("override me!")
@@ -138,6 +142,8 @@ class XpraClientBase(object):
         self._protocol.large_packets.append("keymap-changed")
         self._protocol.large_packets.append("server-settings")
         self._protocol.set_compression_level(self.compression_level)
+        #unless the user chose the level, let the adaptive compression choose:
+        self._protocol.fixed_compression = self.fixed_compression
         self._protocol.receive_aliases.update(self._aliases)
         self.have_more = self._protocol.source_has_more
 
@@ -197,6 +203,8 @@ class XpraClientBase(object):
                 "client_type"           : self.client_type(),
                 "python.version"        : sys.version_info[:3],
                 "compression_level"     : self.compression_level,
+                "compression_level.fixed" : self.fixed_compression,
+                "bandwidth-limit"       : self.bandwidth_limit,
                 })
         if self.display:
             capabilities["display"] = self.display
@@ -432,8 +440,12 @@ class XpraClientBase(object):
         self._protocol.chunked_compression = c.boolget("chunked_compression")
         if use_rencode and c.boolget("rencode"):
             self._protocol.enable_rencode()
-        if use_lz4 and c.boolget("lz4") and self._protocol.chunked_compression and self.compression_level==1:
+        self._protocol.peer_lz4 = use_lz4 and c.boolget("lz4") and self._protocol.chunked_compression
+        self._protocol.set_peer_dictionaries(c.dictget("zlib.dictionaries"))
+        if self._protocol.peer_lz4 and self.compression_level==1:
             self._protocol.enable_lz4()
+        if self.bandwidth_limit>0:
+            self._protocol.set_bandwidth_limit(self.bandwidth_limit//8)
         if self.encryption:
             #server uses a new cipher after second hello:
             key = self.get_encryption_key()
@@ -38,7 +38,7 @@ from OpenGL.GL import GL_PROJECTION, GL_MODELVIEW, \
     glGenTextures, glDisable, \
     glBindTexture, glPixelStorei, glEnable, glBegin, glFlush, \
     glTexParameteri, \
-    glTexImage2D, \
+    glTexImage2D, glCopyTexImage2D, \
     glMultiTexCoord2i, \
     glTexCoord2i, glVertex2i, glEnd, \
     glClear, glClearColor
@@ -127,6 +127,7 @@ The use of a intermediate framebuffer object is the only way to guarantee that t
 window image, which is critical because of backbuffer content losses upon buffer swaps or offscreen window movement.
 """
 class GLPixmapBacking(GTK2WindowBacking):
+    RGB_FORMATS = ("RGB", "BGR", "RGBA", "BGRA", "RGBX", "BGRX")
 
     def __init__(self, wid, w, h, has_alpha):
         GTK2WindowBacking.__init__(self, wid, w, h, has_alpha)
@@ -480,6 +481,39 @@ class GLPixmapBacking(GTK2WindowBacking):
             drawable.gl_end()
         return True
 
+    def _do_paint_scroll(self, scrolls):
+        drawable = self.gl_init()
+        if not drawable:
+            debug("%s._do_paint_scroll(..) drawable is not set!", self)
+            return False
+        try:
+            self.set_rgb_paint_state()
+            _, h = self.size
+            glBindTexture(GL_TEXTURE_RECTANGLE_ARB, self.textures[TEX_RGB])
+            for x, y, width, height, dx, dy in scrolls:
+                self.gl_marker("scroll %s,%s %sx%s by %s,%s" % (x, y, width, height, dx, dy))
+                #copy the area from the FBO to a temporary texture,
+                #the FBO is upside down (see the projection in gl_init):
+                glCopyTexImage2D(GL_TEXTURE_RECTANGLE_ARB, 0, self.texture_pixel_format, x, h-y-height, width, height, 0)
+                glTexParameteri(GL_TEXTURE_RECTANGLE_ARB, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+                glTexParameteri(GL_TEXTURE_RECTANGLE_ARB, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+                #and draw it back at the new position, flipped:
+                tx, ty = x+dx, y+dy
+                glBegin(GL_QUADS)
+                glTexCoord2i(0, height)
+                glVertex2i(tx, ty)
+                glTexCoord2i(0, 0)
+                glVertex2i(tx, ty+height)
+                glTexCoord2i(width, 0)
+                glVertex2i(tx+width, ty+height)
+                glTexCoord2i(width, height)
+                glVertex2i(tx+width, ty)
+                glEnd()
+            self.present_fbo(drawable)
+        finally:
+            drawable.gl_end()
+        return True
+
     def do_video_paint(self, img, x, y, enc_width, enc_height, width, height, options, callbacks):
         img.clone_pixel_data()
         gobject.idle_add(self.gl_paint_planar, img, x, y, enc_width, enc_height, width, height, callbacks)
@@ -513,7 +547,7 @@ class GLPixmapBacking(GTK2WindowBacking):
             fire_paint_callbacks(callbacks, False)
 
     def update_planar_textures(self, x, y, width, height, img, pixel_format, scaling=False):
-        assert x==0 and y==0
+        #the textures hold the video frame only, its position is applied by render_planar_update
         assert self.textures is not None, "no OpenGL textures!"
         debug("%s.update_planar_textures%s", self, (x, y, width, height, img, pixel_format))
 
@@ -553,7 +587,7 @@ class GLPixmapBacking(GTK2WindowBacking):
             glPixelStorei(GL_UNPACK_ROW_LENGTH, rowstrides[index])
             pixel_data = img_data[index]
             debug("texture %s: div=%s, rowstride=%s, %sx%s, data=%s bytes", index, divs[index], rowstrides[index], width/div_w, height/div_h, len(pixel_data))
-            glTexSubImage2D(GL_TEXTURE_RECTANGLE_ARB, 0, x, y, width/div_w, height/div_h, GL_LUMINANCE, GL_UNSIGNED_BYTE, pixel_data)
+            glTexSubImage2D(GL_TEXTURE_RECTANGLE_ARB, 0, 0, 0, width/div_w, height/div_h, GL_LUMINANCE, GL_UNSIGNED_BYTE, pixel_data)
             if index == 1:
                 U_width = width/div_w
                 U_height = height/div_h
@@ -568,7 +602,6 @@ class GLPixmapBacking(GTK2WindowBacking):
         if self.pixel_format not in ("YUV420P", "YUV422P", "YUV444P", "GBRP"):
             #not ready to render yet
             return
-        assert rx==0 and ry==0
         if self.pixel_format == "GBRP":
             self.set_rgbP_paint_state()
         self.gl_marker("painting planar update, format %s" % self.pixel_format)
@@ -581,13 +614,14 @@ class GLPixmapBacking(GTK2WindowBacking):
         tw, th = self.texture_size
         debug("%s.render_planar_update(..) texture_size=%s, size=%s", self, self.texture_size, self.size)
         glBegin(GL_QUADS)
-        for x,y in ((rx, ry), (rx, ry+rh), (rx+rw, ry+rh), (rx+rw, ry)):
+        #the texture coordinates are relative to the video frame, which we paint at rx, ry:
+        for x,y in ((0, 0), (0, rh), (rw, rh), (rw, 0)):
             ax = min(tw, x)
             ay = min(th, y)
             for texture, index in ((GL_TEXTURE0, 0), (GL_TEXTURE1, 1), (GL_TEXTURE2, 2)):
                 (div_w, div_h) = divs[index]
                 glMultiTexCoord2i(texture, ax/div_w, ay/div_h)
-            glVertex2i(int(ax*x_scale), int(ay*y_scale))
+            glVertex2i(rx+int(ax*x_scale), ry+int(ay*y_scale))
         glEnd()
         if self.pixel_format == "GBRP":
             self.unset_rgbP_paint_state()
@@ -23,6 +23,7 @@ UI_watcher = get_UI_watcher(gobject.timeout_add)
 
 from xpra.gtk_common.gtk2common import gtk2main
 from xpra.client.gtk_base.gtk_client_base import GTKXpraClient, xor_str
+from xpra.codecs.delta_cache import DELTA_CACHE_SIZE, DELTA_CACHE_SLOTS
 from xpra.client.gtk2.tray_menu import GTK2TrayMenu
 from xpra.gtk_common.cursor_names import cursor_names
 from xpra.log import Logger
@@ -235,6 +236,10 @@ class XpraClient(GTKXpraClient):
         capabilities = GTKXpraClient.make_hello(self)
         if xor_str is not None:
             capabilities["encoding.supports_delta"] = [x for x in ("png", "rgb24", "rgb32") if x in self.get_core_encodings()]
+            capabilities["encoding.delta_cache_size"] = DELTA_CACHE_SIZE
+            capabilities["encoding.delta_cache_slots"] = DELTA_CACHE_SLOTS
+        #all our backings can copy areas of the window:
+        capabilities["encoding.scrolling"] = True
         return capabilities
 
     def process_ui_capabilities(self, capabilities):
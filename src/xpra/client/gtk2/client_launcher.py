@@ -72,6 +72,7 @@ class ApplicationWindow:
         self.config_keys = set(["username", "password", "host", "port", "mode",
                                 "encoding", "quality", "min-quality", "speed", "min-speed"])
         self.config.client_toolkit = "gtk2"
+        self.config.fixed_compression = False
         self.client = make_client(Exception, self.config)
         self.exit_code = None
 
@@ -84,3 +84,12 @@ class PixmapBacking(GTK2WindowBacking):
         cr.set_operator(cairo.OPERATOR_SOURCE)
         cr.paint()
         return True
+
+    def _do_paint_scroll(self, scrolls):
+        if self._backing is None:
+            return False
+        gc = self._backing.new_gc()
+        for x, y, w, h, dx, dy in scrolls:
+            #the X server deals with overlapping areas:
+            self._backing.draw_drawable(gc, self._backing, x, y, x+dx, y+dy, w, h)
+        return True
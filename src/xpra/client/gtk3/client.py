@@ -4,6 +4,7 @@
 # later version. See the file COPYING for details.
 
 from xpra.client.gtk_base.gtk_client_base import GTKXpraClient, xor_str
+from xpra.codecs.delta_cache import DELTA_CACHE_SIZE, DELTA_CACHE_SLOTS
 
 from gi.repository import GObject               #@UnresolvedImport
 from gi.repository import Gtk                   #@UnresolvedImport
@@ -30,6 +31,10 @@ class XpraClient(GTKXpraClient):
         capabilities = GTKXpraClient.make_hello(self)
         if xor_str is not None:
             capabilities["encoding.supports_delta"] = [x for x in ("rgb24", "rgb32") if x in self.get_core_encodings()]
+            capabilities["encoding.delta_cache_size"] = DELTA_CACHE_SIZE
+            capabilities["encoding.delta_cache_slots"] = DELTA_CACHE_SLOTS
+        #all our backings can copy areas of the window:
+        capabilities["encoding.scrolling"] = True
         return capabilities
 
     def client_type(self):
@@ -101,6 +101,24 @@ class CairoBacking(GTKWindowBacking):
         self.do_paint_png(img_data, x, y, width, height, rowstride, options, callbacks)
         return  False
 
+    def _do_paint_scroll(self, scrolls):
+        if self._backing is None:
+            return False
+        gc = cairo.Context(self._backing)
+        gc.set_operator(cairo.OPERATOR_SOURCE)
+        for x, y, w, h, dx, dy in scrolls:
+            #copy via a temporary surface since the areas may overlap:
+            tmp = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
+            tgc = cairo.Context(tmp)
+            tgc.set_operator(cairo.OPERATOR_SOURCE)
+            tgc.set_source_surface(self._backing, -x, -y)
+            tgc.paint()
+            gc.set_source_surface(tmp, x+dx, y+dy)
+            gc.rectangle(x+dx, y+dy, w, h)
+            gc.fill()
+            tmp.finish()
+        return True
+
 
     def cairo_draw(self, context):
         if self._backing is None:
@@ -653,6 +653,8 @@ class UIXpraClient(XpraClientBase):
         if self.mmap_enabled:
             capabilities["mmap_file"] = self.mmap_filename
             capabilities["mmap_token"] = self.mmap_token
+            #we acknowledge every draw packet once painted, so the server can re-use its mmap slot:
+            capabilities["mmap_slots"] = True
         #don't try to find the server uuid if this platform cannot run servers..
         #(doing so causes lockups on win32 and startup errors on osx)
         if MMAP_SUPPORTED:
@@ -684,6 +686,7 @@ class UIXpraClient(XpraClientBase):
             #TODO: check for csc support (swscale only?)
             "encoding.video_reinit"     : True,
             "encoding.video_scaling"    : True,
+            "encoding.video_subregion"  : True,
             "encoding.rgb_lz4"          : use_lz4 and self.compression_level==1,
             "encoding.transparency"     : self.has_transparency(),
             #TODO: check for csc support (swscale only?)
@@ -1115,9 +1118,11 @@ class UIXpraClient(XpraClientBase):
             self.show_session_info(*args)
         elif command=="enable_zlib":
             log.info("switching to zlib on server request")
+            self._protocol.fixed_compression = True
             self._protocol.enable_zlib()
         elif command=="enable_lz4":
             log.info("switching to lz4 on server request")
+            self._protocol.fixed_compression = True
             self._protocol.enable_lz4()
         elif command=="enable_bencode":
             log.info("switching to bencode on server request")
@@ -1375,11 +1380,13 @@ class UIXpraClient(XpraClientBase):
 
     def set_deflate_level(self, level):
         self.compression_level = level
+        self.fixed_compression = True
         self.send_deflate_level()
 
     def send_deflate_level(self):
         self._protocol.set_compression_level(self.compression_level)
-        self.send("set_deflate", self.compression_level)
+        self._protocol.fixed_compression = self.fixed_compression
+        self.send("set_deflate", self.compression_level, self.fixed_compression)
 
 
     def _process_clipboard_enabled_status(self, packet):
@@ -1532,6 +1539,7 @@ class UIXpraClient(XpraClientBase):
                         data_start.value = offset+length
                     #clear the mmap area via idle_add so any pending draw requests
                     #will get a chance to run first (preserving the order)
+                    self.idle_add(free_mmap_area)
                 self.send_damage_sequence(wid, packet_sequence, width, height, -1)
             self.idle_add(draw_cleanup)
             return
@@ -13,11 +13,17 @@ log = Logger()
 
 from threading import Lock
 from xpra.codecs.xor import xor_str
+from xpra.codecs.delta_cache import DeltaCache
 from xpra.net.mmap_pipe import mmap_read
 from xpra.net.protocol import has_lz4, LZ4_uncompress
 from xpra.os_util import BytesIOClass, bytestostr
 from xpra.codecs.codec_constants import get_colorspace_from_avutil_enum
 from xpra.codecs.loader import get_codec
+try:
+    from xpra.codecs.argb.convert import convert as rgb_convert    #@UnresolvedImport
+except Exception, e:
+    log("cannot load pixel format conversion module: %s", e)
+    rgb_convert = None
 
 
 #logging in the draw path is expensive:
@@ -82,6 +88,9 @@ Generic superclass for all Backing code,
 see CairoBacking and GTKWindowBacking for actual implementations
 """
 class WindowBackingBase(object):
+    #the rgb formats we can paint without converting them first:
+    RGB_FORMATS = ("RGB", "RGBA")
+
     def __init__(self, wid, idle_add):
         load_csc_options()
         load_video_decoders()
@@ -89,7 +98,7 @@ class WindowBackingBase(object):
         self.idle_add = idle_add
         self._has_alpha = False
         self._backing = None
-        self._last_pixmap_data = None
+        self._delta_cache = DeltaCache()
         self._video_decoder = None
         self._csc_prep = None
         self._csc_decoder = None
@@ -157,15 +166,19 @@ class WindowBackingBase(object):
         delta = options.get("delta", -1)
         rgb_data = img_data
         if delta>=0:
-            if not self._last_pixmap_data:
+            lpd = self._delta_cache.get(delta)
+            if lpd is None:
                 raise Exception("delta region references pixmap data we do not have!")
-            lwidth, lheight, store, ldata = self._last_pixmap_data
-            assert width==lwidth and height==lheight and delta==store
+            lwidth, lheight, ldata = lpd
+            assert width==lwidth and height==lheight
             rgb_data = xor_str(img_data, ldata)
+        #drop the slots the server no longer uses:
+        for store in options.get("evict", []):
+            self._delta_cache.remove(store)
         #store new pixels for next delta:
         store = options.get("store", -1)
         if store>=0:
-            self._last_pixmap_data =  width, height, store, rgb_data
+            self._delta_cache.add(store, (width, height, rgb_data), len(rgb_data))
         return rgb_data
 
 
@@ -215,11 +228,26 @@ class WindowBackingBase(object):
         self.idle_add(paint_rgb, pixels, x, y, width, height, rowstride, options, callbacks)
         return  False
 
+    def convert_rgb(self, img_data, width, height, rowstride, options, target_format):
+        """
+            Converts the pixels to target_format if this backing cannot paint
+            the rgb format the server used, returns the pixels and the rowstride.
+        """
+        rgb_format = (options or {}).get("rgb_format")
+        if not rgb_format or rgb_format in self.RGB_FORMATS or rgb_convert is None:
+            return img_data, rowstride
+        if DRAW_DEBUG:
+            log.info("convert_rgb(%s bytes, %s, %s, %s, %s, %s)", len(img_data), width, height, rowstride, rgb_format, target_format)
+        img_data, rowstride = rgb_convert(img_data, width, height, rowstride, rgb_format, target_format)
+        options["rgb_format"] = target_format
+        return img_data, rowstride
+
     def paint_rgb24(self, raw_data, x, y, width, height, rowstride, options, callbacks):
         """ called from non-UI thread
             this method calls process_delta before calling do_paint_rgb24 from the UI thread via idle_add
         """
         rgb24_data = self.process_delta(raw_data, width, height, rowstride, options)
+        rgb24_data, rowstride = self.convert_rgb(rgb24_data, width, height, rowstride, options, "RGB")
         self.idle_add(self.do_paint_rgb24, rgb24_data, x, y, width, height, rowstride, options, callbacks)
         return  False
 
@@ -246,6 +274,7 @@ class WindowBackingBase(object):
             this method calls process_delta before calling do_paint_rgb32 from the UI thread via idle_add
         """
         rgb32_data = self.process_delta(raw_data, width, height, rowstride, options)
+        rgb32_data, rowstride = self.convert_rgb(rgb32_data, width, height, rowstride, options, "RGBA")
         self.idle_add(self.do_paint_rgb32, rgb32_data, x, y, width, height, rowstride, options, callbacks)
         return  False
 
@@ -295,7 +324,7 @@ class WindowBackingBase(object):
         raise Exception("no csc module found for %s(%sx%s) to %s(%sx%s) in %s" % (src_format, src_width, src_height, " or ".join(dst_format_options), dst_width, dst_height, CSC_OPTIONS))
 
     def paint_with_video_decoder(self, decoder_name, coding, img_data, x, y, width, height, options, callbacks):
-        assert x==0 and y==0
+        #x and y may be non-zero when the server only encodes a part of the window as video
         decoder_module = get_codec(decoder_name)
         assert decoder_module, "decoder module not found for %s" % decoder_name
         assert hasattr(decoder_module, "Decoder"), "decoder module %s does not have 'Decoder' factory function!" % decoder_module
@@ -447,16 +476,43 @@ class WindowBackingBase(object):
         assert self.mmap_enabled
         data = mmap_read(self.mmap, img_data)
         rgb_format = options.get("rgb_format", "rgb24")
-        #Note: BGR(A) is only handled by gl_window_backing
+        #Note: BGR(A) is only handled natively by gl_window_backing
         if rgb_format in ("RGB", "BGR"):
+            data, rowstride = self.convert_rgb(data, width, height, rowstride, options, "RGB")
             self.do_paint_rgb24(data, x, y, width, height, rowstride, options, callbacks)
         elif rgb_format in ("RGBA", "BGRA"):
+            data, rowstride = self.convert_rgb(data, width, height, rowstride, options, "RGBA")
             self.do_paint_rgb32(data, x, y, width, height, rowstride, options, callbacks)
         else:
             raise Exception("invalid rgb format: %s" % rgb_format)
         return  False
 
 
+    def paint_scroll(self, img_data, options, callbacks):
+        """ called from non-UI thread
+            img_data is a list of (x, y, width, height, dx, dy) areas to move,
+            which must be applied in the order given
+        """
+        self.idle_add(self.do_paint_scroll, img_data, callbacks)
+
+    def do_paint_scroll(self, scrolls, callbacks):
+        """ must be called from UI thread
+            this method is only here to ensure that we always fire the callbacks,
+            the actual paint code is in _do_paint_scroll
+        """
+        try:
+            success = self._do_paint_scroll(scrolls)
+            fire_paint_callbacks(callbacks, success)
+        except KeyboardInterrupt:
+            raise
+        except:
+            log.error("do_paint_scroll error", exc_info=True)
+            fire_paint_callbacks(callbacks, False)
+
+    def _do_paint_scroll(self, scrolls):
+        raise Exception("override me!")
+
+
     def draw_region(self, x, y, width, height, coding, img_data, rowstride, options, callbacks):
         """ dispatches the paint to one of the paint_XXXX methods """
         if DRAW_DEBUG:
@@ -479,5 +535,7 @@ class WindowBackingBase(object):
             self.paint_webp(img_data, x, y, width, height, options, callbacks)
         elif coding[:3]=="png" or coding=="jpeg":
             self.paint_image(coding, img_data, x, y, width, height, options, callbacks)
+        elif coding == "scroll":
+            self.paint_scroll(img_data, options, callbacks)
         else:
             raise Exception("invalid encoding: %s" % coding)
@@ -0,0 +1,121 @@
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Pixel checksums for the tile cache and the scroll detection:
+# hashes 8 bytes at a time with the GIL released,
+# this is an order of magnitude faster than calling zlib.crc32 for each row (of each tile).
+# The values are only compared with other values from this module.
+
+cdef extern from "stdlib.h":
+    void* malloc(size_t __size)
+    void free(void* mem)
+
+cdef extern from "string.h":
+    void* memcpy(void *dest, const void *src, size_t n) nogil
+
+cdef extern from "Python.h":
+    ctypedef int Py_ssize_t
+    int PyObject_AsReadBuffer(object obj,
+                              void ** buffer,
+                              Py_ssize_t * buffer_len) except -1
+
+ctypedef unsigned long long uint64
+
+cdef uint64 SEED = 14695981039346656037ULL
+cdef uint64 PRIME = 1099511628211ULL
+
+
+cdef inline uint64 mix(uint64 h, uint64 v) nogil:
+    h = (h ^ v) * PRIME
+    return h ^ (h >> 29)
+
+cdef inline uint64 hash_bytes(const unsigned char *buf, int size, uint64 h) nogil:
+    cdef uint64 v0, v1, v2, v3
+    cdef uint64 h1, h2, h3
+    cdef int i = 0
+    if size>=32:
+        #4 independent lanes, so the multiplications can run in parallel:
+        h1 = h ^ 1
+        h2 = h ^ 2
+        h3 = h ^ 3
+        while i+32<=size:
+            #memcpy avoids unaligned reads, the compiler turns it into a single load:
+            memcpy(&v0, buf+i, 8)
+            memcpy(&v1, buf+i+8, 8)
+            memcpy(&v2, buf+i+16, 8)
+            memcpy(&v3, buf+i+24, 8)
+            h = mix(h, v0)
+            h1 = mix(h1, v1)
+            h2 = mix(h2, v2)
+            h3 = mix(h3, v3)
+            i += 32
+        h = mix(mix(mix(h, h1), h2), h3)
+    while i+8<=size:
+        memcpy(&v0, buf+i, 8)
+        h = mix(h, v0)
+        i += 8
+    while i<size:
+        h = mix(h, buf[i])
+        i += 1
+    return h
+
+
+def tile_checksums(pixels, int rowstride, int Bpp, int ix, int iy, int iw, int ih, int tile_size):
+    """ see xpra.server.tile_cache.get_tile_checksums """
+    cdef const unsigned char *buf = <unsigned char *> 0
+    cdef Py_ssize_t buf_len = 0
+    assert PyObject_AsReadBuffer(pixels, <const void**> &buf, &buf_len)==0
+    assert iw>0 and ih>0 and tile_size>0
+    assert (ih-1)*rowstride+iw*Bpp<=buf_len, "pixel buffer is too small: %s bytes for %sx%s with rowstride=%s" % (buf_len, iw, ih, rowstride)
+    cdef int col0 = ix//tile_size
+    cdef int ncols = (ix+iw-1)//tile_size-col0+1
+    cdef uint64 *hashes = <uint64 *> malloc(ncols*sizeof(uint64))
+    cdef int *offsets = <int *> malloc((ncols+1)*sizeof(int))
+    cdef const unsigned char *line
+    cdef int row, y, y1, y2, c, x1, x2
+    tiles = {}
+    try:
+        #the byte offset of each tile column within a row, the last one is the end of the row:
+        for c in range(ncols):
+            offsets[c] = (max(ix, (col0+c)*tile_size)-ix)*Bpp
+        offsets[ncols] = iw*Bpp
+        for row in range(iy//tile_size, (iy+ih-1)//tile_size+1):
+            y1 = max(iy, row*tile_size)
+            y2 = min(iy+ih, (row+1)*tile_size)
+            with nogil:
+                for c in range(ncols):
+                    hashes[c] = SEED
+                #go through the pixels in memory order:
+                for y in range(y1, y2):
+                    line = buf + (y-iy)*rowstride
+                    for c in range(ncols):
+                        hashes[c] = hash_bytes(line+offsets[c], offsets[c+1]-offsets[c], hashes[c])
+            for c in range(ncols):
+                x1 = ix+offsets[c]//Bpp
+                x2 = ix+offsets[c+1]//Bpp
+                tiles[(col0+c, row)] = (x1, y1, x2-x1, y2-y1, hashes[c])
+        return tiles
+    finally:
+        free(offsets)
+        free(hashes)
+
+
+def row_checksums(pixels, int rowstride, int width, int height):
+    """ see xpra.server.scroll_detect.get_row_checksums, the width is in bytes """
+    cdef const unsigned char *buf = <unsigned char *> 0
+    cdef Py_ssize_t buf_len = 0
+    assert PyObject_AsReadBuffer(pixels, <const void**> &buf, &buf_len)==0
+    if height<=0:
+        return []
+    assert (height-1)*rowstride+width<=buf_len, "pixel buffer is too small: %s bytes for %s rows of %s bytes with rowstride=%s" % (buf_len, height, width, rowstride)
+    cdef uint64 *hashes = <uint64 *> malloc(height*sizeof(uint64))
+    cdef int y
+    try:
+        with nogil:
+            for y in range(height):
+                hashes[y] = hash_bytes(buf + y*rowstride, width, SEED)
+        return [hashes[y] for y in range(height)]
+    finally:
+        free(hashes)
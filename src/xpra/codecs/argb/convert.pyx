@@ -0,0 +1,231 @@
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Pixel format conversion engine:
+# converts between the packed RGB formats we use (with or without alpha, in any byte order),
+# honouring the rowstride of the source and destination,
+# writing into a buffer the caller may re-use,
+# and splitting large images across worker threads (the GIL is released whilst converting).
+
+import os
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_CONVERT_DEBUG")
+
+from xpra.os_util import Queue
+from xpra.daemon_thread import make_daemon_thread
+
+
+cdef extern from "Python.h":
+    ctypedef int Py_ssize_t
+    int PyObject_AsWriteBuffer(object obj,
+                               void ** buffer,
+                               Py_ssize_t * buffer_len) except -1
+    int PyObject_AsReadBuffer(object obj,
+                              void ** buffer,
+                              Py_ssize_t * buffer_len) except -1
+
+
+def get_default_threads():
+    try:
+        import multiprocessing
+        cpus = multiprocessing.cpu_count()
+    except:
+        cpus = 1
+    return max(1, min(4, cpus))
+
+CONVERT_THREADS = int(os.environ.get("XPRA_CONVERT_THREADS", get_default_threads()))
+#images smaller than this are converted in the calling thread:
+THREADED_MIN_PIXELS = int(os.environ.get("XPRA_CONVERT_THREADED_MIN_PIXELS", 512*1024))
+
+FORMATS = ("RGB", "BGR", "RGBA", "BGRA", "ARGB", "ABGR", "RGBX", "BGRX", "XRGB", "XBGR")
+
+DEF MAX_BPP = 4
+
+
+def get_channel_map(src_format, dst_format):
+    """
+        For each byte of the destination pixels,
+        returns the index of the source byte to copy, or -1 to fill with 0xff.
+        The padding byte 'X' is never used as alpha.
+    """
+    assert src_format in FORMATS, "unsupported source format %s" % src_format
+    assert dst_format in FORMATS, "unsupported destination format %s" % dst_format
+    cmap = []
+    for c in dst_format:
+        if c=="X":
+            #copy the alpha or padding byte if there is one:
+            i = max(src_format.find("A"), src_format.find("X"))
+        else:
+            i = src_format.find(c)
+        cmap.append(i)
+    return cmap
+
+def can_convert(src_format, dst_format):
+    return src_format in FORMATS and dst_format in FORMATS
+
+
+cdef void convert_rows(const unsigned char *src, int src_stride, int src_Bpp,
+                       unsigned char *dst, int dst_stride, int dst_Bpp,
+                       int width, int start, int end, int *cmap) nogil:
+    cdef const unsigned char *s
+    cdef unsigned char *d
+    cdef int x, y, c
+    cdef int c0 = cmap[0]
+    cdef int c1 = cmap[1]
+    cdef int c2 = cmap[2]
+    cdef int c3 = -1
+    if dst_Bpp==4:
+        c3 = cmap[3]
+    if c0<0 or c1<0 or c2<0:
+        #generic version, for destinations with the alpha channel first:
+        for y in range(start, end):
+            s = src + y*src_stride
+            d = dst + y*dst_stride
+            for x in range(width):
+                for c in range(dst_Bpp):
+                    if cmap[c]<0:
+                        d[c] = 0xff
+                    else:
+                        d[c] = s[cmap[c]]
+                s += src_Bpp
+                d += dst_Bpp
+        return
+    for y in range(start, end):
+        s = src + y*src_stride
+        d = dst + y*dst_stride
+        if dst_Bpp==3:
+            for x in range(width):
+                d[0] = s[c0]
+                d[1] = s[c1]
+                d[2] = s[c2]
+                s += src_Bpp
+                d += 3
+        elif c3<0:
+            #no alpha in the source:
+            for x in range(width):
+                d[0] = s[c0]
+                d[1] = s[c1]
+                d[2] = s[c2]
+                d[3] = 0xff
+                s += src_Bpp
+                d += 4
+        else:
+            for x in range(width):
+                d[0] = s[c0]
+                d[1] = s[c1]
+                d[2] = s[c2]
+                d[3] = s[c3]
+                s += src_Bpp
+                d += 4
+
+
+cdef class ConversionJob:
+    """ the arguments of convert_rows, held as integers so a worker thread can run it """
+    cdef size_t src
+    cdef int src_stride
+    cdef int src_Bpp
+    cdef size_t dst
+    cdef int dst_stride
+    cdef int dst_Bpp
+    cdef int width
+    cdef int cmap[MAX_BPP]
+
+    def run(self, int start, int end):
+        cdef const unsigned char *src = <const unsigned char *> self.src
+        cdef unsigned char *dst = <unsigned char *> self.dst
+        with nogil:
+            convert_rows(src, self.src_stride, self.src_Bpp, dst, self.dst_stride, self.dst_Bpp,
+                         self.width, start, end, self.cmap)
+
+
+workers = []
+work_queue = Queue()
+
+def conversion_worker():
+    while True:
+        item = work_queue.get(True)
+        if item is None:
+            break
+        job, start, end, done = item
+        try:
+            job.run(start, end)
+            done.put(True)
+        except Exception, e:
+            log.error("conversion worker error: %s", e, exc_info=True)
+            done.put(False)
+
+def start_workers(n):
+    while len(workers)<n:
+        t = make_daemon_thread(conversion_worker, "convert-%s" % len(workers))
+        workers.append(t)
+        t.start()
+
+
+def convert(pixels, int width, int height, int rowstride, src_format, dst_format, out=None, int dst_rowstride=0, int threads=-1):
+    """
+        Converts the pixels from src_format to dst_format,
+        writing them to 'out' if specified (which must be a writeable buffer large enough),
+        or to a new bytearray.
+        Returns the output buffer and the destination rowstride.
+    """
+    cdef int src_Bpp = len(src_format)
+    cdef int dst_Bpp = len(dst_format)
+    cmap = get_channel_map(src_format, dst_format)
+    if dst_rowstride<=0:
+        dst_rowstride = width*dst_Bpp
+    assert rowstride>=width*src_Bpp, "invalid rowstride %s for %s pixels of %s" % (rowstride, width, src_format)
+    assert dst_rowstride>=width*dst_Bpp, "invalid destination rowstride %s for %s pixels of %s" % (dst_rowstride, width, dst_format)
+    cdef Py_ssize_t size = dst_rowstride*height
+    if out is None:
+        out = bytearray(size)
+    cdef const unsigned char *src_buf = NULL
+    cdef Py_ssize_t src_len = 0
+    assert PyObject_AsReadBuffer(pixels, <const void**> &src_buf, &src_len)==0
+    #the last row may not be padded:
+    assert src_len>=rowstride*(height-1)+width*src_Bpp, "source buffer is too small: %s bytes for %sx%s %s with rowstride=%s" % (src_len, width, height, src_format, rowstride)
+    cdef unsigned char *dst_buf = NULL
+    cdef Py_ssize_t dst_len = 0
+    assert PyObject_AsWriteBuffer(out, <void**> &dst_buf, &dst_len)==0
+    assert dst_len>=size, "output buffer is too small: %s bytes, we need %s" % (dst_len, size)
+    if height<=0 or width<=0:
+        return out, dst_rowstride
+    cdef ConversionJob job = ConversionJob()
+    job.src = <size_t> src_buf
+    job.src_stride = rowstride
+    job.src_Bpp = src_Bpp
+    job.dst = <size_t> dst_buf
+    job.dst_stride = dst_rowstride
+    job.dst_Bpp = dst_Bpp
+    job.width = width
+    cdef int i
+    for i in range(dst_Bpp):
+        job.cmap[i] = cmap[i]
+    if threads<0:
+        threads = CONVERT_THREADS
+    if width*height<THREADED_MIN_PIXELS:
+        threads = 1
+    threads = max(1, min(threads, height))
+    if threads==1:
+        job.run(0, height)
+        return out, dst_rowstride
+    #split the rows, the calling thread converts the first chunk:
+    start_workers(threads-1)
+    done = Queue()
+    cdef int chunk = (height+threads-1)//threads
+    for i in range(1, threads):
+        end = min(height, (i+1)*chunk)
+        if i*chunk<end:
+            work_queue.put((job, i*chunk, end, done))
+        else:
+            done.put(True)
+    job.run(0, min(height, chunk))
+    ok = True
+    for i in range(1, threads):
+        ok = done.get(True) and ok
+    assert ok, "conversion failed"
+    debug("convert(%s bytes, %s, %s, %s, %s, %s) done using %s threads", len(pixels), width, height, rowstride, src_format, dst_format, threads)
+    return out, dst_rowstride
@@ -0,0 +1,162 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+A process wide pool of pixel buffers (bytearrays),
+so the images we copy or convert for every damage region can re-use
+the memory of the previous frames instead of allocating new buffers every time.
+The buffers are grouped in buckets of similar sizes (at most 1/16th larger than requested),
+the ones which have not been used for a while are freed,
+and we never keep more than the maximum size.
+The buffers returned may be larger than the size requested,
+so the users must only use the first 'size' bytes (ie: via a buffer view).
+"""
+
+import os
+import time
+from threading import Lock, RLock
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_BUFFER_POOL_DEBUG")
+
+#maximum size of the idle buffers we keep (in MB), 0 to disable the pool:
+BUFFER_POOL_SIZE = int(os.environ.get("XPRA_BUFFER_POOL_SIZE", "64"))*1024*1024
+#buffers which have not been used for this long (in seconds) are freed:
+BUFFER_POOL_IDLE = float(os.environ.get("XPRA_BUFFER_POOL_IDLE", "10"))
+#the smallest bucket:
+MIN_BUFFER_SIZE = 4096
+
+
+def get_bucket_size(size):
+    """
+        Rounds up the size so we only use 16 buckets per power of two,
+        ie: a 1920x1080 BGRX frame (8294400 bytes) uses the 8388608 bytes bucket.
+    """
+    if size<=MIN_BUFFER_SIZE:
+        return MIN_BUFFER_SIZE
+    granularity = 1<<(size.bit_length()-5)
+    return (size+granularity-1)//granularity*granularity
+
+
+class BufferPool(object):
+
+    def __init__(self, max_size=BUFFER_POOL_SIZE, idle_timeout=BUFFER_POOL_IDLE):
+        #re-entrant since buffers may be released from __del__ whilst we hold the lock:
+        self.lock = RLock()
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.buckets = {}           #bucket size -> [(buffer, time released), ..]
+        self.size = 0
+        self.last_expire = 0
+        self.hits = 0
+        self.misses = 0
+        self.released = 0
+        self.dropped = 0
+        self.expired = 0
+
+    def __len__(self):
+        return sum(len(x) for x in self.buckets.values())
+
+    def get(self, size):
+        """ returns a bytearray of at least 'size' bytes, its contents are undefined """
+        bsize = get_bucket_size(size)
+        self.lock.acquire()
+        try:
+            bucket = self.buckets.get(bsize)
+            if bucket:
+                #the most recently released buffer is the most likely to still be in the CPU cache:
+                buf = bucket.pop()[0]
+                self.size -= bsize
+                self.hits += 1
+                return buf
+            self.misses += 1
+        finally:
+            self.lock.release()
+        return bytearray(bsize)
+
+    def copy(self, pixels):
+        """ returns a pooled buffer containing a copy of the pixels, and the number of bytes copied """
+        size = len(pixels)
+        buf = self.get(size)
+        buf[0:size] = pixels
+        return buf, size
+
+    def release(self, buf):
+        """ gives the buffer back to the pool, the caller must not use it (or views of it) afterwards """
+        bsize = len(buf)
+        if type(buf)!=bytearray or bsize!=get_bucket_size(bsize):
+            #not one of ours
+            return
+        now = time.time()
+        self.lock.acquire()
+        try:
+            self.released += 1
+            if now-self.last_expire>=1:
+                self.expire(now)
+            if self.size+bsize>self.max_size:
+                self.dropped += 1
+                return
+            self.buckets.setdefault(bsize, []).append((buf, now))
+            self.size += bsize
+        finally:
+            self.lock.release()
+
+    def expire(self, now):
+        self.last_expire = now
+        limit = now-self.idle_timeout
+        for bsize, bucket in list(self.buckets.items()):
+            #buffers are in release order, so the idle ones are first:
+            n = 0
+            while n<len(bucket) and bucket[n][1]<limit:
+                n += 1
+            if n>0:
+                del bucket[:n]
+                self.size -= n*bsize
+                self.expired += n
+                debug("BufferPool.expire() freed %s buffers of %s bytes", n, bsize)
+            if not bucket:
+                del self.buckets[bsize]
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.buckets = {}
+            self.size = 0
+        finally:
+            self.lock.release()
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"buffers" + suffix] = len(self)
+        info[prefix+"buckets" + suffix] = len(self.buckets)
+        info[prefix+"size" + suffix] = self.size
+        info[prefix+"max_size" + suffix] = self.max_size
+        info[prefix+"idle_timeout" + suffix] = self.idle_timeout
+        info[prefix+"hits" + suffix] = self.hits
+        info[prefix+"misses" + suffix] = self.misses
+        info[prefix+"released" + suffix] = self.released
+        info[prefix+"dropped" + suffix] = self.dropped
+        info[prefix+"expired" + suffix] = self.expired
+        lookups = self.hits+self.misses
+        if lookups>0:
+            info[prefix+"hit_rate" + suffix] = int(100*self.hits/lookups)
+
+
+#only one pool per process:
+singleton = None
+lock = Lock()
+
+def get_buffer_pool():
+    global singleton
+    if singleton is not None:
+        return singleton
+    lock.acquire()
+    try:
+        if singleton is None:
+            singleton = BufferPool()
+        return singleton
+    finally:
+        lock.release()
@@ -0,0 +1,118 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+The pixel data stored for xor delta encoding.
+The server keeps one slot per geometry and encoding so that regions which alternate
+(ie: a status bar and a text area) can each be xored with their own previous frame,
+the client keeps the same slots keyed on the store sequence number.
+The least recently used slots are evicted when we exceed the size budget (in bytes)
+or the maximum number of slots, the server tells the client which slots it evicts.
+"""
+
+import os
+from threading import Lock
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_DELTA_DEBUG")
+
+#the budget the client advertises and the server honours (per window):
+DELTA_CACHE_SIZE = int(os.environ.get("XPRA_DELTA_CACHE_SIZE", str(1024*1024)))
+DELTA_CACHE_SLOTS = int(os.environ.get("XPRA_DELTA_CACHE_SLOTS", "16"))
+
+
+class DeltaCache(object):
+
+    def __init__(self, max_size=DELTA_CACHE_SIZE, max_slots=DELTA_CACHE_SLOTS):
+        self.lock = Lock()
+        self.max_size = max_size
+        self.max_slots = max_slots
+        self.slots = {}             #key -> [last used counter, size, value]
+        self.size = 0
+        self.counter = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.slots = {}
+            self.size = 0
+        finally:
+            self.lock.release()
+
+    def get(self, key):
+        """ returns the value stored for this key (or None) and marks it as recently used """
+        self.lock.acquire()
+        try:
+            slot = self.slots.get(key)
+            if slot is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.counter += 1
+            slot[0] = self.counter
+            return slot[2]
+        finally:
+            self.lock.release()
+
+    def add(self, key, value, size):
+        """
+            Stores the value, replacing the one with the same key,
+            returns the list of (key, value) which have been removed or evicted.
+        """
+        removed = []
+        self.lock.acquire()
+        try:
+            old = self.slots.get(key)
+            if old is not None:
+                del self.slots[key]
+                self.size -= old[1]
+                removed.append((key, old[2]))
+            if size>self.max_size or self.max_slots<=0:
+                return removed
+            #evict the least recently used slots until the new one fits:
+            while self.slots and (self.size+size>self.max_size or len(self.slots)>=self.max_slots):
+                lru = min(self.slots.keys(), key=lambda k : self.slots[k][0])
+                slot = self.slots[lru]
+                del self.slots[lru]
+                self.size -= slot[1]
+                self.evictions += 1
+                removed.append((lru, slot[2]))
+            self.counter += 1
+            self.slots[key] = [self.counter, size, value]
+            self.size += size
+            debug("DeltaCache.add(%s, .., %s) slots=%s, size=%s, removed=%s", key, size, len(self.slots), self.size, [k for k,_ in removed])
+            return removed
+        finally:
+            self.lock.release()
+
+    def remove(self, key):
+        self.lock.acquire()
+        try:
+            slot = self.slots.get(key)
+            if slot is not None:
+                del self.slots[key]
+                self.size -= slot[1]
+        finally:
+            self.lock.release()
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"slots" + suffix] = len(self.slots)
+        info[prefix+"max_slots" + suffix] = self.max_slots
+        info[prefix+"size" + suffix] = self.size
+        info[prefix+"max_size" + suffix] = self.max_size
+        info[prefix+"hits" + suffix] = self.hits
+        info[prefix+"misses" + suffix] = self.misses
+        info[prefix+"evictions" + suffix] = self.evictions
+        lookups = self.hits+self.misses
+        if lookups>0:
+            info[prefix+"hit_rate" + suffix] = int(100*self.hits/lookups)
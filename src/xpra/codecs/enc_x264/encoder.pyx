@@ -344,6 +344,19 @@ cdef class Encoder:
             x264_encoder_close(self.context)
             self.context = NULL
 
+    def restart(self):
+        """
+            Starts a new stream with the same context:
+            the next frame will be an IDR frame (with the stream headers)
+            and the client will see frame=0 so it creates a new decoder.
+        """
+        assert self.context!=NULL, "context is closed!"
+        self.frames = 0
+        self.last_frame_times = maxdeque(200)
+        self.time = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
     def get_client_options(self, options):
         q = options.get("quality", -1)
         if q<0:
@@ -405,6 +418,9 @@ cdef class Encoder:
         pic_in.img.i_csp = self.colorspace
         pic_in.img.i_plane = 3
         pic_in.i_pts = 1
+        if self.frames==0:
+            #first frame of a new stream (see restart):
+            pic_in.i_type = X264_TYPE_IDR
 
         try:
             with nogil:
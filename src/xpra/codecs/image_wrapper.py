@@ -4,6 +4,8 @@
 # Xpra is released under the terms of the GNU GPL v2, or, at your option, any
 # later version. See the file COPYING for details.
 
+from xpra.codecs.buffer_pool import get_buffer_pool
+
 
 class ImageWrapper(object):
 
@@ -26,6 +28,8 @@ class ImageWrapper(object):
         self.rowstride = rowstride
         self.planes = planes
         self.freed = False
+        #the buffers borrowed from the buffer pool, given back when we are freed:
+        self.pool_buffers = []
 
     def __str__(self):
         return "%s(%s:%s:%s)" % (type(self), self.pixel_format, self.get_geometry(), ImageWrapper.PLANE_NAMES.get(self.planes))
@@ -37,7 +41,7 @@ class ImageWrapper(object):
         return self.x
 
     def get_y(self):
-        return self.x
+        return self.y
 
     def get_width(self):
         return self.width
@@ -73,16 +77,24 @@ class ImageWrapper(object):
     def set_pixel_format(self, pixel_format):
         self.pixel_format = pixel_format
 
-    def set_pixels(self, pixels):
+    def set_pixels(self, pixels, pool_buffer=None):
+        """
+            pool_buffer is the buffer pool bytearray backing the pixels (if any),
+            the image takes ownership of it.
+        """
         self.pixels = pixels
+        if pool_buffer is not None:
+            self.pool_buffers.append(pool_buffer)
 
     def clone_pixel_data(self):
         if not self.freed:
             if self.planes == 0:
                 #no planes, simple buffer:
                 assert self.pixels, "no pixels!"
-                self.pixels = self.pixels[:]
+                buf, size = get_buffer_pool().copy(self.pixels)
+                self.set_pixels(buffer(buf, 0, size), buf)
             else:
+                #the planes are uploaded to OpenGL, which expects strings:
                 assert self.planes>0
                 for i in range(self.planes):
                     self.pixels[i] = self.pixels[i][:]
@@ -98,3 +110,38 @@ class ImageWrapper(object):
             self.planes = None
             self.pixels = None
             self.pixel_format = None
+            if self.pool_buffers:
+                pool = get_buffer_pool()
+                for buf in self.pool_buffers:
+                    pool.release(buf)
+                self.pool_buffers = []
+
+
+def get_sub_image(image, x, y, w, h):
+    """
+        Returns a new image with a copy of the pixels of the given area,
+        the coordinates are in the same space as the image's.
+        (only for packed pixel formats)
+        The copy uses a buffer from the buffer pool, so the new image should be freed.
+    """
+    ix, iy, iw = image.get_geometry()[:3]
+    pixels = image.get_pixels()
+    rowstride = image.get_rowstride()
+    pool = get_buffer_pool()
+    if x==ix and w==iw:
+        #full rows, we can keep the same rowstride:
+        start = (y-iy)*rowstride
+        buf, size = pool.copy(buffer(pixels, start, h*rowstride))
+    else:
+        Bpp = len(image.get_pixel_format())
+        row_size = w*Bpp
+        size = row_size*h
+        buf = pool.get(size)
+        offset = (y-iy)*rowstride + (x-ix)*Bpp
+        for i in range(h):
+            buf[i*row_size:(i+1)*row_size] = buffer(pixels, offset, row_size)
+            offset += rowstride
+        rowstride = row_size
+    sub = ImageWrapper(x, y, w, h, None, image.get_pixel_format(), image.get_depth(), rowstride)
+    sub.set_pixels(buffer(buf, 0, size), buf)
+    return sub
@@ -24,6 +24,8 @@ class VideoHelper(object):
         #even when called from multiple threads:
         self._initialized = init
         self._lock = Lock()
+        #incremented whenever the codec specs change:
+        self.generation = 0
 
     def clone(self, deep=False):
         if not self._initialized:
@@ -60,6 +62,9 @@ class VideoHelper(object):
         finally:
             self._lock.release()
 
+    def get_generation(self):
+        return self.generation
+
     def get_encodings(self):
         return self._video_encoder_specs.keys()
 
@@ -110,6 +115,7 @@ class VideoHelper(object):
 
     def add_encoder_spec(self, encoding, colorspace, spec):
         self._video_encoder_specs.setdefault(encoding, {}).setdefault(colorspace, []).append(spec)
+        self.generation += 1
 
 
     def init_csc_options(self):
@@ -160,6 +166,7 @@ class VideoHelper(object):
     def add_csc_spec(self, in_csc, out_csc, spec):
         item = out_csc, spec
         self._csc_encoder_specs.setdefault(in_csc, []).append(item)
+        self.generation += 1
 
 
 instance = VideoHelper()
@@ -214,6 +214,7 @@ def init_module():
 
 cdef class Encoder:
     cdef int frames
+    cdef long long pts
     cdef vpx_codec_ctx_t *context
     cdef vpx_codec_enc_cfg_t *cfg
     cdef vpx_img_fmt_t pixfmt
@@ -231,6 +232,7 @@ cdef class Encoder:
         self.width = width
         self.height = height
         self.frames = 0
+        self.pts = 0
         assert src_format=="YUV420P"
         self.src_format = "YUV420P"
         self.pixfmt = get_vpx_colorspace(self.src_format)
@@ -317,6 +319,16 @@ cdef class Encoder:
             free(self.cfg)
             self.cfg = NULL
 
+    def restart(self):
+        """
+            Starts a new stream with the same context:
+            the next frame will be a key frame
+            and the client will see frame=0 so it creates a new decoder.
+            (the timestamps keep increasing)
+        """
+        assert self.context!=NULL, "context is closed!"
+        self.frames = 0
+
     def compress_image(self, image, options):
         cdef uint8_t *pic_in[3]
         cdef int strides[3]
@@ -364,7 +376,7 @@ cdef class Encoder:
             flags |= VPX_EFLAG_FORCE_KF
         start = time.time()
         with nogil:
-            i = vpx_codec_encode(self.context, image, self.frames, 1, flags, VPX_DL_REALTIME)
+            i = vpx_codec_encode(self.context, image, self.pts, 1, flags, VPX_DL_REALTIME)
         if i!=0:
             free(image)
             log.error("%s codec encoding error: %s", self.encoding, vpx_codec_destroy(self.context))
@@ -379,6 +391,7 @@ cdef class Encoder:
             log.error("%s invalid packet type: %s", self.encoding, get_packet_kind(pkt))
             return None
         self.frames += 1
+        self.pts += 1
         #we copy the compressed data here, we could manage the buffer instead
         #using vpx_codec_set_cx_data_buf every time with a wrapper for freeing it,
         #but since this is compressed data, no big deal
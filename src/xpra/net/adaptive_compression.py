@@ -0,0 +1,167 @@
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+from threading import Lock
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_COMPRESSION_DEBUG")
+
+#try one of the other options every N packets to keep the statistics current:
+EXPLORE_INTERVAL = int(os.environ.get("XPRA_COMPRESSION_EXPLORE_INTERVAL", 20))
+
+NONE = ("none", 0)
+
+
+class CompressorStats(object):
+    """ compression ratio and speed of one compressor option for one packet type """
+
+    def __init__(self):
+        self.count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.elapsed = 0.0
+
+    def record(self, size_in, size_out, elapsed):
+        self.count += 1
+        self.bytes_in += size_in
+        self.bytes_out += size_out
+        self.elapsed += elapsed
+
+    def get_ratio(self):
+        if self.bytes_in==0:
+            return 1.0
+        return float(self.bytes_out)/self.bytes_in
+
+    def get_time_per_byte(self):
+        if self.bytes_in==0:
+            return 0.0
+        return self.elapsed/self.bytes_in
+
+
+class PacketTypeStats(object):
+
+    def __init__(self):
+        self.stats = {}
+        self.count = 0
+        self.choice = None
+
+    def get_stats(self, option):
+        s = self.stats.get(option)
+        if s is None:
+            s = CompressorStats()
+            self.stats[option] = s
+        return s
+
+    def choose(self, options, bandwidth):
+        if bandwidth<=0:
+            #we can't compare the options without the link rate,
+            #keep the current choice (if any)
+            return self.choice
+        self.count += 1
+        #try each option at least once:
+        for o in options:
+            if self.get_stats(o).count==0:
+                return o
+        #estimated cost per byte: compression time plus time on the wire
+        def cost(o):
+            s = self.stats[o]
+            return s.get_time_per_byte() + s.get_ratio()/bandwidth
+        best = min(options, key=cost)
+        if best!=self.choice:
+            debug("compressor changed from %s to %s at %iKB/s", self.choice, best, bandwidth//1024)
+            self.choice = best
+        if EXPLORE_INTERVAL>0 and self.count % EXPLORE_INTERVAL==0:
+            others = [o for o in options if o!=best]
+            if others:
+                return others[(self.count//EXPLORE_INTERVAL) % len(others)]
+        return best
+
+
+class AdaptiveCompression(object):
+    """
+        Keeps compression statistics for each packet type
+        and picks the compressor (none, lz4 or zlib with a given level)
+        which minimizes the time spent compressing plus sending the data,
+        using the link rate supplied by the caller (see SendPacer.get_rate).
+        Until the link rate is known, 'choose' returns None
+        and the caller should use the compression level requested.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.packet_types = {}
+        #the link rate used for the last choice:
+        self.bandwidth = 0
+
+    def get_options(self, level, lz4, dictionary=False):
+        options = [NONE]
+        if lz4:
+            options.append(("lz4", 1))
+        options.append(("zlib", 1))
+        if level>1:
+            options.append(("zlib", level))
+        if dictionary:
+            options.append(("dict", level))
+        return tuple(options)
+
+    def choose(self, packet_type, level, lz4, dictionary=False, bandwidth=0):
+        """
+            bandwidth is the link rate in bytes per second, zero if it is not known yet,
+            returns None if there is no choice to make yet.
+        """
+        options = self.get_options(level, lz4, dictionary)
+        self.lock.acquire()
+        try:
+            if bandwidth>0:
+                self.bandwidth = bandwidth
+            pts = self.packet_types.get(packet_type)
+            if pts is None:
+                pts = PacketTypeStats()
+                self.packet_types[packet_type] = pts
+            choice = pts.choose(options, bandwidth)
+            if choice not in options:
+                #the level or lz4 support may have changed since:
+                return None
+            return choice
+        finally:
+            self.lock.release()
+
+    def record(self, packet_type, option, size_in, size_out, elapsed):
+        self.lock.acquire()
+        try:
+            pts = self.packet_types.get(packet_type)
+            if pts:
+                pts.get_stats(option).record(size_in, size_out, elapsed)
+        finally:
+            self.lock.release()
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"bandwidth" + suffix] = int(self.bandwidth)
+        self.lock.acquire()
+        try:
+            self.do_add_stats(info, prefix, suffix)
+        finally:
+            self.lock.release()
+
+    def do_add_stats(self, info, prefix, suffix):
+        for packet_type, pts in list(self.packet_types.items()):
+            if pts.choice is None:
+                continue
+            p = prefix + str(packet_type) + "."
+            algo, level = pts.choice
+            info[p+"compressor" + suffix] = algo
+            info[p+"level" + suffix] = level
+            stats = list(pts.stats.values())
+            bytes_in = sum([s.bytes_in for s in stats])
+            bytes_out = sum([s.bytes_out for s in stats])
+            info[p+"bytes_in" + suffix] = bytes_in
+            info[p+"bytes_saved" + suffix] = bytes_in-bytes_out
+            info[p+"time_ms" + suffix] = int(1000.0*sum([s.elapsed for s in stats]))
+            for (oalgo, olevel), s in list(pts.stats.items()):
+                if s.count>0:
+                    info[p+"%s%s.ratio_pct" % (oalgo, olevel) + suffix] = int(100.0*s.get_ratio())
+
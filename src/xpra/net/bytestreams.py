@@ -27,6 +27,24 @@ def untilConcludes(is_active_cb, f, *a, **kw):
                 continue
             raise
 
+#gather writes are only available with python 3.3 onwards,
+#older versions will write the buffers one at a time:
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+HAS_WRITEV = hasattr(os, "writev")
+#don't pass more buffers than this to a single gather write:
+IOV_MAX = int(os.environ.get("XPRA_IOV_MAX", 64))
+#without gather writes, small buffers are joined up to this size:
+WRITE_JOIN_SIZE = int(os.environ.get("XPRA_WRITE_JOIN_SIZE", 16*1024))
+
+#the ioctl which returns the number of bytes in a socket's send queue:
+TIOCOUTQ = None
+if sys.platform.startswith("linux"):
+    try:
+        import fcntl, termios, struct
+        TIOCOUTQ = termios.TIOCOUTQ
+    except:
+        pass
+
 
 class Connection(object):
     def __init__(self, target, info):
@@ -48,6 +66,10 @@ class Connection(object):
     def close(self):
         self.set_active(False)
 
+    def get_send_queue_size(self):
+        """ the number of bytes written but not acknowledged yet, or None if unknown """
+        return None
+
     def untilConcludes(self, *args):
         return untilConcludes(self.is_active, *args)
 
@@ -56,6 +78,26 @@ class Connection(object):
         self.output_bytecount += w
         return w
 
+    def writev(self, buffers):
+        """
+            Writes as much as possible from the list of buffers,
+            returns the number of bytes written.
+            This default implementation joins the leading buffers
+            if they are small, or writes just the first buffer,
+            subclasses override it when the platform supports gather writes.
+        """
+        if len(buffers)>1 and len(buffers[0])<WRITE_JOIN_SIZE:
+            join = []
+            size = 0
+            for b in buffers:
+                if size+len(b)>WRITE_JOIN_SIZE:
+                    break
+                join.append(b)
+                size += len(b)
+            if len(join)>1:
+                return self.write(b"".join([memoryview(b).tobytes() for b in join]))
+        return self.write(buffers[0])
+
     def _read(self, *args):
         r = self.untilConcludes(*args)
         self.input_bytecount += len(r or "")
@@ -90,6 +132,12 @@ class TwoFileConnection(Connection):
         self.may_abort("write")
         return self._write(os.write, self._writeable.fileno(), buf)
 
+    def writev(self, buffers):
+        if not HAS_WRITEV or len(buffers)==1:
+            return Connection.writev(self, buffers)
+        self.may_abort("write")
+        return self._write(os.writev, self._writeable.fileno(), buffers[:IOV_MAX])
+
     def close(self):
         Connection.close(self)
         try:
@@ -119,6 +167,23 @@ class SocketConnection(Connection):
     def write(self, buf):
         return self._write(self._socket.send, buf)
 
+    def writev(self, buffers):
+        if not HAS_SENDMSG or len(buffers)==1:
+            return Connection.writev(self, buffers)
+        return self._write(self._socket.sendmsg, buffers[:IOV_MAX])
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def get_send_queue_size(self):
+        if TIOCOUTQ is None:
+            return None
+        try:
+            v = fcntl.ioctl(self._socket.fileno(), TIOCOUTQ, struct.pack("i", 0))
+            return struct.unpack("i", v)[0]
+        except:
+            return None
+
     def close(self):
         Connection.close(self)
         self._socket.close()
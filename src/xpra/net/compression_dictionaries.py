@@ -0,0 +1,178 @@
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Preset dictionaries for compressing small, repetitive control packets with zlib.
+
+The dictionaries are built from typical packets of each type,
+encoded with each packet encoder we have.
+Both ends advance a compressor / decompressor through the dictionary data
+(terminated with a sync flush so the state is byte aligned),
+and each packet is then compressed with a copy of this "primed" state,
+so back-references can point into the dictionary.
+Only the data following the dictionary goes on the wire.
+Peers exchange a checksum for each dictionary and only use the ones which match.
+"""
+
+import zlib
+from threading import Lock
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_COMPRESSION_DEBUG")
+
+
+#the order defines the dictionary ids (1 to 15, sent in the compression level byte)
+SAMPLE_PACKETS = (
+    ("cursor",  (
+        ["cursor", 512, 384, 24, 24, 12, 12, 1055, "", "xterm"],
+        ["cursor", 1024, 768, 32, 32, 6, 2, 1056, "", "left_ptr"],
+        ["cursor", ""],
+        )),
+    ("window-metadata", (
+        ["window-metadata", 1, {"title" : "user@host: ~/projects"}],
+        ["window-metadata", 2, {"icon-title" : "Terminal", "class-instance" : ["gnome-terminal", "Gnome-terminal"]}],
+        ["window-metadata", 3, {"size-constraints" : {"minimum-size" : (200, 100), "maximum-size" : (4096, 4096), "base-size" : (19, 4), "increment" : (8, 17)}}],
+        ["window-metadata", 4, {"window-type" : ["_NET_WM_WINDOW_TYPE_NORMAL"], "transient-for" : 1, "modal" : False}],
+        ["window-metadata", 5, {"pid" : 12345, "xid" : "0x2400007", "client-machine" : "localhost", "role" : "browser"}],
+        ["window-metadata", 6, {"group-leader-xid" : "0x2400001", "group-leader-wid" : 1, "fullscreen" : False, "maximized" : True, "has-alpha" : False}],
+        )),
+    ("configure-override-redirect", (
+        ["configure-override-redirect", 7, 100, 200, 300, 24],
+        ["configure-override-redirect", 8, 1280, 0, 640, 480],
+        )),
+    ("pointer-position", (
+        ["pointer-position", 1, (640, 480), ["mod2"], []],
+        ["pointer-position", 2, (1020, 31), ["shift", "mod2"], [1]],
+        )),
+    ("damage-sequence", (
+        ["damage-sequence", 1001, 1, 640, 480, 1500],
+        ["damage-sequence", 1002, 2, 1920, 1080, 25000],
+        )),
+    ("ping", (
+        ["ping", 1386248315281],
+        ["ping_echo", 1386248315281, 120, 95, 80, 12],
+        )),
+    ("key-action", (
+        ["key-action", 1, "Return", True, ["mod2"], 65293, "\r", 36, 0],
+        ["key-action", 1, "a", False, ["shift", "mod2"], 97, "a", 38, 0],
+        )),
+    ("button-action", (
+        ["button-action", 1, 1, True, (640, 480), ["mod2"]],
+        ["button-action", 2, 4, False, (12, 1000), ["control"]],
+        )),
+    )
+#packet types sharing a dictionary:
+DICTIONARY_ALIASES = {"ping_echo" : "ping"}
+#compressing packets smaller than this isn't worth it, even with a dictionary:
+DICTIONARY_MIN_SIZE = 32
+
+
+def get_encoders():
+    encoders = []
+    try:
+        from xpra.net.bencode import bencode
+        encoders.append(bencode)
+    except Exception, e:
+        debug("bencode not available for compression dictionaries: %s", e)
+    try:
+        from xpra.net.rencode import dumps
+        encoders.append(dumps)
+    except Exception, e:
+        debug("rencode not available for compression dictionaries: %s", e)
+    return encoders
+
+def build_dictionaries():
+    """ returns a dictionary of packet type -> (id, dictionary data) """
+    encoders = get_encoders()
+    dictionaries = {}
+    i = 1
+    for packet_type, packets in SAMPLE_PACKETS:
+        data = []
+        for encode in encoders:
+            for packet in packets:
+                try:
+                    data.append(encode(packet))
+                except Exception, e:
+                    debug("failed to encode sample packet %s with %s: %s", packet, encode, e)
+        if data:
+            dictionaries[packet_type] = (i, "".join(data))
+        i += 1
+    return dictionaries
+
+
+class CompressionDictionaries(object):
+    """ primed compressors and decompressors for each dictionary """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.dictionaries = build_dictionaries()
+        self.by_id = dict([(i, data) for i, data in self.dictionaries.values()])
+        self.compressors = {}
+        self.decompressors = {}
+
+    def get_caps(self):
+        caps = {}
+        for packet_type, (i, data) in self.dictionaries.items():
+            caps[packet_type] = [i, zlib.adler32(data) & 0xffffffff]
+        return caps
+
+    def get_matching(self, remote_caps):
+        """ returns the dictionary ids we can use for sending each packet type """
+        matching = {}
+        local_caps = self.get_caps()
+        for packet_type, v in (remote_caps or {}).items():
+            if local_caps.get(packet_type)==list(v):
+                matching[packet_type] = v[0]
+        for alias, packet_type in DICTIONARY_ALIASES.items():
+            if packet_type in matching:
+                matching[alias] = matching[packet_type]
+        return matching
+
+    def compress(self, dictionary_id, data, level):
+        key = (dictionary_id, level)
+        primed = self.compressors.get(key)
+        if primed is None:
+            self.lock.acquire()
+            try:
+                dictionary = self.by_id[dictionary_id]
+                #use the smallest window which holds the dictionary,
+                #this makes copying the compressor state much cheaper:
+                wbits = 9
+                while (1<<wbits)-262<len(dictionary) and wbits<zlib.MAX_WBITS:
+                    wbits += 1
+                primed = zlib.compressobj(level, zlib.DEFLATED, wbits, 4)
+                primed.compress(dictionary)
+                primed.flush(zlib.Z_SYNC_FLUSH)
+                self.compressors[key] = primed
+            finally:
+                self.lock.release()
+        c = primed.copy()
+        return c.compress(data) + c.flush()
+
+    def decompress(self, dictionary_id, data):
+        primed = self.decompressors.get(dictionary_id)
+        if primed is None:
+            dictionary = self.by_id.get(dictionary_id)
+            assert dictionary is not None, "unknown compression dictionary %s" % dictionary_id
+            self.lock.acquire()
+            try:
+                c = zlib.compressobj(1)
+                prefix = c.compress(dictionary) + c.flush(zlib.Z_SYNC_FLUSH)
+                primed = zlib.decompressobj()
+                primed.decompress(prefix)
+                self.decompressors[dictionary_id] = primed
+            finally:
+                self.lock.release()
+        d = primed.copy()
+        return d.decompress(data)
+
+
+singleton = None
+def get_compression_dictionaries():
+    global singleton
+    if singleton is None:
+        singleton = CompressionDictionaries()
+    return singleton
@@ -0,0 +1,143 @@
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import struct
+import zlib
+from threading import Lock, Event
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_NETWORK_DEBUG")
+from xpra.os_util import Queue
+from xpra.daemon_thread import make_daemon_thread
+
+#number of compression threads (zero disables the pool):
+COMPRESSION_THREADS = int(os.environ.get("XPRA_COMPRESSION_THREADS", "0"))
+#only split buffers larger than this into blocks:
+PARALLEL_MIN_SIZE = int(os.environ.get("XPRA_PARALLEL_COMPRESSION_SIZE", 256*1024))
+BLOCK_SIZE = int(os.environ.get("XPRA_COMPRESSION_BLOCK_SIZE", 128*1024))
+
+
+class CompressionTask(object):
+    """ the result of a function call made from one of the pool threads """
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.result = None
+        self.exception = None
+        self.done = Event()
+
+    def run(self):
+        try:
+            self.result = self.fn(*self.args)
+        except Exception, e:
+            self.exception = e
+        self.done.set()
+
+    def get(self):
+        self.done.wait()
+        if self.exception:
+            raise self.exception
+        return self.result
+
+
+class CompressionPool(object):
+    """
+        Threads used for compressing data in parallel,
+        zlib releases the GIL whilst compressing so this scales with the number of cores.
+    """
+
+    def __init__(self, nthreads):
+        self.tasks = Queue()
+        self.threads = []
+        for i in range(nthreads):
+            t = make_daemon_thread(self.run, "compress-%s" % i)
+            self.threads.append(t)
+            t.start()
+
+    def __str__(self):
+        return "CompressionPool(%s)" % len(self.threads)
+
+    def stop(self):
+        for _ in self.threads:
+            self.tasks.put(None)
+        self.threads = []
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            task.run()
+
+    def submit(self, fn, *args):
+        task = CompressionTask(fn, args)
+        self.tasks.put(task)
+        return task
+
+    def zcompress(self, data, level):
+        """
+            Same as zlib.compress but large buffers are split into blocks
+            which are deflated in parallel.
+            Each block ends on a byte boundary (Z_SYNC_FLUSH) so the raw streams
+            can be concatenated and wrapped into a regular zlib stream,
+            which the other end decompresses as usual.
+        """
+        size = len(data)
+        if size<PARALLEL_MIN_SIZE or len(self.threads)<2:
+            return zlib.compress(data, level)
+        tasks = []
+        for start in range(0, size, BLOCK_SIZE):
+            last = start+BLOCK_SIZE>=size
+            tasks.append(self.submit(deflate_block, data[start:start+BLOCK_SIZE], level, last))
+        #adler32 of the whole buffer is needed for the zlib trailer:
+        checksum = zlib.adler32(data) & 0xffffffff
+        blocks = [task.get() for task in tasks]
+        return "".join([zlib_header(level)] + blocks + [struct.pack("!L", checksum)])
+
+
+def deflate_block(data, level, last):
+    c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    if last:
+        return c.compress(data) + c.flush(zlib.Z_FINISH)
+    return c.compress(data) + c.flush(zlib.Z_SYNC_FLUSH)
+
+def zlib_header(level):
+    #CMF: deflate with a 32K window, FLG: compression level hint + check bits
+    cmf = 0x78
+    if level<2:
+        flevel = 0
+    elif level<6:
+        flevel = 1
+    elif level==6:
+        flevel = 2
+    else:
+        flevel = 3
+    flg = flevel<<6
+    flg += 31 - (cmf*256 + flg) % 31
+    return struct.pack("!BB", cmf, flg)
+
+
+#only one pool for all connections:
+singleton = None
+lock = Lock()
+
+def get_compression_pool():
+    global singleton
+    if COMPRESSION_THREADS<=0:
+        return None
+    #fast path:
+    if singleton is not None:
+        return singleton
+    lock.acquire()
+    try:
+        if singleton is None:
+            singleton = CompressionPool(COMPRESSION_THREADS)
+            debug("created %s", singleton)
+        return singleton
+    finally:
+        lock.release()
@@ -0,0 +1,442 @@
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Event driven network I/O, as an alternative to the four threads
+each Protocol instance normally uses (read, write, parse and format).
+
+A single thread polls all the sockets (using epoll when available)
+and does all the non-blocking reads and writes,
+the CPU intensive work (parsing and decompressing packets, encoding and compressing them)
+runs on a small pool of worker threads, never concurrently for the same connection.
+"""
+
+import os
+import errno
+import select
+import socket
+from threading import Lock, RLock
+from collections import deque
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_NETWORK_DEBUG")
+from xpra.os_util import Queue
+from xpra.daemon_thread import make_daemon_thread
+from xpra.net.bytestreams import SocketConnection
+from xpra.net.protocol import Protocol, READ_BUFFER_SIZE, WRITE_COALESCE_SIZE
+
+USE_IO_ENGINE = os.environ.get("XPRA_IO_ENGINE", "0")=="1"
+IO_WORKERS = int(os.environ.get("XPRA_IO_WORKERS", "4"))
+
+HAS_EPOLL = hasattr(select, "epoll")
+HAS_POLL = hasattr(select, "poll")
+POLLIN = getattr(select, "POLLIN", 1)
+POLLOUT = getattr(select, "POLLOUT", 4)
+POLLERR = getattr(select, "POLLERR", 8)
+POLLHUP = getattr(select, "POLLHUP", 16)
+WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK)
+
+
+class IOWorkers(object):
+    """ the threads running the parse and format tasks """
+
+    def __init__(self, nthreads):
+        self.tasks = Queue()
+        self.threads = []
+        for i in range(nthreads):
+            t = make_daemon_thread(self.run, "io-worker-%s" % i)
+            self.threads.append(t)
+            t.start()
+
+    def submit(self, task):
+        self.tasks.put(task)
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            try:
+                task()
+            except:
+                log.error("error in io worker task %s", task, exc_info=True)
+
+
+class SerialTask(object):
+    """
+        Runs a function on the worker pool, never concurrently with itself:
+        if it is scheduled again whilst running, it will run once more.
+    """
+
+    def __init__(self, workers, fn):
+        self.workers = workers
+        self.fn = fn
+        self.lock = Lock()
+        self.running = False
+        self.pending = False
+
+    def schedule(self):
+        self.lock.acquire()
+        try:
+            if self.running:
+                self.pending = True
+                return
+            self.running = True
+        finally:
+            self.lock.release()
+        self.workers.submit(self.run)
+
+    def run(self):
+        while True:
+            try:
+                self.fn()
+            except:
+                log.error("error in %s", self.fn, exc_info=True)
+            self.lock.acquire()
+            try:
+                if not self.pending:
+                    self.running = False
+                    return
+                self.pending = False
+            finally:
+                self.lock.release()
+
+
+class IOEngine(object):
+
+    def __init__(self, nworkers=IO_WORKERS):
+        #re-entrant: the write callbacks may close the connection
+        self.lock = RLock()
+        self.protocols = {}
+        if HAS_EPOLL:
+            self.poller = select.epoll()
+        else:
+            self.poller = select.poll()
+        #used for waking up the poll loop when we add or change registrations:
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        import fcntl
+        flags = fcntl.fcntl(self.wakeup_write, fcntl.F_GETFL)
+        fcntl.fcntl(self.wakeup_write, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.poller.register(self.wakeup_read, POLLIN)
+        self.workers = IOWorkers(nworkers)
+        self.thread = make_daemon_thread(self.run, "io-engine")
+        self.thread.start()
+
+    def __str__(self):
+        return "IOEngine(%s connections)" % len(self.protocols)
+
+    def discard(self):
+        """
+            Closes our copy of the file descriptors after a fork,
+            without touching the connections (they belong to the parent process).
+        """
+        self.protocols = {}
+        for fd in (self.wakeup_read, self.wakeup_write):
+            try:
+                os.close(fd)
+            except:
+                pass
+        try:
+            self.poller.close()
+        except:
+            pass
+
+    def wakeup(self):
+        try:
+            os.write(self.wakeup_write, "0")
+        except:
+            pass
+
+    def register(self, proto):
+        fd = proto._conn.fileno()
+        proto._conn._socket.setblocking(False)
+        self.lock.acquire()
+        try:
+            self.protocols[fd] = proto
+            #packets may have been queued before we got here,
+            #if not, the first write event will clear POLLOUT:
+            proto._io_events = POLLIN | POLLOUT
+            self.poller.register(fd, proto._io_events)
+        finally:
+            self.lock.release()
+        self.wakeup()
+
+    def unregister(self, proto):
+        self.lock.acquire()
+        try:
+            for fd, p in list(self.protocols.items()):
+                if p==proto:
+                    del self.protocols[fd]
+                    try:
+                        self.poller.unregister(fd)
+                    except:
+                        pass
+        finally:
+            self.lock.release()
+
+    def want_write(self, proto):
+        """ called when a protocol has queued data to write out """
+        self.lock.acquire()
+        try:
+            if proto._io_events & POLLOUT or proto._conn is None:
+                return
+            fd = proto._conn.fileno()
+            if fd not in self.protocols:
+                return
+            proto._io_events = POLLIN | POLLOUT
+            self.poller.modify(fd, proto._io_events)
+        finally:
+            self.lock.release()
+        self.wakeup()
+
+    def poll(self):
+        if HAS_EPOLL:
+            return self.poller.poll(1)
+        return self.poller.poll(1000)
+
+    def run(self):
+        debug("%s.run() starting", self)
+        while True:
+            try:
+                events = self.poll()
+            except (OSError, IOError, select.error), e:
+                if e.args[0]==errno.EINTR:
+                    continue
+                raise
+            for fd, event in events:
+                if fd==self.wakeup_read:
+                    os.read(self.wakeup_read, 4096)
+                    continue
+                proto = self.protocols.get(fd)
+                if proto is None:
+                    continue
+                try:
+                    if event & (POLLIN | POLLHUP | POLLERR):
+                        proto.io_read()
+                    if event & POLLOUT:
+                        self.lock.acquire()
+                        try:
+                            more = proto.io_write()
+                            if not more and fd in self.protocols:
+                                proto._io_events = POLLIN
+                                self.poller.modify(fd, POLLIN)
+                        finally:
+                            self.lock.release()
+                except Exception, e:
+                    self.unregister(proto)
+                    proto.io_error(e)
+
+
+class EventProtocol(Protocol):
+    """
+        A Protocol which uses the IOEngine rather than its own threads,
+        the packet source and packet processing callbacks are used exactly as before.
+    """
+
+    def __init__(self, scheduler, conn, process_packet_cb, get_packet_cb=None):
+        Protocol.__init__(self, scheduler, conn, process_packet_cb, get_packet_cb)
+        self._write_thread = None
+        self._read_thread = None
+        self._read_parser_thread = None
+        self._write_format_thread = None
+        self._io_events = 0
+        self._engine = get_io_engine()
+        self._read_pending = deque()
+        self._parser = self.packet_parser()
+        self._parser.send(None)
+        self._parse_task = SerialTask(self._engine.workers, self.parse_pending)
+        self._format_task = SerialTask(self._engine.workers, self.format_pending)
+        #the PendingWrite we are currently writing out:
+        self._current_write = None
+        #packets which did not fit in their write lane yet: (items, lane, size)
+        self._pending_items = deque()
+        #set when we stop writing until the pacing timer fires:
+        self._paced = False
+
+    def __str__(self):
+        return "EventProtocol(%s)" % self._conn
+
+    def start(self):
+        def do_start():
+            if not self._closed:
+                self._engine.register(self)
+                self.source_has_more()
+        self.scheduler.idle_add(do_start)
+
+    def wait_for_io_threads_exit(self, timeout=None):
+        return True
+
+    def source_has_more(self):
+        self._source_has_more.set()
+        if not self._closed:
+            self._format_task.schedule()
+
+    def format_pending(self):
+        """
+            Runs on the shared worker threads, so it must never block:
+            we stop formatting when a packet does not fit in its write lane,
+            io_write schedules us again once it has taken something out of the queue.
+        """
+        if not self.queue_pending_items():
+            return
+        while not self._closed and self._source_has_more.isSet() and self._get_packet_cb:
+            #stop when we have enough queued for a full write:
+            if self._write_queue.get_size()>=WRITE_COALESCE_SIZE or len(self._pending_items)>0:
+                #resumes when the engine has written something out:
+                return
+            self._source_has_more.clear()
+            self._add_packet_to_queue(*self._get_packet_cb())
+
+    def queue_pending_items(self):
+        """ moves the pending packets to the write queue, returns True if they all fit """
+        if len(self._pending_items)==0:
+            return True
+        self._write_lock.acquire()
+        try:
+            while len(self._pending_items)>0:
+                items, lane, size = self._pending_items[0]
+                if not self._write_queue.try_put(items, lane, size):
+                    break
+                self._pending_items.popleft()
+        finally:
+            self._write_lock.release()
+        self._engine.want_write(self)
+        return len(self._pending_items)==0
+
+    def _queue_items(self, items, lane, size):
+        #the write lock is held, never block:
+        #keep the packet until there is room in its lane (preserving the order)
+        if len(self._pending_items)>0 or not self._write_queue.try_put(items, lane, size):
+            self._pending_items.append((items, lane, size))
+
+    def _add_chunks_to_queue(self, chunks, proto_flags, start_send_cb=None, end_send_cb=None, lane=0):
+        Protocol._add_chunks_to_queue(self, chunks, proto_flags, start_send_cb, end_send_cb, lane)
+        self._engine.want_write(self)
+
+    def io_read(self):
+        """ called from the engine thread when the socket is readable """
+        try:
+            buf = self._conn.read(READ_BUFFER_SIZE)
+        except (socket.error, IOError, OSError), e:
+            if e.args[0] in WOULD_BLOCK:
+                return
+            raise
+        if buf:
+            self.input_raw_packetcount += 1
+        else:
+            debug("io_read: eof")
+            self._engine.unregister(self)
+        self._read_pending.append(buf)
+        self._parse_task.schedule()
+
+    def parse_pending(self):
+        while len(self._read_pending)>0:
+            buf = self._read_pending.popleft()
+            try:
+                self._parser.send(buf)
+            except StopIteration:
+                return
+
+    def io_write(self):
+        """
+            called from the engine thread when the socket is writeable,
+            returns True if we still have data to write out
+        """
+        self._paced = False
+        while not self._closed:
+            if self._current_write is None:
+                items = self._write_queue.get_nowait()
+                if items is None:
+                    return False
+                self._current_write = self._start_write(self.coalesce_items(items))
+                #we have room for more:
+                if self._source_has_more.isSet() or len(self._pending_items)>0:
+                    self._format_task.schedule()
+            w = self._current_write
+            while w.index<len(w.items):
+                if w.sent>=w.ends[w.index]:
+                    self._end_write(w)
+                    continue
+                try:
+                    written = self._write_buffers(self._conn, w)
+                except (socket.error, IOError, OSError), e:
+                    if e.args[0] in WOULD_BLOCK:
+                        return True
+                    raise
+                if not written:
+                    return not self._paced
+                w.sent += written
+            self._current_write = None
+        return False
+
+    def _wait_for_pacing(self, delay):
+        #don't block the engine thread: stop polling for write events
+        #and resume when the delay has expired
+        self._paced = True
+        def resume():
+            self._engine.want_write(self)
+            return False
+        self.scheduler.timeout_add(max(1, int(delay*1000)), resume)
+        return False
+
+    def io_error(self, e):
+        if not self._closed:
+            if e.args and e.args[0] in (errno.ECONNRESET, errno.EPIPE):
+                log.error("connection reset for %s", self._conn)
+                self._call_connection_lost("connection reset: %s" % e)
+            else:
+                log.error("error on %s", self._conn, exc_info=True)
+                self._call_connection_lost("error on connection: %s" % e)
+
+    def close(self):
+        self._engine.unregister(self)
+        Protocol.close(self)
+
+    def steal_connection(self):
+        self._engine.unregister(self)
+        conn = self._conn
+        conn._socket.setblocking(True)
+        return Protocol.steal_connection(self)
+
+    def terminate_queue_threads(self):
+        #no threads to terminate, but the parser must exit:
+        self._read_pending.append(None)
+        self._source_has_more.set()
+
+
+#only one engine per process:
+singleton = None
+singleton_pid = 0
+lock = Lock()
+
+def get_io_engine():
+    global singleton, singleton_pid, lock
+    pid = os.getpid()
+    if singleton is not None and singleton_pid==pid:
+        return singleton
+    if singleton is not None:
+        #we have been forked (ie: proxy instance process),
+        #the parent's engine threads do not exist in this process
+        #and its lock may have been held when we forked:
+        debug("discarding %s inherited from process %s", singleton, singleton_pid)
+        singleton.discard()
+        singleton = None
+        lock = Lock()
+    lock.acquire()
+    try:
+        if singleton is None:
+            singleton = IOEngine()
+            singleton_pid = pid
+            debug("created %s", singleton)
+        return singleton
+    finally:
+        lock.release()
+
+def make_protocol(scheduler, conn, process_packet_cb, get_packet_cb=None):
+    """ returns an EventProtocol if the io engine is enabled and supports this connection """
+    if USE_IO_ENGINE and (HAS_EPOLL or HAS_POLL) and isinstance(conn, SocketConnection):
+        return EventProtocol(scheduler, conn, process_packet_cb, get_packet_cb)
+    return Protocol(scheduler, conn, process_packet_cb, get_packet_cb)
@@ -5,6 +5,7 @@
 
 import os
 import ctypes
+from threading import Lock
 from xpra.os_util import strtobytes
 from xpra.log import Logger, debug_if_env
 log = Logger()
@@ -15,6 +16,11 @@ warn = log.warn
 Utility functions for communicating via mmap
 """
 
+#the slots start after the legacy indexes and the token:
+MMAP_SLOTS_START = 4096
+#slots are aligned on cache lines:
+MMAP_ALIGNMENT = int(os.environ.get("XPRA_MMAP_ALIGNMENT", "64"))
+
 
 def init_client_mmap(token, mmap_group=None, socket_filename=None):
     """
@@ -128,13 +134,17 @@ def mmap_read(mmap_area, descr_data):
         arraytype = ctypes.c_char * length
         data_start.value = offset+length
         return arraytype.from_buffer(mmap_area, offset)
-    #re-construct the buffer from discontiguous chunks:
-    data = ""
+    #re-construct the buffer from discontiguous chunks (legacy servers only),
+    #copying each chunk straight to its place:
+    data = bytearray(sum(length for _, length in descr_data))
+    pos = 0
     for offset, length in descr_data:
-        mmap_area.seek(offset)
-        data += mmap_area.read(length)
+        data[pos:pos+length] = buffer(mmap_area, offset, length)
+        pos += length
         data_start.value = offset+length
-    return data
+    #same type as the single chunk case:
+    arraytype = ctypes.c_char * len(data)
+    return arraytype.from_buffer(data)
 
 
 def mmap_write(mmap_area, mmap_size, data):
@@ -209,3 +219,124 @@ def mmap_write(mmap_area, mmap_size, data):
             mmap_data_end.value = 8+l2
     debug("sending damage with mmap: %s", data)
     return data, mmap_free_size
+
+
+class MmapAllocator(object):
+    """
+        Allocates slots from the client's mmap area,
+        so several regions can be in flight at the same time
+        and each one can be re-used as soon as the client has painted it,
+        regardless of the order in which the paints complete.
+        The slots are always contiguous, so the client can paint them in place.
+        The slots are tagged with the (wid, packet sequence) of the draw packet using them,
+        the client's damage acknowledgement for this packet releases them.
+        Used by the server when the client supports it ("mmap_slots"),
+        otherwise we fall back to the simple ring buffer: see mmap_write.
+    """
+
+    def __init__(self, mmap_area, mmap_size, alignment=MMAP_ALIGNMENT, start=MMAP_SLOTS_START):
+        self.lock = Lock()
+        self.write_lock = Lock()
+        self.mmap_area = mmap_area
+        self.mmap_size = mmap_size
+        self.alignment = alignment
+        self.start = start
+        self.free_list = [[start, mmap_size-start]]    #sorted list of [offset, size]
+        self.free_size = mmap_size-start
+        self.slots = {}                                 #tag -> (offset, size)
+        self.allocated = 0
+        self.released = 0
+        self.failed = 0
+        self.max_in_flight = 0
+
+    def allocate(self, size):
+        """ returns the offset of a slot of at least 'size' bytes, or -1 if there is no room """
+        size = (size+self.alignment-1)//self.alignment*self.alignment
+        for i, (offset, extent) in enumerate(self.free_list):
+            if extent>=size:
+                if extent==size:
+                    del self.free_list[i]
+                else:
+                    self.free_list[i] = [offset+size, extent-size]
+                self.free_size -= size
+                return offset, size
+        return -1, size
+
+    def free_slot(self, offset, size):
+        """ returns the slot to the free list, merging it with its neighbours """
+        fl = self.free_list
+        i = 0
+        while i<len(fl) and fl[i][0]<offset:
+            i += 1
+        fl.insert(i, [offset, size])
+        self.free_size += size
+        if i+1<len(fl) and offset+size==fl[i+1][0]:
+            fl[i][1] += fl[i+1][1]
+            del fl[i+1]
+        if i>0 and fl[i-1][0]+fl[i-1][1]==offset:
+            fl[i-1][1] += fl[i][1]
+            del fl[i]
+
+    def write(self, data, tag):
+        """
+            Copies the data to a new slot tagged with 'tag',
+            returns the chunks used ([(offset, length)] or None if the area is full)
+            and the free space left.
+        """
+        l = len(data)
+        self.lock.acquire()
+        try:
+            old = self.slots.get(tag)
+            if old:
+                #stale slot: the client never acknowledged this packet sequence
+                del self.slots[tag]
+                self.free_slot(*old)
+            offset, size = self.allocate(l)
+            if offset<0:
+                self.failed += 1
+                largest = max([0]+[extent for _, extent in self.free_list])
+                warn("mmap area full: we need %s bytes but the largest free slot is %s bytes (%s bytes free in total)", l, largest, self.free_size)
+                return None, self.free_size-l
+            self.slots[tag] = (offset, size)
+            self.allocated += 1
+            self.max_in_flight = max(self.max_in_flight, len(self.slots))
+            free_size = self.free_size
+        finally:
+            self.lock.release()
+        #the slot is ours until it is released, but the file position is shared
+        #with the other encode threads, so seek and write must not be interleaved:
+        self.write_lock.acquire()
+        try:
+            self.mmap_area.seek(offset)
+            self.mmap_area.write(data)
+        finally:
+            self.write_lock.release()
+        debug("sending damage with mmap slot %s: %s", tag, (offset, l))
+        return [(offset, l)], free_size
+
+    def release(self, tag):
+        """ the client has painted the data tagged with 'tag', its slot can be re-used """
+        self.lock.acquire()
+        try:
+            slot = self.slots.get(tag)
+            if slot is None:
+                return False
+            del self.slots[tag]
+            self.free_slot(*slot)
+            self.released += 1
+            return True
+        finally:
+            self.lock.release()
+
+    def get_free_size(self):
+        return self.free_size
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"size" + suffix] = self.mmap_size
+        info[prefix+"free" + suffix] = self.free_size
+        info[prefix+"free_extents" + suffix] = len(self.free_list)
+        info[prefix+"in_flight" + suffix] = len(self.slots)
+        info[prefix+"max_in_flight" + suffix] = self.max_in_flight
+        info[prefix+"allocated" + suffix] = self.allocated
+        info[prefix+"released" + suffix] = self.released
+        info[prefix+"failed" + suffix] = self.failed
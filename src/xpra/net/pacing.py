@@ -0,0 +1,144 @@
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Send pacing: estimates the link rate from how fast the socket send queue drains,
+and delays writes so we don't fill the kernel buffers with more data
+than the link can deliver in a short amount of time (bufferbloat),
+which would delay everything queued behind it.
+When a bandwidth limit is set, a token bucket also caps the send rate.
+"""
+
+import os
+import time
+from threading import Lock
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_PACING_DEBUG")
+from xpra.deque import maxdeque
+
+SEND_PACING = os.environ.get("XPRA_SEND_PACING", "1")=="1"
+#how much data we allow in the socket send queue, in seconds at the link rate:
+MAX_QUEUE_TIME = float(os.environ.get("XPRA_MAX_SEND_QUEUE_TIME", "0.050"))
+#but always allow at least this much:
+MIN_QUEUE_SIZE = int(os.environ.get("XPRA_MIN_SEND_QUEUE_SIZE", 64*1024))
+#the token bucket can hold this much (in seconds at the rate limit):
+BURST_TIME = 0.020
+MIN_BURST = 16*1024
+#never wait longer than this before writing something:
+MAX_DELAY = 1.0
+#ignore rate samples over intervals shorter than this:
+MIN_SAMPLE_TIME = 0.005
+#without access to the send queue, only writes at least this big are used for estimating the rate:
+MIN_WRITE_SAMPLE = 16*1024
+
+
+class SendPacer(object):
+    """
+        The link rate is estimated from the bytes delivered
+        (bytes written minus the bytes still in the send queue)
+        during intervals where the send queue never ran dry,
+        and from the time spent in large blocking writes when
+        the send queue size is not available.
+    """
+
+    def __init__(self, limit=0):
+        self.lock = Lock()
+        self.limit = 0
+        self.tokens = 0
+        self.last_refill = time.time()
+        self.set_limit(limit)
+        self.total_sent = 0
+        self.queue_size = 0
+        self.last_sample = None         #(time, delivered, queue_size)
+        self.rate_samples = maxdeque(50) #(bytes delivered, elapsed)
+        self.paced_count = 0
+        self.paced_time = 0.0
+
+    def set_limit(self, limit):
+        """ the maximum send rate in bytes per second, zero for no limit """
+        self.limit = max(0, int(limit or 0))
+        self.tokens = self.get_burst()
+        debug("set_limit(%s)", limit)
+
+    def get_burst(self):
+        return max(MIN_BURST, self.limit*BURST_TIME)
+
+    def get_estimate(self):
+        """ the measured link rate in bytes per second, zero until we have enough data """
+        samples = list(self.rate_samples)
+        size = sum([x for x,_ in samples])
+        elapsed = sum([x for _,x in samples])
+        if elapsed<0.050 or size==0:
+            return 0
+        return int(size/elapsed)
+
+    def get_rate(self):
+        """ the rate we expect to be able to send at, zero if unknown """
+        estimate = self.get_estimate()
+        if self.limit>0 and (estimate==0 or estimate>self.limit):
+            return self.limit
+        return estimate
+
+    def get_delay(self, queue_size):
+        """ how long to wait before writing more data """
+        self.lock.acquire()
+        try:
+            delay = 0.0
+            if self.limit>0:
+                now = time.time()
+                self.tokens = min(self.get_burst(), self.tokens + (now-self.last_refill)*self.limit)
+                self.last_refill = now
+                if self.tokens<0:
+                    delay = -self.tokens/self.limit
+            rate = self.get_rate()
+            if rate>0 and queue_size:
+                max_queue = max(MIN_QUEUE_SIZE, rate*MAX_QUEUE_TIME)
+                if queue_size>max_queue:
+                    delay = max(delay, (queue_size-max_queue)/float(rate))
+            return min(MAX_DELAY, delay)
+        finally:
+            self.lock.release()
+
+    def paced(self, delay):
+        self.paced_count += 1
+        self.paced_time += delay
+
+    def record_write(self, size, elapsed, queue_size):
+        """ called after each write with the send queue size (or None) """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            if self.limit>0:
+                #we may go into debt when writing a large buffer, get_delay will pay it back:
+                self.tokens -= size
+            self.total_sent += size
+            if queue_size is None:
+                if size>=MIN_WRITE_SAMPLE and elapsed>=MIN_SAMPLE_TIME:
+                    self.rate_samples.append((size, elapsed))
+                return
+            self.queue_size = queue_size
+            delivered = self.total_sent-queue_size
+            if self.last_sample:
+                last_time, last_delivered, last_queue_size = self.last_sample
+                sample_time = now-last_time
+                if sample_time<MIN_SAMPLE_TIME:
+                    #wait until the interval is long enough:
+                    return
+                #only a busy link tells us how fast it can go:
+                if last_queue_size>0 and queue_size>0:
+                    self.rate_samples.append((delivered-last_delivered, sample_time))
+            self.last_sample = (now, delivered, queue_size)
+        finally:
+            self.lock.release()
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"limit" + suffix] = self.limit
+        info[prefix+"estimate" + suffix] = self.get_estimate()
+        info[prefix+"rate" + suffix] = self.get_rate()
+        info[prefix+"send_queue" + suffix] = self.queue_size
+        info[prefix+"paced.count" + suffix] = self.paced_count
+        info[prefix+"paced.time_ms" + suffix] = int(1000.0*self.paced_time)
@@ -20,6 +20,8 @@ from threading import Lock
 
 ZLIB_FLAG = 0x00
 LZ4_FLAG = 0x10
+#zlib with a preset dictionary, the dictionary id is in the lower 4 bits:
+ZLIB_DICT_FLAG = 0x20
 
 
 from xpra.log import Logger, debug_if_env
@@ -28,6 +30,11 @@ debug = debug_if_env(log, "XPRA_NETWORK_DEBUG")
 from xpra.os_util import Queue, strtobytes, get_hex_uuid
 from xpra.daemon_thread import make_daemon_thread
 from xpra.simple_stats import std_unit, std_unit_dec
+from xpra.net.write_lanes import WriteLanes, get_packet_lane, NORMAL
+from xpra.net.compression_pool import get_compression_pool
+from xpra.net.adaptive_compression import AdaptiveCompression
+from xpra.net.compression_dictionaries import get_compression_dictionaries, DICTIONARY_MIN_SIZE
+from xpra.net.pacing import SendPacer, SEND_PACING
 
 try:
     from Crypto.Cipher import AES
@@ -80,16 +87,22 @@ if sys.version > '3':
     unicode = str           #@ReservedAssignment
     def zcompress(packet, level):
         return level + ZLIB_FLAG, compress(bytes(packet, 'UTF-8'), level)
+    #zero-copy read-only view of a buffer, which can be given to zlib:
+    def buffer_view(data, offset=0, size=-1):
+        if size<0:
+            return memoryview(data)[offset:]
+        return memoryview(data)[offset:offset+size]
 else:
     def zcompress(packet, level):
         return level + ZLIB_FLAG, compress(str(packet), level)
+    buffer_view = buffer                #@UndefinedVariable
 
 if sys.version_info[:2]>=(2,5):
-    def unpack_header(buf):
-        return struct.unpack_from('!cBBBL', buf)
+    def unpack_header(buf, offset=0):
+        return struct.unpack_from('!cBBBL', buf, offset)
 else:
-    def unpack_header(buf):
-        return struct.unpack('!cBBBL', "".join(buf))
+    def unpack_header(buf, offset=0):
+        return struct.unpack('!cBBBL', "".join(buf[offset:offset+8]))
 
 
 #'P' + protocol-flags + compression_level + packet_index + data_size
@@ -112,6 +125,13 @@ LARGE_PACKET_SIZE = 4096
 #inline compressed data in packet if smaller than:
 INLINE_SIZE = int(os.environ.get("XPRA_INLINE_SIZE", 2048))
 FAKE_JITTER = int(os.environ.get("XPRA_FAKE_JITTER", "0"))
+#the write thread writes out everything queued, up to this many bytes at a time:
+WRITE_COALESCE_SIZE = int(os.environ.get("XPRA_WRITE_COALESCE_SIZE", 64*1024))
+#each write lane can hold this many packets, as long as they fit in WRITE_COALESCE_SIZE:
+WRITE_LANE_SIZE = int(os.environ.get("XPRA_WRITE_LANE_SIZE", 16))
+#choose the compressor for each packet type from measurements:
+ADAPTIVE_COMPRESSION = os.environ.get("XPRA_ADAPTIVE_COMPRESSION", "1")=="1"
+USE_DICTIONARIES = os.environ.get("XPRA_COMPRESSION_DICTIONARIES", "1")=="1"
 
 
 def new_cipher_caps(proto, cipher, encryption_key):
@@ -136,6 +156,8 @@ def get_network_caps():
                 "lz4"                   : use_lz4,
                 "zlib"                  : True,
                }
+    if USE_DICTIONARIES:
+        caps["zlib.dictionaries"] = get_compression_dictionaries().get_caps()
     try:
         import Crypto
         caps["pycrypto.version"] = Crypto.__version__
@@ -201,6 +223,33 @@ def compressed_wrapper(datatype, data, level=5, lz4=False):
     return LevelCompressed(datatype, cdata, cl, algo)
 
 
+class PendingWrite(object):
+    """
+        The (buffer, start_cb, end_cb) items we are writing out,
+        and how far we got: the callbacks are given the byte position
+        where each item starts and ends, relative to the output bytecount ('base')
+    """
+
+    def __init__(self, items, base):
+        self.items = items
+        self.views = [memoryview(buf) for buf,_,_ in items]
+        self.ends = []
+        pos = 0
+        for view in self.views:
+            pos += len(view)
+            self.ends.append(pos)
+        self.base = base
+        #bytes written so far:
+        self.sent = 0
+        #the item we are writing:
+        self.index = 0
+        #the number of items we have fired the start callback for:
+        self.started = 0
+
+    def get_start(self, index):
+        return self.ends[index]-len(self.views[index])
+
+
 class Protocol(object):
     CONNECTION_LOST = "connection-lost"
     GIBBERISH = "gibberish"
@@ -222,7 +271,7 @@ class Protocol(object):
             self._process_packet_cb =  fj.process_packet_cb
         else:
             self._process_packet_cb = process_packet_cb
-        self._write_queue = Queue(1)
+        self._write_queue = WriteLanes(WRITE_LANE_SIZE, WRITE_COALESCE_SIZE)
         self._read_queue = Queue(20)
         # Invariant: if .source is None, then _source_has_more == False
         self._get_packet_cb = get_packet_cb
@@ -243,6 +292,20 @@ class Protocol(object):
         self._encoder = self.noencode
         self._compress = zcompress
         self._decompressor = decompressobj()
+        self._compression_pool = get_compression_pool()
+        self._adaptive_compression = None
+        if ADAPTIVE_COMPRESSION:
+            self._adaptive_compression = AdaptiveCompression()
+        #set once we know the other end can decompress lz4:
+        self.peer_lz4 = False
+        #set when the user chose the compression level or algorithm,
+        #the adaptive compression must not override it:
+        self.fixed_compression = False
+        #packet type -> id of the compression dictionary to use:
+        self.send_dictionaries = {}
+        self._pacer = None
+        if SEND_PACING:
+            self._pacer = SendPacer()
         self.compression_level = 0
         self.cipher_in = None
         self.cipher_in_name = None
@@ -259,10 +322,10 @@ class Protocol(object):
         self.enable_default_encoder()
 
     STATE_FIELDS = ("max_packet_size", "large_packets", "send_aliases", "receive_aliases",
-                    "chunked_compression",
+                    "chunked_compression", "peer_lz4", "send_dictionaries",
                     "cipher_in", "cipher_in_name", "cipher_in_block_size",
                     "cipher_out", "cipher_out_name", "cipher_out_block_size",
-                    "compression_level")
+                    "compression_level", "fixed_compression")
     def save_state(self):
         state = {}
         for x in Protocol.STATE_FIELDS:
@@ -348,6 +411,13 @@ class Protocol(object):
         elif self._compress==lz4_compress:
             info[prefix+"compression" + suffix] = "lz4"
         info[prefix+"max_packet_size" + suffix] = self.max_packet_size
+        if self._compression_pool:
+            info[prefix+"compression.threads" + suffix] = len(self._compression_pool.threads)
+        if self._adaptive_compression:
+            self._adaptive_compression.add_stats(info, prefix+"compression.", suffix)
+        self._write_queue.add_stats(info, prefix+"output.", suffix)
+        if self._pacer:
+            self._pacer.add_stats(info, prefix+"output.pacing.", suffix)
         for k,v in self.send_aliases.items():
             info[prefix+"send_alias." + str(k) + suffix] = v
             info[prefix+"send_alias." + str(v) + suffix] = k
@@ -409,14 +479,19 @@ class Protocol(object):
             return
         debug("add_packet_to_queue(%s ...)", packet[0])
         chunks, proto_flags = self.encode(packet)
+        lane = get_packet_lane(packet[0])
         try:
             self._write_lock.acquire()
-            self._add_chunks_to_queue(chunks, proto_flags, start_send_cb, end_send_cb)
+            self._add_chunks_to_queue(chunks, proto_flags, start_send_cb, end_send_cb, lane)
         finally:
             self._write_lock.release()
 
-    def _add_chunks_to_queue(self, chunks, proto_flags, start_send_cb=None, end_send_cb=None):
-        """ the write_lock must be held when calling this function """
+    def _add_chunks_to_queue(self, chunks, proto_flags, start_send_cb=None, end_send_cb=None, lane=NORMAL):
+        """
+            the write_lock must be held when calling this function,
+            all the chunks of a packet are queued as a single item
+            so packets from higher priority lanes can only be written between packets
+        """
         counter = 0
         items = []
         for index,level,data in chunks:
@@ -455,9 +530,13 @@ class Protocol(object):
                 items.append((header, scb, None))
                 items.append((strtobytes(data), None, ecb))
             counter += 1
-        self._write_queue.put(items)
+        self._queue_items(items, lane, sum([len(x[0]) for x in items]))
         self.output_packetcount += 1
 
+    def _queue_items(self, items, lane, size):
+        #blocks until the lane has room for it:
+        self._write_queue.put(items, lane, size)
+
     def verify_packet(self, packet):
         """ look for None values which may have caused the packet to fail encoding """
         if type(packet)!=list:
@@ -501,6 +580,12 @@ class Protocol(object):
         debug("enable_rencode()")
         self._encoder = self.rencode
 
+    def set_peer_dictionaries(self, remote_caps):
+        """ enables the compression dictionaries which match the ones the other end has """
+        if USE_DICTIONARIES and self.chunked_compression and remote_caps:
+            self.send_dictionaries = get_compression_dictionaries().get_matching(remote_caps)
+            debug("set_peer_dictionaries(..) using dictionaries for: %s", self.send_dictionaries.keys())
+
     def enable_zlib(self):
         debug("enable_zlib()")
         self._compress = zcompress
@@ -561,7 +646,7 @@ class Protocol(object):
             elif ti==str and level>0 and len(item)>LARGE_PACKET_SIZE:
                 log.warn("found a large uncompressed item in packet '%s' at position %s: %s bytes", packet[0], i, len(item))
                 #add new binary packet with large item:
-                cl, cdata = self._compress(item, level)
+                cl, cdata = self.compress_packet(packet[0], item, level)
                 packets.append((i, cl, cdata))
                 #replace this item with an empty string placeholder:
                 packet[i] = ''
@@ -586,13 +671,57 @@ class Protocol(object):
             log.warn("found large packet (%s bytes): %s, argument types:%s, sizes: %s, packet head=%s",
                      len(main_packet), packet_in[0], [type(x) for x in packet[1:]], [len(str(x)) for x in packet[1:]], repr_ellipsized(packet))
         #compress, but don't bother for small packets:
+        #(unless we have a dictionary for this packet type)
+        if packet_type in self.send_dictionaries:
+            min_comp_size = min(min_comp_size, DICTIONARY_MIN_SIZE)
         if level>0 and len(main_packet)>min_comp_size:
-            cl, cdata = self._compress(main_packet, level)
+            cl, cdata = self.compress_packet(packet_type, main_packet, level)
             packets.append((0, cl, cdata))
         else:
             packets.append((0, 0, main_packet))
         return packets, proto_version
 
+    def compress(self, data, level):
+        if self._compress==zcompress:
+            return self.zlib_compress(data, level)
+        return self._compress(data, level)
+
+    def zlib_compress(self, data, level):
+        """ uses the compression pool when we have one """
+        if self._compression_pool and sys.version_info[0]<3:
+            return level + ZLIB_FLAG, self._compression_pool.zcompress(str(data), level)
+        return zcompress(data, level)
+
+    def compress_packet(self, packet_type, data, level):
+        """
+            Compresses the data from a packet of the given type,
+            the adaptive compression picks the algorithm and level to use
+            (only with chunked compression, where each chunk carries its own compression flags)
+            unless the user has chosen them (see fixed_compression)
+            or until we know the link rate.
+        """
+        dictionary_id = self.send_dictionaries.get(packet_type)
+        ac = self._adaptive_compression
+        option = None
+        if ac and self.chunked_compression and not self.fixed_compression:
+            option = ac.choose(packet_type, level, self.peer_lz4 and has_lz4, dictionary_id is not None, self.get_link_rate())
+        if option is None:
+            if dictionary_id and self.chunked_compression:
+                return ZLIB_DICT_FLAG | dictionary_id, get_compression_dictionaries().compress(dictionary_id, data, level)
+            return self.compress(data, level)
+        algo, alevel = option
+        start = time.time()
+        if algo=="dict":
+            cl, cdata = ZLIB_DICT_FLAG | dictionary_id, get_compression_dictionaries().compress(dictionary_id, data, alevel)
+        elif algo=="lz4":
+            cl, cdata = lz4_compress(data, alevel)
+        elif algo=="zlib":
+            cl, cdata = self.zlib_compress(data, alevel)
+        else:
+            cl, cdata = 0, data
+        ac.record(packet_type, option, len(data), len(cdata), time.time()-start)
+        return cl, cdata
+
     def set_compression_level(self, level):
         #this may be used next time encode() is called
         self.compression_level = level
@@ -634,23 +763,125 @@ class Protocol(object):
             debug("write thread: empty marker, exiting")
             self.close()
             return
-        for buf, start_cb, end_cb in items:
+        self.write_items(self.coalesce_items(items))
+
+    def coalesce_items(self, items):
+        """
+            Adds the items that are already queued to the list,
+            up to WRITE_COALESCE_SIZE bytes, so bursts of small packets
+            can go out in a single write.
+        """
+        size = sum([len(x[0]) for x in items])
+        while size<WRITE_COALESCE_SIZE and not self._write_queue.empty():
+            more = self._write_queue.get_nowait()
+            if more is None:
+                #exit marker: put it back so the next call will find it
+                self._write_queue.put_nowait(None)
+                break
+            items = items + more
+            size += sum([len(x[0]) for x in more])
+        return items
+
+    def write_items(self, items):
+        """
+            Writes all the (buffer, start_cb, end_cb) items using gather writes,
+            partial writes advance a memoryview offset rather than copying the rest of the buffer.
+        """
+        conn = self._conn
+        if not conn:
+            return
+        w = self._start_write(items)
+        while w.index<len(items):
+            if w.sent>=w.ends[w.index]:
+                self._end_write(w)
+                continue
+            if self._closed:
+                return
+            written = self._write_buffers(conn, w)
+            if written:
+                w.sent += written
+
+    def _start_write(self, items):
+        return PendingWrite(items, self._conn.output_bytecount)
+
+    def _start_items(self, w, count):
+        """ fires the start callbacks of the first 'count' items, unless we already have """
+        while w.started<count:
+            start_cb = w.items[w.started][1]
+            pos = w.base+w.get_start(w.started)
+            w.started += 1
             if start_cb:
                 try:
-                    start_cb(self._conn.output_bytecount)
+                    start_cb(pos)
                 except:
                     log.error("error on %s", start_cb, exc_info=True)
-            while buf and not self._closed:
-                written = self._conn.write(buf)
-                if written:
-                    buf = buf[written:]
-                    self.output_raw_packetcount += 1
-            if end_cb:
-                try:
-                    end_cb(self._conn.output_bytecount)
-                except:
-                    if not self._closed:
-                        log.error("error on %s", end_cb, exc_info=True)
+
+    def _end_write(self, w):
+        """ the current item has been written out completely """
+        #empty items never get written, start them now:
+        self._start_items(w, w.index+1)
+        end_cb = w.items[w.index][2]
+        pos = w.base+w.ends[w.index]
+        w.index += 1
+        if end_cb:
+            try:
+                end_cb(pos)
+            except:
+                if not self._closed:
+                    log.error("error on %s", end_cb, exc_info=True)
+
+    def _write_buffers(self, conn, w):
+        """
+            writes as much as we can from the current item of the PendingWrite,
+            the next items are only added once we are within WRITE_COALESCE_SIZE bytes
+            of their start, so we can fire their start callbacks right before writing them
+        """
+        pacer = self._pacer
+        if pacer:
+            delay = pacer.get_delay(conn.get_send_queue_size())
+            if delay>0:
+                pacer.paced(delay)
+                if not self._wait_for_pacing(delay):
+                    return 0
+        index = w.index
+        last = index+1
+        while last<len(w.views) and w.get_start(last)-w.sent<WRITE_COALESCE_SIZE:
+            last += 1
+        self._start_items(w, last)
+        offset = w.sent-w.get_start(index)
+        buffers = [w.views[index][offset:]] + w.views[index+1:last]
+        start = time.time()
+        written = conn.writev(buffers)
+        if written:
+            self.output_raw_packetcount += 1
+            if pacer:
+                pacer.record_write(written, time.time()-start, conn.get_send_queue_size())
+        return written
+
+    def _wait_for_pacing(self, delay):
+        """ returns True if we should write now """
+        time.sleep(delay)
+        return not self._closed
+
+    def set_bandwidth_limit(self, limit):
+        """ caps the send rate (in bytes per second), zero to remove the limit """
+        if self._pacer is None:
+            if not limit:
+                return
+            self._pacer = SendPacer()
+        self._pacer.set_limit(limit)
+
+    def get_link_rate(self):
+        """ the estimated (or configured) link rate in bytes per second, zero if unknown """
+        if self._pacer is None:
+            return 0
+        return self._pacer.get_rate()
+
+    def get_send_queue_size(self):
+        """ the number of bytes waiting in the socket send queue (as of the last write) """
+        if self._pacer is None:
+            return 0
+        return self._pacer.queue_size
 
     def _read_thread_loop(self):
         self._io_thread_loop("read", self._read)
@@ -697,7 +928,21 @@ class Protocol(object):
 
     def do_read_parse_thread_loop(self):
         """
-            Process the individual network packets placed in _read_queue.
+            Process the individual network packets placed in _read_queue,
+            by feeding them to the packet parser.
+        """
+        parser = self.packet_parser()
+        parser.send(None)
+        while not self._closed:
+            buf = self._read_queue.get()
+            try:
+                parser.send(buf)
+            except StopIteration:
+                return
+
+    def packet_parser(self):
+        """
+            Generator which receives the raw packet data via send().
             Concatenate the raw packet data, then try to parse it.
             Extract the individual packets from the potentially large buffer,
             saving the rest of the buffer for later, and optionally decompress this data
@@ -708,83 +953,110 @@ class Protocol(object):
             from the UI thread will need to use a callback (usually via 'idle_add')
         """
         read_buffer = None
+        #position of the unparsed data in read_buffer:
+        pos = 0
         payload_size = -1
         padding = None
         packet_index = 0
         compression_level = False
         raw_packets = {}
+        #large payloads are assembled in place in a buffer of the size announced in the header:
+        payload = None
+        payload_filled = 0
         while not self._closed:
-            buf = self._read_queue.get()
+            buf = yield
             if not buf:
                 debug("read thread: empty marker, exiting")
                 self.scheduler.idle_add(self.close)
                 return
-            if read_buffer:
-                read_buffer = read_buffer + buf
+            raw_string = None
+            if payload is not None:
+                #copy what we need into the payload buffer:
+                n = min(len(buf), payload_size-payload_filled)
+                payload[payload_filled:payload_filled+n] = buffer_view(buf, 0, n)
+                payload_filled += n
+                if payload_filled<payload_size:
+                    continue
+                raw_string = payload
+                payload = None
+                read_buffer = buf[n:]
+                pos = 0
+            elif read_buffer and pos<len(read_buffer):
+                #only the start of a header can be left over:
+                read_buffer = read_buffer[pos:] + buf
+                pos = 0
             else:
                 read_buffer = buf
-            bl = len(read_buffer)
+                pos = 0
+            bl = len(read_buffer)-pos
             while not self._closed:
-                bl = len(read_buffer)
-                if bl<=0:
-                    break
-                if payload_size<0:
-                    head = read_buffer[:8]
-                    if read_buffer[0] not in ("P", ord("P")):
-                        self._invalid_header(read_buffer)
-                        return
-                    if bl<8:
-                        break   #packet still too small
-                    #packet format: struct.pack('cBBBL', ...) - 8 bytes
-                    _, protocol_flags, compression_level, packet_index, data_size = unpack_header(head)
-
-                    #sanity check size (will often fail if not an xpra client):
-                    if data_size>self.abs_max_packet_size:
-                        self._invalid_header(read_buffer)
-                        return
-
-                    bl = len(read_buffer)-8
-                    if protocol_flags & Protocol.FLAGS_CIPHER:
-                        if self.cipher_in_block_size==0 or not self.cipher_in_name:
-                            log.warn("received cipher block but we don't have a cipher to decrypt it with, not an xpra client?")
-                            self._invalid_header(read_buffer)
+                if raw_string is None:
+                    bl = len(read_buffer)-pos
+                    if bl<=0:
+                        break
+                    if payload_size<0:
+                        if read_buffer[pos] not in ("P", ord("P")):
+                            self._invalid_header(read_buffer[pos:])
+                            return
+                        if bl<8:
+                            break   #packet still too small
+                        #packet format: struct.pack('cBBBL', ...) - 8 bytes
+                        _, protocol_flags, compression_level, packet_index, data_size = unpack_header(read_buffer, pos)
+
+                        #sanity check size (will often fail if not an xpra client):
+                        if data_size>self.abs_max_packet_size:
+                            self._invalid_header(read_buffer[pos:])
                             return
-                        padding = (self.cipher_in_block_size - data_size % self.cipher_in_block_size) * " "
-                        payload_size = data_size + len(padding)
+
+                        bl -= 8
+                        if protocol_flags & Protocol.FLAGS_CIPHER:
+                            if self.cipher_in_block_size==0 or not self.cipher_in_name:
+                                log.warn("received cipher block but we don't have a cipher to decrypt it with, not an xpra client?")
+                                self._invalid_header(read_buffer[pos:])
+                                return
+                            padding = (self.cipher_in_block_size - data_size % self.cipher_in_block_size) * " "
+                            payload_size = data_size + len(padding)
+                        else:
+                            #no cipher, no padding:
+                            padding = None
+                            payload_size = data_size
+                        assert payload_size>0
+                        pos += 8
+
+                        if payload_size>self.max_packet_size:
+                            #this packet is seemingly too big, but check again from the main UI thread
+                            #this gives 'set_max_packet_size' a chance to run from "hello"
+                            def check_packet_size(size_to_check, packet_header):
+                                if not self._closed:
+                                    debug("check_packet_size(%s, 0x%s) limit is %s", size_to_check, repr_ellipsized(packet_header), self.max_packet_size)
+                                    if size_to_check>self.max_packet_size:
+                                        self._call_connection_lost("invalid packet: size requested is %s (maximum allowed is %s - packet header: 0x%s), dropping this connection!" %
+                                                                      (size_to_check, self.max_packet_size, repr_ellipsized(packet_header)))
+                                return False
+                            self.scheduler.timeout_add(1000, check_packet_size, payload_size, read_buffer[pos:pos+32])
+
+                    if bl<payload_size:
+                        # incomplete packet, copy what we have into the payload buffer
+                        # and wait for the rest to arrive:
+                        payload = bytearray(payload_size)
+                        payload[:bl] = buffer_view(read_buffer, pos, bl)
+                        payload_filled = bl
+                        read_buffer = None
+                        pos = 0
+                        break
+
+                    #chop this packet from the buffer:
+                    if pos==0 and len(read_buffer)==payload_size:
+                        raw_string = read_buffer
                     else:
-                        #no cipher, no padding:
-                        padding = None
-                        payload_size = data_size
-                    assert payload_size>0
-                    read_buffer = read_buffer[8:]
-
-                    if payload_size>self.max_packet_size:
-                        #this packet is seemingly too big, but check again from the main UI thread
-                        #this gives 'set_max_packet_size' a chance to run from "hello"
-                        def check_packet_size(size_to_check, packet_header):
-                            if not self._closed:
-                                debug("check_packet_size(%s, 0x%s) limit is %s", size_to_check, repr_ellipsized(packet_header), self.max_packet_size)
-                                if size_to_check>self.max_packet_size:
-                                    self._call_connection_lost("invalid packet: size requested is %s (maximum allowed is %s - packet header: 0x%s), dropping this connection!" %
-                                                                  (size_to_check, self.max_packet_size, repr_ellipsized(packet_header)))
-                            return False
-                        self.scheduler.timeout_add(1000, check_packet_size, payload_size, read_buffer[:32])
-
-                if bl<payload_size:
-                    # incomplete packet, wait for the rest to arrive
-                    break
-
-                #chop this packet from the buffer:
-                if len(read_buffer)==payload_size:
-                    raw_string = read_buffer
-                    read_buffer = ''
-                else:
-                    raw_string = read_buffer[:payload_size]
-                    read_buffer = read_buffer[payload_size:]
+                        raw_string = read_buffer[pos:pos+payload_size]
+                    pos += payload_size
                 #decrypt if needed:
                 data = raw_string
+                raw_string = None
                 if self.cipher_in and protocol_flags & Protocol.FLAGS_CIPHER:
                     debug("received %s encrypted bytes with %s padding", payload_size, len(padding))
+                    raw_string = bytes(data)
                     data = self.cipher_in.decrypt(raw_string)
                     if padding:
                         def debug_str(s):
@@ -800,9 +1072,13 @@ class Protocol(object):
                         data = data[:-len(padding)]
                 #uncompress if needed:
                 if compression_level>0:
+                    if type(data)==bytearray:
+                        data = buffer_view(data)
                     try:
                         if self.chunked_compression:
-                            if compression_level & LZ4_FLAG:
+                            if compression_level & ZLIB_DICT_FLAG:
+                                data = get_compression_dictionaries().decompress(compression_level & 0x0F, data)
+                            elif compression_level & LZ4_FLAG:
                                 assert has_lz4
                                 data = LZ4_uncompress(data)
                             else:
@@ -811,11 +1087,16 @@ class Protocol(object):
                             data = self._decompressor.decompress(data)
                     except Exception, e:
                         if self.cipher_in:
-                            return self._call_connection_lost("decompression failed (invalid encryption key?): %s" % e)
-                        return self._call_connection_lost("decompression failed: %s" % e)
+                            self._call_connection_lost("decompression failed (invalid encryption key?): %s" % e)
+                        else:
+                            self._call_connection_lost("decompression failed: %s" % e)
+                        return
+                elif type(data)==bytearray:
+                    data = bytes(data)
 
                 if self.cipher_in and not (protocol_flags & Protocol.FLAGS_CIPHER):
-                    return self._call_connection_lost("unencrypted packet dropped: %s" % repr_ellipsized(data))
+                    self._call_connection_lost("unencrypted packet dropped: %s" % repr_ellipsized(data))
+                    return
 
                 if self._closed:
                     return
@@ -825,7 +1106,8 @@ class Protocol(object):
                     payload_size = -1
                     packet_index = 0
                     if len(raw_packets)>=4:
-                        return self._call_connection_lost("too many raw packets: %s" % len(raw_packets))
+                        self._call_connection_lost("too many raw packets: %s" % len(raw_packets))
+                        return
                     continue
                 #final packet (packet_index==0), decode it:
                 try:
@@ -0,0 +1,146 @@
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import time
+import threading
+from collections import deque
+
+from xpra.deque import maxdeque
+from xpra.simple_stats import add_list_stats
+
+#priority lanes, lower values are written out first:
+REALTIME = 0
+NORMAL = 1
+BULK = 2
+LANE_NAMES = {
+              REALTIME  : "realtime",
+              NORMAL    : "normal",
+              BULK      : "bulk",
+              }
+
+#packet types which are latency sensitive:
+REALTIME_PACKETS = ["ping", "ping_echo",
+                    "cursor", "bell",
+                    "key-action", "pointer-position", "button-action", "focus"]
+#packet types which carry large payloads:
+BULK_PACKETS = ["draw", "sound-data"]
+
+
+def get_packet_lane(packet_type):
+    if packet_type in REALTIME_PACKETS:
+        return REALTIME
+    if packet_type in BULK_PACKETS:
+        return BULK
+    return NORMAL
+
+
+class WriteLanes(object):
+    """
+        A queue with one FIFO per priority lane:
+        get() returns the oldest item from the highest priority lane which has one,
+        put() blocks when the lane is full: when it holds 'lane_size' items,
+        or (if set) when the size of its items reaches 'lane_bytes'.
+        So a lane can buffer a burst of small packets (for the writer to coalesce)
+        but never more than one large packet.
+        Items are never re-ordered within a lane.
+    """
+
+    def __init__(self, lane_size=1, lane_bytes=0):
+        self.lane_size = lane_size
+        self.lane_bytes = lane_bytes
+        self.condition = threading.Condition()
+        self.lanes = [deque() for _ in LANE_NAMES]
+        self.sizes = [0 for _ in LANE_NAMES]
+        self.queued = [0 for _ in LANE_NAMES]
+        #how long items spent waiting in each lane (in seconds):
+        self.wait_times = [maxdeque(100) for _ in LANE_NAMES]
+
+    def is_full(self, lane):
+        n = len(self.lanes[lane])
+        return n>=self.lane_size or (n>0 and self.lane_bytes>0 and self.sizes[lane]>=self.lane_bytes)
+
+    def put(self, item, lane=NORMAL, size=0):
+        self.condition.acquire()
+        try:
+            while self.is_full(lane):
+                self.condition.wait()
+            self._append(item, lane, size)
+        finally:
+            self.condition.release()
+
+    def try_put(self, item, lane=NORMAL, size=0):
+        """ adds the item if the lane has room for it, returns False otherwise """
+        self.condition.acquire()
+        try:
+            if self.is_full(lane):
+                return False
+            self._append(item, lane, size)
+            return True
+        finally:
+            self.condition.release()
+
+    def put_nowait(self, item, lane=NORMAL, size=0):
+        """ adds the item even if the lane is full (used for the exit marker) """
+        self.condition.acquire()
+        try:
+            self._append(item, lane, size)
+        finally:
+            self.condition.release()
+
+    def _append(self, item, lane, size):
+        self.lanes[lane].append((item, time.time(), size))
+        self.sizes[lane] += size
+        self.queued[lane] += 1
+        self.condition.notifyAll()
+
+    def get(self):
+        self.condition.acquire()
+        try:
+            while self.empty():
+                self.condition.wait()
+            return self._pop()
+        finally:
+            self.condition.release()
+
+    def get_nowait(self):
+        """ returns the next item, or None if all the lanes are empty """
+        self.condition.acquire()
+        try:
+            if self.empty():
+                return None
+            return self._pop()
+        finally:
+            self.condition.release()
+
+    def _pop(self):
+        for lane in range(len(self.lanes)):
+            q = self.lanes[lane]
+            if len(q)>0:
+                item, queued_at, size = q.popleft()
+                self.sizes[lane] -= size
+                self.wait_times[lane].append(time.time()-queued_at)
+                #wake up any thread waiting for room in this lane:
+                self.condition.notifyAll()
+                return item
+
+    def empty(self):
+        for q in self.lanes:
+            if len(q)>0:
+                return False
+        return True
+
+    def qsize(self):
+        return sum([len(q) for q in self.lanes])
+
+    def get_size(self):
+        """ the size of all the items queued """
+        return sum(self.sizes)
+
+    def add_stats(self, info, prefix="", suffix=""):
+        for lane, name in LANE_NAMES.items():
+            info[prefix+"lane.%s.depth" % name + suffix] = len(self.lanes[lane])
+            info[prefix+"lane.%s.bytes" % name + suffix] = self.sizes[lane]
+            info[prefix+"lane.%s.queued" % name + suffix] = self.queued[lane]
+            add_list_stats(info, prefix+"lane.%s.wait_ms" % name + suffix, [1000.0*x for x in list(self.wait_times[lane])])
@@ -9,7 +9,7 @@ log = Logger()
 
 from xpra.server.gtk_server_base import GTKServerBase
 from xpra.server.shadow_server_base import ShadowServerBase, RootWindowModel
-from xpra.codecs.image_wrapper import ImageWrapper
+from xpra.codecs.image_wrapper import ImageWrapper, get_sub_image
 from xpra.os_util import StringIOClass
 
 import gtk.gdk
@@ -35,18 +35,22 @@ class OSXRootWindowModel(RootWindowModel):
                     CG.kCGWindowListOptionOnScreenOnly,
                     CG.kCGNullWindowID,
                     CG.kCGWindowImageDefault)
-        width = CG.CGImageGetWidth(image)
-        height = CG.CGImageGetHeight(image)
+        screen_width = CG.CGImageGetWidth(image)
+        screen_height = CG.CGImageGetHeight(image)
         bpc = CG.CGImageGetBitsPerComponent(image)
         bpp = CG.CGImageGetBitsPerPixel(image)
         rowstride = CG.CGImageGetBytesPerRow(image)
         alpha = CG.CGImageGetAlphaInfo(image)
         alpha_str = ALPHA.get(alpha, alpha)
         if logger:
-            logger("OSXRootWindowModel.get_image(..) image size: %sx%s, bpc=%s, bpp=%s, rowstride=%s, alpha=%s", width, height, bpc, bpp, rowstride, alpha_str)
+            logger("OSXRootWindowModel.get_image(..) image size: %sx%s, bpc=%s, bpp=%s, rowstride=%s, alpha=%s", screen_width, screen_height, bpc, bpp, rowstride, alpha_str)
         prov = CG.CGImageGetDataProvider(image)
         argb = CG.CGDataProviderCopyData(prov)
-        return ImageWrapper(0, 0, width, height, argb, "BGRX", 24, rowstride)
+        image = ImageWrapper(0, 0, screen_width, screen_height, argb, "BGRX", 24, rowstride)
+        if (x, y, width, height)!=(0, 0, screen_width, screen_height) and x+width<=screen_width and y+height<=screen_height:
+            #we always capture the whole screen, only keep the area requested:
+            image = get_sub_image(image, x, y, width, height)
+        return image
 
     def take_screenshot(self):
         log("grabbing screenshot")
@@ -133,5 +137,6 @@ class ShadowServer(ShadowServerBase, GTKServerBase):
     def get_info(self, proto):
         info = GTKServerBase.get_info(self, proto)
         info["features.shadow"] = True
+        self.add_refresh_info(info)
         info["server.type"] = "Python/gtk2/osx-shadow"
         return info
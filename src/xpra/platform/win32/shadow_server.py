@@ -72,5 +72,6 @@ class ShadowServer(ShadowServerBase, GTKServerBase):
     def get_info(self, proto):
         info = GTKServerBase.get_info(self, proto)
         info["features.shadow"] = True
+        self.add_refresh_info(info)
         info["server.type"] = "Python/gtk2/win32-shadow"
         return info
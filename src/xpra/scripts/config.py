@@ -216,6 +216,7 @@ OPTION_TYPES = {
                     "window-layout"     : str,
                     "display"           : str,
                     "tcp-proxy"         : str,
+                    "bandwidth-limit"   : str,
                     #int options:
                     "quality"           : int,
                     "min-quality"       : int,
@@ -306,6 +307,7 @@ def get_defaults():
                     "window-layout"     : "",
                     "display"           : "",
                     "tcp-proxy"         : "",
+                    "bandwidth-limit"   : "0",
                     "quality"           : -1,
                     "min-quality"       : 50,
                     "speed"             : -1,
@@ -399,6 +401,20 @@ def parse_number(numtype, k, v, auto=-1):
         warn("Warning: cannot parse value '%s' for '%s' as a type %s: %s" % (v, k, numtype, e))
         return None
 
+def parse_bandwidth_limit(v):
+    """ parses a rate in bits per second with an optional unit suffix (ie: "800K", "1.5Mbps") """
+    s = str(v).strip().lower()
+    if s.endswith("bps"):
+        s = s[:-3]
+    multiplier = 1
+    if s and s[-1] in ("k", "m", "g"):
+        multiplier = {"k" : 1000, "m" : 1000*1000, "g" : 1000*1000*1000}[s[-1]]
+        s = s[:-1]
+    limit = int(float(s or 0)*multiplier)
+    if limit<0:
+        raise ValueError("bandwidth limit cannot be negative")
+    return limit
+
 def validate_config(d={}, discard=NO_FILE_OPTIONS):
     """
         Validates all the options given in a dict with fields as keys and
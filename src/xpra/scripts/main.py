@@ -25,7 +25,7 @@ from xpra.platform import init as platform_init
 from xpra.net.bytestreams import TwoFileConnection, SocketConnection
 from xpra.net.protocol import ConnectionClosedException
 from xpra.scripts.config import OPTION_TYPES, ENCRYPTION_CIPHERS, \
-    make_defaults_struct, parse_bool, print_bool, validate_config
+    make_defaults_struct, parse_bool, print_bool, validate_config, parse_bandwidth_limit
 
 
 SOCKET_TIMEOUT = int(os.environ.get("XPRA_SOCKET_TIMEOUT", 10))
@@ -275,14 +275,20 @@ When unspecified, all the available codecs are allowed and the first one is used
                       + " 0.0 to disable."
                       + " Default: %default.")
     group.add_option("-z", "--compress", action="store",
-                      dest="compression_level", type="int", default=defaults.compression_level,
+                      dest="compression_level", type="int", default=None,
                       metavar="LEVEL",
                       help="How hard to work on compressing data."
                       + " You generally do not need to use this option,"
                       + " the default value should be adequate,"
                       + " picture data is compressed separately (see --encoding)."
                       + " 0 to disable compression,"
-                      + " 9 for maximal (slowest) compression. Default: %default.")
+                      + " 9 for maximal (slowest) compression. Default: %s." % defaults.compression_level)
+    group.add_option("--bandwidth-limit", action="store",
+                      dest="bandwidth_limit", default=defaults.bandwidth_limit,
+                      metavar="BITRATE",
+                      help="Limit the rate at which data is sent, in bits per second,"
+                      + " units can be specified (ie: 800K, 5Mbps),"
+                      + " 0 to use the link rate measured automatically. Default: %default.")
 
     group = OptionGroup(parser, "Client Features Options",
                 "These options control client features that affect the appearance or the keyboard.")
@@ -381,6 +387,11 @@ When unspecified, all the available codecs are allowed and the first one is used
 
     options, args = parser.parse_args(cmdline[1:])
 
+    #the adaptive compression is only used if the level was not specified:
+    options.fixed_compression = options.compression_level is not None
+    if options.compression_level is None:
+        options.compression_level = defaults.compression_level
+
     #ensure all the option fields are set even though
     #some options are not shown to the user:
     for k,v in hidden_options.items():
@@ -426,6 +437,10 @@ When unspecified, all the available codecs are allowed and the first one is used
         int(options.dpi)
     except Exception, e:
         parser.error("invalid dpi: %s" % e)
+    try:
+        options.bandwidth_limit = parse_bandwidth_limit(options.bandwidth_limit)
+    except Exception, e:
+        parser.error("invalid bandwidth limit: %s" % e)
     if options.encryption:
         assert len(ENCRYPTION_CIPHERS)>0, "cannot use encryption: no ciphers available"
         if options.encryption not in ENCRYPTION_CIPHERS:
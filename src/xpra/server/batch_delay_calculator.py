@@ -36,7 +36,7 @@ def calculate_batch_delay(wid, window_dimensions, has_focus, is_OR, batch, globa
     low_limit = get_low_limit(global_statistics.mmap_size>0, window_dimensions)
 
     #for each indicator: (description, factor, weight)
-    factors = statistics.get_factors(low_limit, batch.delay)
+    factors = statistics.get_factors(low_limit, batch.delay, global_statistics.link_rate)
     statistics.target_latency = statistics.get_target_client_latency(global_statistics.min_client_latency, global_statistics.avg_client_latency)
     factors += global_statistics.get_factors(statistics.target_latency, low_limit)
     #damage pixels waiting in the packet queue: (extract data for our window id only)
@@ -79,7 +79,7 @@ def update_batch_delay(batch, factors):
         if len(x)!=4:
             log.warn("invalid factor line: %s" % str(x))
     valid_factors = [x for x in factors if x is not None and len(x)==4]
-    all_factors_weight = sum([w for _,_,_,w in valid_factors])
+    all_factors_weight = sum([x[3] for x in valid_factors])
     if all_factors_weight==0:
         log("update_batch_delay: no weights yet!")
         return
@@ -180,6 +180,12 @@ def get_target_quality(wid, window_dimensions, batch, global_statistics, statist
         ref_delay = (batch.START_DELAY*10.0/recs + batch.min_delay*recs) / (recs+10.0/recs)
         batch_q = ref_delay / max(batch.min_delay, batch.delay)
         target = min(1.0, target, batch_q)
+    bandwidth_q = -1
+    send_time = statistics.get_frame_send_time(global_statistics.link_rate)
+    if send_time:
+        #lower the quality when frames take longer to send than the batch delay:
+        bandwidth_q = max(batch.min_delay, batch.delay) / 1000.0 / send_time
+        target = min(target, bandwidth_q)
     latency_q = -1
     if len(global_statistics.client_latency)>0 and global_statistics.recent_client_latency>0:
         latency_q = 3.0 * statistics.target_latency / global_statistics.recent_client_latency
@@ -192,5 +198,6 @@ def get_target_quality(wid, window_dimensions, batch, global_statistics, statist
             "backlog_factor": int(100.0*packets_bl),
             "batch_factor"  : int(100.0*batch_q),
             "latency_factor": int(100.0*latency_q),
+            "bandwidth_factor": int(100.0*bandwidth_q),
             }
     return info, target_quality
@@ -0,0 +1,178 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+A server wide pool of initialized video encoder and csc contexts.
+Creating a context is expensive (tens of milliseconds for x264),
+so instead of freeing them when a window is resized, closed or changes colourspace,
+the window sources give them back to the pool and borrow from it when they need a new pipeline.
+The contexts are keyed by the caller (type, dimensions, pixel formats, etc),
+the ones which have not been used for a while are freed,
+and we never keep more than the (estimated) maximum size.
+See WindowVideoSource.setup_pipeline
+"""
+
+import os
+import time
+from threading import Lock
+
+from xpra.server.background_worker import add_work_item
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_CODEC_POOL_DEBUG")
+
+CODEC_POOL = os.environ.get("XPRA_CODEC_POOL", "1")=="1"
+#maximum (estimated) size of the idle contexts we keep (in MB):
+CODEC_POOL_SIZE = int(os.environ.get("XPRA_CODEC_POOL_SIZE", "256"))*1024*1024
+#contexts which have not been used for this long (in seconds) are freed:
+CODEC_POOL_IDLE = float(os.environ.get("XPRA_CODEC_POOL_IDLE", "30"))
+#rough memory usage per pixel, encoders hold reference frames:
+ENCODER_BYTES_PER_PIXEL = 8
+CSC_BYTES_PER_PIXEL = 2
+
+
+def get_context_size(width, height, is_encoder):
+    if is_encoder:
+        return width*height*ENCODER_BYTES_PER_PIXEL
+    return width*height*CSC_BYTES_PER_PIXEL
+
+
+class CodecPool(object):
+
+    def __init__(self, max_size=CODEC_POOL_SIZE, idle_timeout=CODEC_POOL_IDLE):
+        self.lock = Lock()
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.contexts = {}          #key -> [(context, size, time released), ..]
+        self.size = 0
+        self.last_expire = 0
+        self.hits = 0
+        self.misses = 0
+        self.released = 0
+        self.dropped = 0
+        self.expired = 0
+
+    def __len__(self):
+        return sum(len(x) for x in self.contexts.values())
+
+    def get(self, key):
+        """ returns an idle context for this key, or None """
+        self.lock.acquire()
+        try:
+            contexts = self.contexts.get(key)
+            if not contexts:
+                self.misses += 1
+                return None
+            context, size, _ = contexts.pop()
+            if not contexts:
+                del self.contexts[key]
+            self.size -= size
+            self.hits += 1
+            debug("CodecPool.get(%s)=%s", key, context)
+            return context
+        finally:
+            self.lock.release()
+
+    def release(self, key, context, size):
+        """
+            Gives the context back to the pool, the caller must not use it afterwards.
+            The context is freed (in the worker thread) if we cannot keep it.
+        """
+        now = time.time()
+        freed = []
+        self.lock.acquire()
+        try:
+            self.released += 1
+            if now-self.last_expire>=1:
+                freed += self.do_expire(now)
+            if self.size+size>self.max_size:
+                self.dropped += 1
+                freed.append(context)
+            else:
+                self.contexts.setdefault(key, []).append((context, size, now))
+                self.size += size
+                debug("CodecPool.release(%s, %s, %s) pool size=%s", key, context, size, self.size)
+        finally:
+            self.lock.release()
+        for x in freed:
+            add_work_item(x.clean)
+
+    def expire(self):
+        """ frees the idle contexts, called periodically from the main thread """
+        self.lock.acquire()
+        try:
+            freed = self.do_expire(time.time())
+        finally:
+            self.lock.release()
+        for x in freed:
+            add_work_item(x.clean)
+        return True
+
+    def do_expire(self, now):
+        #must be called with the lock held, returns the contexts to free
+        self.last_expire = now
+        limit = now-self.idle_timeout
+        freed = []
+        for key, contexts in list(self.contexts.items()):
+            #contexts are in release order, so the idle ones are first:
+            n = 0
+            while n<len(contexts) and contexts[n][2]<limit:
+                context, size, _ = contexts[n]
+                freed.append(context)
+                self.size -= size
+                n += 1
+            if n>0:
+                del contexts[:n]
+                self.expired += n
+                debug("CodecPool.expire() freeing %s contexts for %s", n, key)
+            if not contexts:
+                del self.contexts[key]
+        return freed
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            freed = []
+            for contexts in self.contexts.values():
+                freed += [x[0] for x in contexts]
+            self.contexts = {}
+            self.size = 0
+        finally:
+            self.lock.release()
+        for x in freed:
+            add_work_item(x.clean)
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"contexts" + suffix] = len(self)
+        info[prefix+"keys" + suffix] = len(self.contexts)
+        info[prefix+"size" + suffix] = self.size
+        info[prefix+"max_size" + suffix] = self.max_size
+        info[prefix+"idle_timeout" + suffix] = self.idle_timeout
+        info[prefix+"hits" + suffix] = self.hits
+        info[prefix+"misses" + suffix] = self.misses
+        info[prefix+"released" + suffix] = self.released
+        info[prefix+"dropped" + suffix] = self.dropped
+        info[prefix+"expired" + suffix] = self.expired
+        lookups = self.hits+self.misses
+        if lookups>0:
+            info[prefix+"hit_rate" + suffix] = int(100*self.hits/lookups)
+
+
+#only one pool per process:
+singleton = None
+lock = Lock()
+
+def get_codec_pool():
+    global singleton
+    if singleton is not None:
+        return singleton
+    lock.acquire()
+    try:
+        if singleton is None:
+            singleton = CodecPool()
+        return singleton
+    finally:
+        lock.release()
@@ -0,0 +1,183 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Guesses the type of content a window is showing by sampling the pixels of the frames we send:
+the number of distinct colours, the density of sharp edges and how much the pixels
+have changed since the previous frame of the same geometry.
+The classifications are accumulated per window with scores which decay over time,
+see WindowSource.get_content_encoding
+"""
+
+import os
+import time
+from threading import Lock
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_CLASSIFIER_DEBUG")
+
+CONTENT_CLASSIFIER = os.environ.get("XPRA_CONTENT_CLASSIFIER", "1")=="1"
+#the scores are halved every HALF_LIFE seconds:
+HALF_LIFE = float(os.environ.get("XPRA_CLASSIFIER_HALF_LIFE", "2"))
+#the sampling grid, the cost does not depend on the size of the image:
+SAMPLE_ROWS = 24
+SAMPLE_COLUMNS = 24
+#images smaller than this do not tell us much:
+MIN_PIXELS = 64*64
+#the sum of the differences between two neighbouring pixels' channels for a sharp edge:
+EDGE_THRESHOLD = 96
+#the share of the total score the best content type must have:
+MIN_CONFIDENCE = 0.6
+
+FLAT = "flat"           #few colours, few edges (window decorations, toolbars, flat areas)
+TEXT = "text"           #few colours, sharp edges (terminals, documents, code)
+PHOTO = "photo"         #many colours (pictures, gradients)
+VIDEO = "video"         #many colours, changing on every frame
+CONTENT_TYPES = (FLAT, TEXT, PHOTO, VIDEO)
+
+
+def sample_image(image):
+    """
+        Returns the values of the pixels sampled on a fixed grid
+        and the number of sharp edges found between these pixels and their right neighbour.
+    """
+    w = image.get_width()
+    h = image.get_height()
+    pixels = image.get_pixels()
+    rowstride = image.get_rowstride()
+    Bpp = len(image.get_pixel_format())
+    rows = min(h, SAMPLE_ROWS)
+    cols = min(w-1, SAMPLE_COLUMNS)
+    samples = []
+    edges = 0
+    if rows<=0 or cols<=0:
+        return samples, edges
+    offsets = [(i*(w-1)//cols)*Bpp for i in range(cols)]
+    for j in range(rows):
+        y = j*h//rows
+        row = bytearray(buffer(pixels, y*rowstride, w*Bpp))
+        for o in offsets:
+            #we ignore the 4th channel (alpha or padding)
+            samples.append(row[o] | (row[o+1]<<8) | (row[o+2]<<16))
+            if abs(row[o]-row[o+Bpp])+abs(row[o+1]-row[o+Bpp+1])+abs(row[o+2]-row[o+Bpp+2])>EDGE_THRESHOLD:
+                edges += 1
+    return samples, edges
+
+
+def classify_samples(samples, edges, previous=None):
+    """
+        Returns the content type for the given samples,
+        and the metrics used: (colours ratio, edges ratio, similarity)
+        where similarity is None if we don't have the previous samples.
+    """
+    n = len(samples)
+    colours = float(len(set(samples)))/n
+    edge_ratio = float(edges)/n
+    similarity = None
+    if previous is not None and len(previous)==n:
+        same = 0
+        for i in range(n):
+            if samples[i]==previous[i]:
+                same += 1
+        similarity = float(same)/n
+    if colours<=0.05 and edge_ratio<0.02:
+        content = FLAT
+    elif colours<=0.25:
+        content = TEXT
+    elif similarity is not None and similarity<0.5:
+        content = VIDEO
+    else:
+        content = PHOTO
+    return content, (colours, edge_ratio, similarity)
+
+
+class ContentClassifier(object):
+
+    def __init__(self, half_life=HALF_LIFE):
+        self.lock = Lock()
+        self.half_life = half_life
+        self.scores = {}
+        self.last_update = 0
+        self.last_samples = None        #(geometry, samples)
+        self.last_metrics = None
+        self.classified = 0
+        self.sample_time = 0
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.scores = {}
+            self.last_samples = None
+        finally:
+            self.lock.release()
+
+    def decayed_scores(self, now):
+        if not self.scores:
+            return {}
+        factor = 0.5**(max(0, now-self.last_update)/self.half_life)
+        return dict((k, v*factor) for k,v in self.scores.items())
+
+    def update(self, image):
+        """ samples the image and records its classification, can be called from any thread """
+        x, y, w, h = image.get_geometry()[:4]
+        if w*h<MIN_PIXELS:
+            return None
+        start = time.time()
+        samples, edges = sample_image(image)
+        if not samples:
+            return None
+        geometry = (x, y, w, h)
+        self.lock.acquire()
+        try:
+            previous = None
+            if self.last_samples and self.last_samples[0]==geometry:
+                previous = self.last_samples[1]
+            content, metrics = classify_samples(samples, edges, previous)
+            now = time.time()
+            scores = self.decayed_scores(now)
+            #larger areas carry more weight:
+            scores[content] = scores.get(content, 0)+min(1.0, float(w*h)/(256*256))
+            self.scores = scores
+            self.last_update = now
+            self.last_samples = geometry, samples
+            self.last_metrics = metrics
+            self.classified += 1
+            self.sample_time += now-start
+        finally:
+            self.lock.release()
+        debug("ContentClassifier.update(%s)=%s, metrics=%s, took %.2fms", image, content, metrics, 1000.0*(now-start))
+        return content
+
+    def get_content(self):
+        """ returns the content type the window is most likely to be showing, or None if we are not sure """
+        self.lock.acquire()
+        try:
+            scores = self.decayed_scores(time.time())
+        finally:
+            self.lock.release()
+        total = sum(scores.values())
+        if total<1.0:
+            return None
+        content = max(scores.keys(), key=lambda k : scores[k])
+        if scores[content]<total*MIN_CONFIDENCE:
+            return None
+        return content
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"content" + suffix] = self.get_content() or ""
+        info[prefix+"classified" + suffix] = self.classified
+        if self.classified>0:
+            info[prefix+"sample_time" + suffix] = int(1000000*self.sample_time/self.classified)
+        scores = self.decayed_scores(time.time())
+        for content in CONTENT_TYPES:
+            info[prefix+"score.%s" % content + suffix] = int(100*scores.get(content, 0))
+        if self.last_metrics:
+            colours, edges, similarity = self.last_metrics
+            info[prefix+"colours" + suffix] = int(100*colours)
+            info[prefix+"edges" + suffix] = int(100*edges)
+            if similarity is not None:
+                info[prefix+"similarity" + suffix] = int(100*similarity)
@@ -0,0 +1,263 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Rectangle region functions, see region.py
+# (this is the cython version of pyregion.py, keep them in sync)
+
+import heapq
+
+
+cdef inline int imin(int a, int b):
+    if a<b:
+        return a
+    return b
+
+cdef inline int imax(int a, int b):
+    if a>b:
+        return a
+    return b
+
+
+cdef class rectangle:
+    cdef readonly int x
+    cdef readonly int y
+    cdef readonly int width
+    cdef readonly int height
+
+    def __init__(self, int x, int y, int width, int height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return "R(%s, %s, %s, %s)" % (self.x, self.y, self.width, self.height)
+
+    def __richcmp__(self, other, int op):
+        if op not in (2, 3):
+            return NotImplemented
+        equal = isinstance(other, rectangle) and self.get_geometry()==other.get_geometry()
+        if op==2:
+            return equal
+        return not equal
+
+    def __hash__(self):
+        return hash(self.get_geometry())
+
+    def get_geometry(self):
+        return self.x, self.y, self.width, self.height
+
+    def area(self):
+        return self.width*self.height
+
+    cdef int _intersects(self, int x, int y, int w, int h):
+        return self.x<x+w and x<self.x+self.width and self.y<y+h and y<self.y+self.height
+
+    cdef int _contains(self, int x, int y, int w, int h):
+        return self.x<=x and self.y<=y and self.x+self.width>=x+w and self.y+self.height>=y+h
+
+    def intersects(self, int x, int y, int w, int h):
+        return bool(self._intersects(x, y, w, h))
+
+    def contains(self, int x, int y, int w, int h):
+        return bool(self._contains(x, y, w, h))
+
+    def intersection(self, int x, int y, int w, int h):
+        """ returns the rectangle common to both, or None """
+        cdef int x1 = imax(self.x, x)
+        cdef int y1 = imax(self.y, y)
+        cdef int x2 = imin(self.x+self.width, x+w)
+        cdef int y2 = imin(self.y+self.height, y+h)
+        if x2<=x1 or y2<=y1:
+            return None
+        return rectangle(x1, y1, x2-x1, y2-y1)
+
+    def subtract(self, int x, int y, int w, int h):
+        """ returns the list of rectangles covering this one minus the area given (up to 4) """
+        if not self._intersects(x, y, w, h):
+            return [self]
+        rects = []
+        cdef int sx2 = self.x+self.width
+        cdef int sy2 = self.y+self.height
+        #band above:
+        if y>self.y:
+            rects.append(rectangle(self.x, self.y, self.width, y-self.y))
+        #band below:
+        if y+h<sy2:
+            rects.append(rectangle(self.x, y+h, self.width, sy2-(y+h)))
+        #left and right parts of the middle band:
+        cdef int my1 = imax(self.y, y)
+        cdef int my2 = imin(sy2, y+h)
+        if x>self.x:
+            rects.append(rectangle(self.x, my1, x-self.x, my2-my1))
+        if x+w<sx2:
+            rects.append(rectangle(x+w, my1, sx2-(x+w), my2-my1))
+        return rects
+
+
+cdef long _merge_cost(rectangle r1, rectangle r2):
+    cdef int x1 = imin(r1.x, r2.x)
+    cdef int y1 = imin(r1.y, r2.y)
+    cdef int x2 = imax(r1.x+r1.width, r2.x+r2.width)
+    cdef int y2 = imax(r1.y+r1.height, r2.y+r2.height)
+    return (<long> (x2-x1))*(y2-y1) - (<long> r1.width)*r1.height - (<long> r2.width)*r2.height
+
+def merge_cost(rectangle r1, rectangle r2):
+    """ the number of pixels we would send for nothing if we sent the bounding box of both rectangles """
+    return _merge_cost(r1, r2)
+
+
+cdef class region:
+    """ a list of rectangles which never overlap """
+    cdef public object rectangles
+
+    def __init__(self, rectangles=[]):
+        self.rectangles = []
+        for r in rectangles:
+            self.add(*r.get_geometry())
+
+    def __repr__(self):
+        return "region(%s)" % self.rectangles
+
+    def __len__(self):
+        return len(self.rectangles)
+
+    def add(self, int x, int y, int w, int h):
+        """ union with the given rectangle """
+        if w<=0 or h<=0:
+            return
+        cdef rectangle r
+        rects = []
+        for r in self.rectangles:
+            if r._contains(x, y, w, h):
+                #already covered
+                return
+            if not r._intersects(x, y, w, h):
+                rects.append(r)
+            elif not (x<=r.x and y<=r.y and x+w>=r.x+r.width and y+h>=r.y+r.height):
+                rects += r.subtract(x, y, w, h)
+            #(rectangles contained in the new one are dropped)
+        rects.append(rectangle(x, y, w, h))
+        self.rectangles = rects
+
+    def subtract(self, int x, int y, int w, int h):
+        cdef rectangle r
+        rects = []
+        for r in self.rectangles:
+            rects += r.subtract(x, y, w, h)
+        self.rectangles = rects
+
+    def intersect(self, int x, int y, int w, int h):
+        cdef rectangle r
+        rects = []
+        for r in self.rectangles:
+            i = r.intersection(x, y, w, h)
+            if i:
+                rects.append(i)
+        self.rectangles = rects
+
+    def get_bounds(self):
+        if not self.rectangles:
+            return None
+        cdef rectangle r = self.rectangles[0]
+        cdef int x1 = r.x, y1 = r.y, x2 = r.x+r.width, y2 = r.y+r.height
+        for r in self.rectangles:
+            x1 = imin(x1, r.x)
+            y1 = imin(y1, r.y)
+            x2 = imax(x2, r.x+r.width)
+            y2 = imax(y2, r.y+r.height)
+        return rectangle(x1, y1, x2-x1, y2-y1)
+
+    def get_area(self):
+        cdef rectangle r
+        cdef long area = 0
+        for r in self.rectangles:
+            area += (<long> r.width)*r.height
+        return area
+
+    def merge(self, long packet_cost):
+        """
+            Replaces pairs of rectangles with their bounding box
+            whenever the extra pixels this would send cost less than
+            sending an extra packet (the cost is expressed in pixels).
+            The cheapest merges are done first,
+            and each merge removes at least one rectangle.
+        """
+        if len(self.rectangles)<2:
+            return
+        cdef rectangle r, o, r1, r2
+        cdef long cost, area
+        cdef int x1, y1, x2, y2
+        cdef int counter = 0
+        live = {}           #index -> rectangle
+        candidates = []     #heap of (cost, index1, index2)
+        pending = list(self.rectangles)
+        while True:
+            for r in pending:
+                for i, o in live.items():
+                    cost = _merge_cost(r, o)
+                    if cost<=packet_cost:
+                        heapq.heappush(candidates, (cost, i, counter))
+                live[counter] = r
+                counter += 1
+            pending = []
+            if not candidates:
+                break
+            _, i, j = heapq.heappop(candidates)
+            r1 = live.get(i)
+            r2 = live.get(j)
+            if r1 is None or r2 is None:
+                #one of them has already been merged
+                continue
+            x1 = imin(r1.x, r2.x)
+            y1 = imin(r1.y, r2.y)
+            x2 = imax(r1.x+r1.width, r2.x+r2.width)
+            y2 = imax(r1.y+r1.height, r2.y+r2.height)
+            #the bounding box may overlap other rectangles,
+            #those must be merged too (so we never split rectangles here):
+            merged = set([i, j])
+            area = (<long> r1.width)*r1.height + (<long> r2.width)*r2.height
+            grown = True
+            while grown:
+                grown = False
+                for k, r in live.items():
+                    if k not in merged and r._intersects(x1, y1, x2-x1, y2-y1):
+                        merged.add(k)
+                        area += (<long> r.width)*r.height
+                        x1 = imin(x1, r.x)
+                        y1 = imin(y1, r.y)
+                        x2 = imax(x2, r.x+r.width)
+                        y2 = imax(y2, r.y+r.height)
+                        grown = True
+            if (<long> (x2-x1))*(y2-y1)-area>packet_cost:
+                #no longer worth it
+                continue
+            for k in merged:
+                del live[k]
+            pending.append(rectangle(x1, y1, x2-x1, y2-y1))
+        self.rectangles = [r for _,r in sorted(live.items())]
+
+
+def new_region():
+    return region()
+
+def add_rectangle(region r, int x, int y, int w, int h):
+    r.add(x, y, w, h)
+
+def subtract_rectangle(region r, int x, int y, int w, int h):
+    r.subtract(x, y, w, h)
+
+def intersect_rectangle(region r, int x, int y, int w, int h):
+    r.intersect(x, y, w, h)
+
+def get_rectangles(region r):
+    return r.rectangles
+
+def get_bounds(region r):
+    return r.get_bounds()
+
+def merge_rectangles(region r, long packet_cost):
+    r.merge(packet_cost)
@@ -0,0 +1,122 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+import os
+import time
+from threading import Lock
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_ENCODE_WORKERS_DEBUG")
+
+from xpra.os_util import Queue
+from xpra.daemon_thread import make_daemon_thread
+
+NOYIELD = os.environ.get("XPRA_YIELD") is None
+
+
+def get_default_workers():
+    try:
+        import multiprocessing
+        cpus = multiprocessing.cpu_count()
+    except:
+        cpus = 1
+    return max(1, min(4, cpus//2))
+
+#number of encoding threads for each client connection:
+ENCODE_WORKERS = int(os.environ.get("XPRA_ENCODE_WORKERS", get_default_workers()))
+
+
+class EncodeWorker(object):
+    """ a thread running the encoding callbacks of the windows assigned to it, in order """
+
+    def __init__(self, index, is_closed):
+        self.index = index
+        self.is_closed = is_closed
+        self.items = Queue()
+        self.keys = set()
+        self.processed = 0
+        self.busy_time = 0.0
+        self.thread = make_daemon_thread(self.run, "encode-%s" % index)
+        self.thread.start()
+
+    def run(self):
+        debug("EncodeWorker(%s).run() starting", self.index)
+        while not self.is_closed():
+            item = self.items.get(True)
+            if item is None:
+                break               #empty marker
+            start = time.time()
+            try:
+                item()
+            except Exception, e:
+                log.error("error processing damage data: %s", e, exc_info=True)
+            self.busy_time += time.time()-start
+            self.processed += 1
+            NOYIELD or time.sleep(0)
+        debug("EncodeWorker(%s).run() ended", self.index)
+
+
+class EncodeWorkerPool(object):
+    """
+        Runs the damage processing callbacks on a fixed number of threads.
+        All the callbacks queued with the same key (the window id)
+        run on the same worker, so the frames of a window stay in order
+        and its encoder state is never accessed concurrently,
+        whilst different windows can be encoded in parallel.
+    """
+
+    def __init__(self, nworkers, is_closed):
+        self.lock = Lock()
+        self.workers = [EncodeWorker(i, is_closed) for i in range(max(1, nworkers))]
+        self.assigned = {}
+
+    def get_worker(self, key):
+        worker = self.assigned.get(key)
+        if worker:
+            return worker
+        self.lock.acquire()
+        try:
+            worker = self.assigned.get(key)
+            if worker is None:
+                #pick the worker with the fewest windows, then the shortest queue:
+                worker = min(self.workers, key=lambda w : (len(w.keys), w.items.qsize()))
+                worker.keys.add(key)
+                self.assigned[key] = worker
+                debug("assigned %s to encode worker %s", key, worker.index)
+            return worker
+        finally:
+            self.lock.release()
+
+    def add(self, key, item):
+        self.get_worker(key).items.put(item)
+
+    def remove(self, key):
+        """ the window is gone, the next window using this key may be assigned to another worker """
+        self.lock.acquire()
+        try:
+            worker = self.assigned.get(key)
+            if worker:
+                del self.assigned[key]
+                worker.keys.discard(key)
+        finally:
+            self.lock.release()
+
+    def qsize(self):
+        return sum([w.items.qsize() for w in self.workers])
+
+    def stop(self):
+        for w in self.workers:
+            w.items.put(None, block=False)
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"workers" + suffix] = len(self.workers)
+        for w in self.workers:
+            p = prefix+"worker[%s]." % w.index
+            info[p+"queue.current" + suffix] = w.items.qsize()
+            info[p+"windows" + suffix] = len(w.keys)
+            info[p+"processed" + suffix] = w.processed
+            info[p+"busy_ms" + suffix] = int(1000.0*w.busy_time)
@@ -0,0 +1,188 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+A server wide cache of encoded frames,
+so when several clients are showing the same window,
+the same damage region is only compressed once.
+The cache is only used when more than one client is connected.
+"""
+
+import os
+import time
+import zlib
+from collections import deque
+from threading import Lock, Event
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_FRAME_CACHE_DEBUG")
+
+FRAME_CACHE = os.environ.get("XPRA_FRAME_CACHE", "1")=="1"
+#maximum size of the compressed data we keep (in MB):
+FRAME_CACHE_SIZE = int(os.environ.get("XPRA_FRAME_CACHE_SIZE", "64"))*1024*1024
+#frames are only shared between clients which update at about the same time:
+FRAME_CACHE_TTL = float(os.environ.get("XPRA_FRAME_CACHE_TTL", "2"))
+#how long to wait for another client to finish encoding the same frame:
+PENDING_TIMEOUT = 1.0
+#only the stateless encodings can be shared:
+CACHEABLE_ENCODINGS = ("png", "png/L", "png/P", "jpeg", "webp", "rgb24", "rgb32")
+#lossy encodings using a quality within the same bucket share frames:
+QUALITY_BUCKET = 10
+
+
+def pixels_checksum(image):
+    pixels = image.get_pixels()
+    return zlib.crc32(pixels) & 0xffffffff
+
+
+class CacheEntry(object):
+
+    def __init__(self):
+        self.created = time.time()
+        self.ready = Event()
+        self.value = None
+        self.size = 0
+        self.hits = 0
+
+
+class EncodedFrameCache(object):
+
+    def __init__(self, max_size=FRAME_CACHE_SIZE, ttl=FRAME_CACHE_TTL):
+        self.lock = Lock()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = {}
+        self.order = deque()
+        self.size = 0
+        self.users = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def add_user(self):
+        self.lock.acquire()
+        try:
+            self.users += 1
+        finally:
+            self.lock.release()
+
+    def remove_user(self):
+        self.lock.acquire()
+        try:
+            self.users -= 1
+            if self.users<=1:
+                #nothing left to share:
+                self.entries = {}
+                self.order.clear()
+                self.size = 0
+        finally:
+            self.lock.release()
+
+    def is_active(self):
+        return self.users>1
+
+    def get_or_encode(self, key, encode):
+        """
+            Returns the cached value for this key,
+            or calls encode() to produce it and stores it for the other clients.
+            If another client is already encoding the same frame, we wait for it.
+        """
+        self.lock.acquire()
+        try:
+            self.expire()
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = CacheEntry()
+                self.entries[key] = entry
+                self.order.append(key)
+                owner = True
+            else:
+                owner = False
+        finally:
+            self.lock.release()
+        if not owner:
+            entry.ready.wait(PENDING_TIMEOUT)
+            value = entry.value
+            if value is not None:
+                entry.hits += 1
+                self.hits += 1
+                self.bytes_saved += entry.size
+                debug("frame cache hit for %s", key)
+                return value
+            #the other client failed or took too long, encode it ourselves:
+            return encode()
+        self.misses += 1
+        try:
+            value = encode()
+            if value is not None:
+                entry.value = value
+                entry.size = len(value[1] or "")
+                self.lock.acquire()
+                try:
+                    #(the cache may have been cleared whilst we were encoding)
+                    if self.entries.get(key) is entry:
+                        self.size += entry.size
+                        while self.size>self.max_size and len(self.order)>0:
+                            self.remove(self.order[0])
+                finally:
+                    self.lock.release()
+            return value
+        finally:
+            if entry.value is None:
+                self.lock.acquire()
+                try:
+                    if self.entries.get(key) is entry:
+                        self.remove(key)
+                finally:
+                    self.lock.release()
+            entry.ready.set()
+
+    def expire(self):
+        #entries are in creation order, so we can stop at the first one which is still valid:
+        limit = time.time()-self.ttl
+        while len(self.order)>0:
+            entry = self.entries.get(self.order[0])
+            if entry is not None and entry.created>limit:
+                break
+            self.remove(self.order[0])
+
+    def remove(self, key):
+        try:
+            self.order.remove(key)
+        except ValueError:
+            pass
+        entry = self.entries.get(key)
+        if entry:
+            del self.entries[key]
+            self.size -= entry.size
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"enabled" + suffix] = self.is_active()
+        info[prefix+"entries" + suffix] = len(self.entries)
+        info[prefix+"size" + suffix] = self.size
+        info[prefix+"hits" + suffix] = self.hits
+        info[prefix+"misses" + suffix] = self.misses
+        info[prefix+"bytes_saved" + suffix] = self.bytes_saved
+
+
+#only one cache per server:
+singleton = None
+lock = Lock()
+
+def get_frame_cache():
+    global singleton
+    if not FRAME_CACHE:
+        return None
+    if singleton is not None:
+        return singleton
+    lock.acquire()
+    try:
+        if singleton is None:
+            singleton = EncodedFrameCache()
+        return singleton
+    finally:
+        lock.release()
@@ -18,6 +18,7 @@ debug = debug_if_env(log, "XPRA_PROXY_DEBUG")
 from xpra.server.server_core import get_server_info, get_thread_info
 from xpra.scripts.server import deadly_signal
 from xpra.net.protocol import Protocol, Compressed, compressed_wrapper, new_cipher_caps, get_network_caps
+from xpra.net.io_engine import make_protocol
 from xpra.codecs.image_wrapper import ImageWrapper
 from xpra.os_util import Queue, SIGNAMES
 from xpra.util import typedict
@@ -29,6 +30,19 @@ from multiprocessing import Process
 PROXY_QUEUE_SIZE = int(os.environ.get("XPRA_PROXY_QUEUE_SIZE", "10"))
 #for testing only: passthrough as RGB:
 PASSTHROUGH = False
+#let the server write to the client's mmap area when they are both local:
+PROXY_MMAP = os.environ.get("XPRA_PROXY_MMAP", "1")=="1"
+LOCAL_ADDRESSES = ("127.0.0.1", "::1", "localhost")
+
+
+def is_local_connection(conn):
+    """ unix domain sockets and tcp connections to the loopback interface """
+    if conn.info=="unix-domain":
+        return True
+    if conn.info=="tcp":
+        remote = getattr(conn, "remote", None)
+        return type(remote)==tuple and len(remote)>=2 and remote[0] in LOCAL_ADDRESSES
+    return False
 
 
 class ProxyInstanceProcess(Process):
@@ -53,6 +67,8 @@ class ProxyInstanceProcess(Process):
         self.video_encoder_types = ["nvenc", "x264"]
         self.video_encoders = {}
         self.video_helper = None
+        self.mmap_passthrough = False           #the client's mmap file is passed to the server
+        self.mmap_enabled = False               #the server is using it
 
     def server_message_queue(self):
         while True:
@@ -114,14 +130,16 @@ class ProxyInstanceProcess(Process):
         #setup protocol wrappers:
         self.server_packets = Queue(PROXY_QUEUE_SIZE)
         self.client_packets = Queue(PROXY_QUEUE_SIZE)
-        self.client_protocol = Protocol(self, self.client_conn, self.process_client_packet, self.get_client_packet)
+        self.client_protocol = make_protocol(self, self.client_conn, self.process_client_packet, self.get_client_packet)
         self.client_protocol.restore_state(self.client_state)
-        self.server_protocol = Protocol(self, self.server_conn, self.process_server_packet, self.get_server_packet)
+        self.server_protocol = make_protocol(self, self.server_conn, self.process_server_packet, self.get_server_packet)
         #server connection tweaks:
         self.server_protocol.large_packets.append("draw")
         self.server_protocol.large_packets.append("keymap-changed")
         self.server_protocol.large_packets.append("server-settings")
-        self.server_protocol.set_compression_level(self.session_options.get("compression_level", 0))
+        level = self.session_options.get("compression_level", 0)
+        self.server_protocol.set_compression_level(level)
+        self.server_protocol.fixed_compression = "compression_level" in self.session_options
 
         debug("starting network threads")
         self.server_protocol.start()
@@ -160,6 +178,9 @@ class ProxyInstanceProcess(Process):
         fc = self.filter_caps(caps, ("cipher", "digest", "aliases", "compression", "lz4"))
         #update with options provided via config if any:
         fc.update(self.session_options)
+        if "compression_level" in self.session_options:
+            fc["compression_level.fixed"] = True
+        self.filter_mmap_caps(caps, fc)
         if self.video_encoder_types:
             #pass list of encoding specs to client:
             from xpra.codecs.video_helper import getVideoHelper
@@ -194,9 +215,40 @@ class ProxyInstanceProcess(Process):
             fc["encoding.proxy.video"] = True
         return fc
 
+    def filter_mmap_caps(self, caps, fc):
+        """
+            The mmap draw packets only contain offsets in the client's mmap area,
+            so if the server can write to this area directly we just forward them.
+            Otherwise we remove the mmap capabilities so the server sends us
+            the pixels, which we relay to the client.
+        """
+        mmap_file = caps.strget("mmap_file")
+        if not mmap_file:
+            return
+        reason = None
+        if not PROXY_MMAP:
+            reason = "disabled"
+        elif not is_local_connection(self.client_conn):
+            reason = "the client connection is not local: %s" % self.client_conn
+        elif not is_local_connection(self.server_conn):
+            reason = "the server connection is not local: %s" % self.server_conn
+        elif not os.path.exists(mmap_file):
+            reason = "cannot find the mmap file %s" % mmap_file
+        elif not os.access(mmap_file, os.R_OK | os.W_OK):
+            #we run as the user owning the server, so the server cannot use it either:
+            reason = "cannot access the mmap file %s" % mmap_file
+        if reason:
+            log.info("not passing the mmap area through the proxy: %s", reason)
+            for k in [k for k in fc.keys() if k.startswith("mmap")]:
+                del fc[k]
+            return
+        log.info("passing the client's mmap area %s through to the server", mmap_file)
+        self.mmap_passthrough = True
+
     def filter_server_caps(self, caps):
         if caps.get("rencode", False):
             self.server_protocol.enable_rencode()
+        self.server_protocol.set_peer_dictionaries(caps.dictget("zlib.dictionaries"))
         return self.filter_caps(caps, ("aliases", ))
 
     def filter_caps(self, caps, prefixes):
@@ -282,6 +334,8 @@ class ProxyInstanceProcess(Process):
             c = typedict(packet[1])
             maxw, maxh = c.intpair("max_desktop_size", (4096, 4096))
             proto.max_packet_size = maxw*maxh*4
+            self.mmap_enabled = self.mmap_passthrough and c.boolget("mmap_enabled")
+            debug("mmap passthrough=%s, enabled by the server=%s", self.mmap_passthrough, self.mmap_enabled)
 
             caps = self.filter_server_caps(c)
             #add new encryption caps:
@@ -321,7 +375,8 @@ class ProxyInstanceProcess(Process):
         wid, x, y, width, height, encoding, pixels, _, rowstride, client_options = packet[1:11]
 
         if encoding=="mmap":
-            #never modify mmap packets
+            #the server has written the pixels to the client's mmap area,
+            #the packet only contains the offsets: never modify it
             return
         if not self.video_encoder_types or not client_options or not client_options.get("proxy", False):
             #ensure we don't try to re-compress the pixel data in the network layer:
@@ -394,7 +449,8 @@ class ProxyInstanceProcess(Process):
         raise Exception("no encoder found for encoding %s and rgb format %s" % (encoding, rgb_format))
 
     def get_encoder_info(self):
-        info = {}
+        info = {"proxy.mmap.passthrough"    : self.mmap_passthrough,
+                "proxy.mmap.enabled"        : self.mmap_enabled}
         for wid, encoder in list(self.video_encoders.items()):
             ipath = "window[%s].proxy.encoder" % wid
             info[ipath] = encoder.get_type()
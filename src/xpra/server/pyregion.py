@@ -0,0 +1,223 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Rectangle region functions, see region.py
+# (the cython version in cyregion.pyx must be kept in sync with this one)
+
+import heapq
+
+
+class rectangle(object):
+    __slots__ = ("x", "y", "width", "height")
+
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return "R(%s, %s, %s, %s)" % (self.x, self.y, self.width, self.height)
+
+    def __eq__(self, other):
+        return isinstance(other, rectangle) and self.get_geometry()==other.get_geometry()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.get_geometry())
+
+    def get_geometry(self):
+        return self.x, self.y, self.width, self.height
+
+    def area(self):
+        return self.width*self.height
+
+    def intersects(self, x, y, w, h):
+        return self.x<x+w and x<self.x+self.width and self.y<y+h and y<self.y+self.height
+
+    def contains(self, x, y, w, h):
+        return self.x<=x and self.y<=y and self.x+self.width>=x+w and self.y+self.height>=y+h
+
+    def intersection(self, x, y, w, h):
+        """ returns the rectangle common to both, or None """
+        x1 = max(self.x, x)
+        y1 = max(self.y, y)
+        x2 = min(self.x+self.width, x+w)
+        y2 = min(self.y+self.height, y+h)
+        if x2<=x1 or y2<=y1:
+            return None
+        return rectangle(x1, y1, x2-x1, y2-y1)
+
+    def subtract(self, x, y, w, h):
+        """ returns the list of rectangles covering this one minus the area given (up to 4) """
+        if not self.intersects(x, y, w, h):
+            return [self]
+        rects = []
+        sx2 = self.x+self.width
+        sy2 = self.y+self.height
+        #band above:
+        if y>self.y:
+            rects.append(rectangle(self.x, self.y, self.width, y-self.y))
+        #band below:
+        if y+h<sy2:
+            rects.append(rectangle(self.x, y+h, self.width, sy2-(y+h)))
+        #left and right parts of the middle band:
+        my1 = max(self.y, y)
+        my2 = min(sy2, y+h)
+        if x>self.x:
+            rects.append(rectangle(self.x, my1, x-self.x, my2-my1))
+        if x+w<sx2:
+            rects.append(rectangle(x+w, my1, sx2-(x+w), my2-my1))
+        return rects
+
+
+def merge_cost(r1, r2):
+    """ the number of pixels we would send for nothing if we sent the bounding box of both rectangles """
+    x1 = min(r1.x, r2.x)
+    y1 = min(r1.y, r2.y)
+    x2 = max(r1.x+r1.width, r2.x+r2.width)
+    y2 = max(r1.y+r1.height, r2.y+r2.height)
+    return (x2-x1)*(y2-y1) - r1.width*r1.height - r2.width*r2.height
+
+
+class region(object):
+    """ a list of rectangles which never overlap """
+
+    def __init__(self, rectangles=[]):
+        self.rectangles = []
+        for r in rectangles:
+            self.add(*r.get_geometry())
+
+    def __repr__(self):
+        return "region(%s)" % self.rectangles
+
+    def __len__(self):
+        return len(self.rectangles)
+
+    def add(self, x, y, w, h):
+        """ union with the given rectangle """
+        if w<=0 or h<=0:
+            return
+        rects = []
+        for r in self.rectangles:
+            if r.contains(x, y, w, h):
+                #already covered
+                return
+            if not r.intersects(x, y, w, h):
+                rects.append(r)
+            elif not (x<=r.x and y<=r.y and x+w>=r.x+r.width and y+h>=r.y+r.height):
+                rects += r.subtract(x, y, w, h)
+            #(rectangles contained in the new one are dropped)
+        rects.append(rectangle(x, y, w, h))
+        self.rectangles = rects
+
+    def subtract(self, x, y, w, h):
+        rects = []
+        for r in self.rectangles:
+            rects += r.subtract(x, y, w, h)
+        self.rectangles = rects
+
+    def intersect(self, x, y, w, h):
+        rects = []
+        for r in self.rectangles:
+            i = r.intersection(x, y, w, h)
+            if i:
+                rects.append(i)
+        self.rectangles = rects
+
+    def get_bounds(self):
+        if not self.rectangles:
+            return None
+        x1 = min([r.x for r in self.rectangles])
+        y1 = min([r.y for r in self.rectangles])
+        x2 = max([r.x+r.width for r in self.rectangles])
+        y2 = max([r.y+r.height for r in self.rectangles])
+        return rectangle(x1, y1, x2-x1, y2-y1)
+
+    def get_area(self):
+        return sum([r.width*r.height for r in self.rectangles])
+
+    def merge(self, packet_cost):
+        """
+            Replaces pairs of rectangles with their bounding box
+            whenever the extra pixels this would send cost less than
+            sending an extra packet (the cost is expressed in pixels).
+            The cheapest merges are done first,
+            and each merge removes at least one rectangle.
+        """
+        if len(self.rectangles)<2:
+            return
+        live = {}           #index -> rectangle
+        candidates = []     #heap of (cost, index1, index2)
+        counter = [0]
+        def add(r):
+            index = counter[0]
+            counter[0] += 1
+            for i, o in live.items():
+                cost = merge_cost(r, o)
+                if cost<=packet_cost:
+                    heapq.heappush(candidates, (cost, i, index))
+            live[index] = r
+        for r in self.rectangles:
+            add(r)
+        while candidates:
+            _, i, j = heapq.heappop(candidates)
+            r1 = live.get(i)
+            r2 = live.get(j)
+            if r1 is None or r2 is None:
+                #one of them has already been merged
+                continue
+            x1 = min(r1.x, r2.x)
+            y1 = min(r1.y, r2.y)
+            x2 = max(r1.x+r1.width, r2.x+r2.width)
+            y2 = max(r1.y+r1.height, r2.y+r2.height)
+            #the bounding box may overlap other rectangles,
+            #those must be merged too (so we never split rectangles here):
+            merged = set([i, j])
+            area = r1.width*r1.height + r2.width*r2.height
+            grown = True
+            while grown:
+                grown = False
+                for k, r in live.items():
+                    if k not in merged and r.intersects(x1, y1, x2-x1, y2-y1):
+                        merged.add(k)
+                        area += r.width*r.height
+                        x1 = min(x1, r.x)
+                        y1 = min(y1, r.y)
+                        x2 = max(x2, r.x+r.width)
+                        y2 = max(y2, r.y+r.height)
+                        grown = True
+            if (x2-x1)*(y2-y1)-area>packet_cost:
+                #no longer worth it
+                continue
+            for k in merged:
+                del live[k]
+            add(rectangle(x1, y1, x2-x1, y2-y1))
+        self.rectangles = [live[k] for k in sorted(live.keys())]
+
+
+def new_region():
+    return region()
+
+def add_rectangle(region, x, y, w, h):
+    region.add(x, y, w, h)
+
+def subtract_rectangle(region, x, y, w, h):
+    region.subtract(x, y, w, h)
+
+def intersect_rectangle(region, x, y, w, h):
+    region.intersect(x, y, w, h)
+
+def get_rectangles(region):
+    return region.rectangles
+
+def get_bounds(region):
+    return region.get_bounds()
+
+def merge_rectangles(region, packet_cost):
+    region.merge(packet_cost)
@@ -0,0 +1,112 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Finds the tiles which have changed between two screen captures,
+so the shadow servers only damage the areas of the screen which have changed.
+The comparisons are done directly on the captured buffers (memcmp),
+one band of tiles at a time, then only on the rows of the bands which have changed.
+"""
+
+import os
+
+from xpra.codecs.buffer_pool import get_buffer_pool
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_SCREEN_DIFF_DEBUG")
+
+TILE_SIZE = int(os.environ.get("XPRA_SHADOW_TILE_SIZE", "64"))
+
+
+class ScreenDiff(object):
+
+    def __init__(self, tile_size=TILE_SIZE):
+        self.tile_size = tile_size
+        self.last_frame = None          #(width, height, rowstride, pixel_format, pixels, pool buffer)
+        self.frames = 0
+        self.changed_tiles = 0
+        self.total_tiles = 0
+
+    def reset(self):
+        last = self.last_frame
+        self.last_frame = None
+        if last:
+            get_buffer_pool().release(last[5])
+
+    def get_changes(self, image):
+        """
+            Compares the image with the previous one and returns
+            the list of rectangles (x, y, w, h) which have changed,
+            one per row of tiles,
+            or None if the whole image must be considered changed.
+        """
+        x, y, width, height = image.get_geometry()[:4]
+        rowstride = image.get_rowstride()
+        pixel_format = image.get_pixel_format()
+        #we must keep a copy since the buffer may be re-used:
+        buf, size = get_buffer_pool().copy(image.get_pixels())
+        pixels = buffer(buf, 0, size)
+        last = self.last_frame
+        self.last_frame = width, height, rowstride, pixel_format, pixels, buf
+        self.frames += 1
+        if last is None:
+            return None
+        try:
+            if last[:4]!=(width, height, rowstride, pixel_format):
+                return None
+            return self.compare(last[4], pixels, x, y, width, height, rowstride, pixel_format)
+        finally:
+            get_buffer_pool().release(last[5])
+
+    def compare(self, old, pixels, x, y, width, height, rowstride, pixel_format):
+        ts = self.tile_size
+        Bpp = len(pixel_format)
+        cols = (width+ts-1)//ts
+        rects = []
+        changed_tiles = 0
+        for band_y in range(0, height, ts):
+            band_h = min(ts, height-band_y)
+            offset = band_y*rowstride
+            size = band_h*rowstride
+            if buffer(old, offset, size)==buffer(pixels, offset, size):
+                continue
+            #find the tile columns which have changed, looking only at the rows which have:
+            changed = [False]*cols
+            row_size = width*Bpp
+            for row in range(band_y, band_y+band_h):
+                roffset = row*rowstride
+                if buffer(old, roffset, row_size)==buffer(pixels, roffset, row_size):
+                    continue
+                for col in range(cols):
+                    if changed[col]:
+                        continue
+                    coffset = roffset+col*ts*Bpp
+                    csize = min(ts, width-col*ts)*Bpp
+                    if buffer(old, coffset, csize)!=buffer(pixels, coffset, csize):
+                        changed[col] = True
+            #merge adjacent tiles into one rectangle per run:
+            col = 0
+            while col<cols:
+                if not changed[col]:
+                    col += 1
+                    continue
+                start = col
+                while col<cols and changed[col]:
+                    col += 1
+                changed_tiles += col-start
+                x1 = start*ts
+                x2 = min(width, col*ts)
+                rects.append((x+x1, y+band_y, x2-x1, band_h))
+        self.changed_tiles += changed_tiles
+        self.total_tiles += cols*((height+ts-1)//ts)
+        debug("compare(..) %s tiles changed: %s", changed_tiles, rects)
+        return rects
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"tile_size" + suffix] = self.tile_size
+        info[prefix+"frames" + suffix] = self.frames
+        info[prefix+"tiles.changed" + suffix] = self.changed_tiles
+        info[prefix+"tiles.total" + suffix] = self.total_tiles
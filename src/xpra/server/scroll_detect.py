@@ -0,0 +1,132 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+# Scroll detection: compares the checksums of the rows of two frames
+# to find a vertical offset which the client can apply by copying
+# the pixels it already has, see WindowSource.make_data_packet
+
+import os
+import zlib
+
+from xpra.deque import maxdeque
+try:
+    from xpra.codecs.argb.checksum import row_checksums     #@UnresolvedImport
+except Exception:
+    row_checksums = None
+
+#minimum percentage of the rows which must have moved by the same offset:
+SCROLL_MIN_PERCENT = int(os.environ.get("XPRA_SCROLL_MIN_PERCENT", "40"))
+#rows which are repeated more than this many times (ie: blank lines) do not tell us anything:
+MAX_ROW_REPEAT = 8
+#changed rows separated by fewer rows than this are sent together:
+BAND_MERGE_GAP = 16
+#when none of this many detections found any scrolling, we stop calculating the row checksums:
+MAX_MISSES = 10
+#but we still probe two updates in a row every N updates:
+PROBE_INTERVAL = 20
+
+
+def get_row_checksums(image):
+    """ returns the checksum of each row of pixels (ignoring the rowstride padding) """
+    pixels = image.get_pixels()
+    rowstride = image.get_rowstride()
+    width = image.get_width()*len(image.get_pixel_format())
+    if row_checksums:
+        return row_checksums(pixels, rowstride, width, image.get_height())
+    return [zlib.crc32(buffer(pixels, i*rowstride, width)) for i in range(image.get_height())]
+
+
+class ScrollStats(object):
+    """
+        Keeps track of the results of the recent scroll detections,
+        so we can stop calculating the row checksums for windows which never scroll.
+    """
+
+    def __init__(self):
+        self.results = maxdeque(MAX_MISSES)
+        self.low_hit_updates = 0
+        self.skipped_updates = 0
+        self.detected = 0
+
+    def record(self, found):
+        self.results.append(bool(found))
+        if found:
+            self.detected += 1
+
+    def should_checksum(self):
+        """ returns False when the row checksums of the next update are unlikely to be useful """
+        results = list(self.results)
+        if len(results)<MAX_MISSES or True in results:
+            self.low_hit_updates = 0
+            return True
+        self.low_hit_updates += 1
+        #the second update of a probe can be compared with the first one:
+        if self.low_hit_updates % PROBE_INTERVAL<2:
+            return True
+        self.skipped_updates += 1
+        return False
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"detected" + suffix] = self.detected
+        info[prefix+"skipped_updates" + suffix] = self.skipped_updates
+
+
+def detect_scroll(old, new, min_percent=SCROLL_MIN_PERCENT):
+    """
+        Given the row checksums of the previous frame and of the new one
+        (rows we know nothing about are set to None in the previous frame),
+        returns None if we did not find any scrolling, or:
+        (dy, copies, bands)
+        * dy is the vertical offset
+        * copies is the list of (start, end) row ranges of the new frame
+          which can be copied from the previous frame's rows (start-dy, end-dy)
+        * bands is the list of (start, end) row ranges which must be sent
+        Rows which have not changed are in neither list.
+    """
+    height = len(new)
+    if len(old)!=height or height<2:
+        return None
+    positions = {}
+    for i, v in enumerate(old):
+        if v is not None:
+            positions.setdefault(v, []).append(i)
+    #count the votes for each offset:
+    votes = {}
+    for i, v in enumerate(new):
+        if old[i]==v:
+            continue
+        p = positions.get(v)
+        if not p or len(p)>MAX_ROW_REPEAT:
+            continue
+        for j in p:
+            votes[i-j] = votes.get(i-j, 0)+1
+    if not votes:
+        return None
+    dy = max(votes.keys(), key=lambda k : (votes[k], -abs(k)))
+    if votes[dy]*100<height*min_percent:
+        return None
+    copies = []
+    bands = []
+    def add(l, i):
+        if l and l[-1][1]==i:
+            l[-1] = (l[-1][0], i+1)
+        else:
+            l.append((i, i+1))
+    for i, v in enumerate(new):
+        if old[i]==v:
+            continue
+        j = i-dy
+        if j>=0 and j<height and old[j]==v:
+            add(copies, i)
+        else:
+            add(bands, i)
+    merged = []
+    for start, end in bands:
+        if merged and start-merged[-1][1]<BAND_MERGE_GAP:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return dy, copies, merged
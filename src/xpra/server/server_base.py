@@ -21,6 +21,9 @@ from xpra.version_util import add_version_info
 from xpra.util import alnum
 from xpra.codecs.loader import PREFERED_ENCODING_ORDER, codec_versions, has_codec, get_codec
 from xpra.codecs.video_helper import getVideoHelper
+from xpra.server.frame_cache import get_frame_cache
+from xpra.codecs.buffer_pool import get_buffer_pool
+from xpra.server.codec_pool import get_codec_pool, CODEC_POOL_IDLE
 
 if sys.version > '3':
     unicode = str           #@ReservedAssignment
@@ -131,6 +134,8 @@ class ServerBase(ServerCore):
             self.timeout_add(1000, self.send_ping)
         else:
             self.timeout_add(10*1000, self.send_ping)
+        #free the video contexts which are no longer used:
+        self.timeout_add(int(max(1, CODEC_POOL_IDLE/2)*1000), get_codec_pool().expire)
         thread.start_new_thread(self.threaded_init, ())
 
     def threaded_init(self):
@@ -373,6 +378,7 @@ class ServerBase(ServerCore):
         if self.notifications_forwarder:
             thread.start_new_thread(self.notifications_forwarder.release, ())
             self.notifications_forwarder = None
+        get_codec_pool().clear()
         ServerCore.cleanup(self)
 
     def add_listen_socket(self, socktype, socket):
@@ -699,11 +705,13 @@ class ServerBase(ServerCore):
             opts = ("lz4", "zlib")
             if compression=="lz4":
                 for cproto in protos:
+                    cproto.fixed_compression = True
                     cproto.enable_lz4()
                 forward_all_clients(["enable_lz4"])
                 return success()
             elif compression=="zlib":
                 for cproto in protos:
+                    cproto.fixed_compression = True
                     cproto.enable_zlib()
                 forward_all_clients(["enable_zlib"])
                 return success()
@@ -877,6 +885,11 @@ class ServerBase(ServerCore):
                     info["keyboard."+k] = v
         # csc and video encoders:
         info.update(getVideoHelper().get_info())
+        frame_cache = get_frame_cache()
+        if frame_cache:
+            frame_cache.add_stats(info, "encoding.frame_cache.")
+        get_buffer_pool().add_stats(info, "encoding.buffer_pool.")
+        get_codec_pool().add_stats(info, "encoding.codec_pool.")
 
         # other clients:
         info["clients"] = len([p for p in self._server_sources.keys() if p!=proto])
@@ -1152,6 +1165,8 @@ class ServerBase(ServerCore):
     def _process_set_deflate(self, proto, packet):
         level = packet[1]
         log("client has requested compression level=%s", level)
+        #older clients do not tell us if the level was chosen by the user:
+        proto.fixed_compression = len(packet)<3 or bool(packet[2])
         proto.set_compression_level(level)
         #echo it back to the client:
         ss = self._server_sources.get(proto)
@@ -21,12 +21,13 @@ log = Logger()
 
 import xpra
 from xpra.scripts.main import SOCKET_TIMEOUT, _socket_connect
-from xpra.scripts.config import ENCRYPTION_CIPHERS
+from xpra.scripts.config import ENCRYPTION_CIPHERS, parse_bandwidth_limit
 from xpra.scripts.server import deadly_signal
 from xpra.net.bytestreams import SocketConnection
 from xpra.os_util import set_application_name, load_binary_file, get_machine_id, get_user_uuid, SIGNAMES
 from xpra.version_util import version_compat_check, add_version_info, get_platform_info
 from xpra.net.protocol import Protocol, use_lz4, use_rencode, new_cipher_caps, get_network_caps, repr_ellipsized
+from xpra.net.io_engine import make_protocol
 from xpra.server.background_worker import stop_worker
 from xpra.daemon_thread import make_daemon_thread
 from xpra.server.proxy import XpraProxy
@@ -117,6 +118,7 @@ class ServerCore(object):
         self.encryption_keyfile = None
         self.password_file = None
         self.compression_level = 1
+        self.bandwidth_limit = 0
         self.exit_with_client = False
 
         #control mode:
@@ -144,6 +146,7 @@ class ServerCore(object):
         self.password_file = opts.password_file
         self.compression_level = opts.compression_level
         self.exit_with_client = opts.exit_with_client
+        self.bandwidth_limit = parse_bandwidth_limit(opts.bandwidth_limit)
 
         self.init_auth(opts)
 
@@ -302,7 +305,7 @@ class ServerCore(object):
         log("new_connection(%s) sock=%s, sockname=%s, address=%s, peername=%s", args, sock, sockname, address, peername)
         sc = SocketConnection(sock, sockname, address, target, socktype)
         log.info("New connection received: %s", sc)
-        protocol = Protocol(self, sc, self.process_packet)
+        protocol = make_protocol(self, sc, self.process_packet)
         protocol.large_packets.append("info-response")
         protocol.authenticator = None
         protocol.invalid_header = self.invalid_header
@@ -403,14 +406,23 @@ class ServerCore(object):
 
         proto.chunked_compression = c.boolget("chunked_compression")
         if proto.chunked_compression:
-            proto.set_compression_level(c.intget("compression_level", self.compression_level))
+            level = c.intget("compression_level", self.compression_level)
+            proto.set_compression_level(level)
+            #unless the user chose the level, let the adaptive compression choose:
+            proto.fixed_compression = c.boolget("compression_level.fixed")
         if use_rencode and c.boolget("rencode"):
             proto.enable_rencode()
         else:
             proto.enable_bencode()
 
-        if c.boolget("lz4") and use_lz4 and proto.chunked_compression and self.compression_level==1:
+        proto.peer_lz4 = c.boolget("lz4") and use_lz4 and proto.chunked_compression
+        proto.set_peer_dictionaries(c.dictget("zlib.dictionaries"))
+        if proto.peer_lz4 and self.compression_level==1:
             proto.enable_lz4()
+        #use the lowest of our limit and the one requested by the client:
+        limits = [x for x in (self.bandwidth_limit, c.intget("bandwidth-limit", 0)) if x>0]
+        if limits:
+            proto.set_bandwidth_limit(min(limits)//8)
 
         log("process_hello: capabilities=%s", capabilities)
         if c.boolget("version_request"):
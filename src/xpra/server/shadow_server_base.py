@@ -4,6 +4,7 @@
 # Xpra is released under the terms of the GNU GPL v2, or, at your option, any
 # later version. See the file COPYING for details.
 
+import os
 import socket
 
 from xpra.log import Logger
@@ -11,8 +12,15 @@ log = Logger()
 
 from xpra.net.protocol import Compressed
 from xpra.server.batch_config import DamageBatchConfig
+from xpra.server.screen_diff import ScreenDiff
 from xpra.util import AdHocStruct
 
+#only damage the tiles of the screen which have changed:
+SHADOW_DIFF = os.environ.get("XPRA_SHADOW_DIFF", "1")=="1"
+#we poll the screen more slowly when nothing changes:
+MIN_REFRESH_DELAY = int(os.environ.get("XPRA_SHADOW_MIN_REFRESH_DELAY", "50"))
+MAX_REFRESH_DELAY = int(os.environ.get("XPRA_SHADOW_MAX_REFRESH_DELAY", "250"))
+
 
 class RootWindowModel(object):
 
@@ -93,6 +101,11 @@ class ShadowServerBase(object):
         self.mapped_at = None
         self.pulseaudio = False
         self.sharing = False
+        self.refresh_timer = None
+        self.refresh_delay = MIN_REFRESH_DELAY
+        self.screen_diff = None
+        if SHADOW_DIFF:
+            self.screen_diff = ScreenDiff()
         DamageBatchConfig.ALWAYS = True             #always batch
         DamageBatchConfig.MIN_DELAY = 50            #never lower than 50ms
         DamageBatchConfig.RECALCULATE_DELAY = 0.1   #re-compute delay 10 times per second at most
@@ -108,7 +121,9 @@ class ShadowServerBase(object):
         pass
 
     def start_refresh(self):
-        self.timeout_add(50, self.refresh)
+        self.refresh_delay = MIN_REFRESH_DELAY
+        if self.refresh_timer is None:
+            self.refresh_timer = self.timeout_add(self.refresh_delay, self.refresh)
 
     def timeout_add(self, *args):
         #usually done via gobject
@@ -116,11 +131,37 @@ class ShadowServerBase(object):
 
 
     def refresh(self):
+        self.refresh_timer = None
         if not self.mapped_at:
+            if self.screen_diff:
+                self.screen_diff.reset()
             return False
         w, h = self.root.get_size()
-        self._damage(self.root_window_model, 0, 0, w, h)
-        return True
+        changes = None
+        if self.screen_diff:
+            image = self.root_window_model.get_image(0, 0, w, h)
+            if image:
+                try:
+                    changes = self.screen_diff.get_changes(image)
+                finally:
+                    image.free()
+        if changes is None:
+            self._damage(self.root_window_model, 0, 0, w, h)
+        else:
+            for x, y, cw, ch in changes:
+                self._damage(self.root_window_model, x, y, cw, ch)
+        #poll faster when the screen is changing:
+        if changes is None or len(changes)>0:
+            self.refresh_delay = MIN_REFRESH_DELAY
+        else:
+            self.refresh_delay = min(MAX_REFRESH_DELAY, int(self.refresh_delay*1.25)+1)
+        self.refresh_timer = self.timeout_add(self.refresh_delay, self.refresh)
+        return False
+
+    def add_refresh_info(self, info):
+        info["shadow.refresh_delay"] = self.refresh_delay
+        if self.screen_diff:
+            self.screen_diff.add_stats(info, "shadow.diff.")
 
     def sanity_checks(self, proto, c):
         server_uuid = c.strget("server_uuid")
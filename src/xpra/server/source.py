@@ -24,14 +24,14 @@ from xpra.simple_stats import add_list_stats, std_unit
 from xpra.scripts.config import python_platform
 from xpra.codecs.loader import get_codec, has_codec, OLD_ENCODING_NAMES_TO_NEW, NEW_ENCODING_NAMES_TO_OLD
 from xpra.net.protocol import compressed_wrapper, Compressed
-from xpra.daemon_thread import make_daemon_thread
-from xpra.os_util import platform_name, StringIOClass, thread, Queue, get_machine_id, get_user_uuid
+from xpra.os_util import platform_name, StringIOClass, thread, get_machine_id, get_user_uuid
 from xpra.server.background_worker import add_work_item
+from xpra.server.encode_workers import EncodeWorkerPool, ENCODE_WORKERS
+from xpra.server.frame_cache import get_frame_cache
 from xpra.util import std, typedict
 
 
 ALLOW_SOUND_LOOP = os.environ.get("XPRA_ALLOW_SOUND_LOOP", "0")=="1"
-NOYIELD = os.environ.get("XPRA_YIELD") is None
 debug = log.debug
 
 
@@ -169,8 +169,8 @@ class ServerSource(object):
     See 'next_packet'.
 
     The UI thread calls damage(), which goes into WindowSource and eventually (batching may be involved)
-    adds the damage pixels ready for processing to the damage_data_queue,
-    items are picked off by the separate 'data_to_packet' thread and added to the
+    adds the damage pixels ready for processing to the encode workers,
+    items are picked off by the worker thread assigned to the window and added to the
     damage_packet_queue.
     """
 
@@ -207,6 +207,7 @@ class ServerSource(object):
         self.mmap = None
         self.mmap_size = 0
         self.mmap_client_token = None                   #the token we write that the client may check
+        self.mmap_allocator = None                      #only when the client acknowledges each slot ("mmap_slots")
         # sound:
         self.supports_speaker = supports_speaker
         self.speaker_codecs = speaker_codecs
@@ -285,20 +286,22 @@ class ServerSource(object):
         self.send_cursor_pending = False
 
         # the queues of damage requests we work through:
-        self.damage_data_queue = Queue()           #holds functions to call to process damage data
-                                                    #items placed in this queue are picked off by the "data_to_packet" thread,
+        self.encode_workers = EncodeWorkerPool(ENCODE_WORKERS, self.is_closed)
+                                                    #holds functions to call to process damage data
+                                                    #items are picked off by the worker thread assigned to each window,
                                                     #the functions should add the packets they generate to the 'damage_packet_queue'
         self.damage_packet_queue = deque()         #holds actual packets ready for sending (already encoded)
                                                     #these packets are picked off by the "protocol" via 'next_packet()'
                                                     #format: packet, wid, pixels, start_send_cb, end_send_cb
+        self.frame_cache = get_frame_cache()
+        if self.frame_cache:
+            self.frame_cache.add_user()
         #these statistics are shared by all WindowSource instances:
         self.statistics = GlobalPerformanceStatistics()
         self.last_user_event = time.time()
         self.last_ping_echoed_time = 0
         # ready for processing:
         protocol.set_packet_source(self.next_packet)
-        self.datapacket_thread = make_daemon_thread(self.data_to_packet, "encode")
-        self.datapacket_thread.start()
         #for managing the recalculate_delays work:
         self.calculate_window_ids = set()
         self.calculate_due = False
@@ -319,6 +322,10 @@ class ServerSource(object):
         if self.is_closed():
             return
         self.statistics.update_averages()
+        p = self.protocol
+        if p:
+            self.statistics.link_rate = p.get_link_rate()
+            self.statistics.send_queue_size = p.get_send_queue_size()
         wids = list(self.calculate_window_ids)  #make a copy so we don't clobber new wids
         focus = self.get_focus()
         for wid in wids:
@@ -378,7 +385,10 @@ class ServerSource(object):
 
     def close(self):
         self.close_event.set()
-        self.damage_data_queue.put(None, block=False)
+        self.encode_workers.stop()
+        if self.frame_cache:
+            self.frame_cache.remove_user()
+            self.frame_cache = None
         for window_source in self.window_sources.values():
             window_source.cleanup()
         self.window_sources = {}
@@ -386,6 +396,7 @@ class ServerSource(object):
             self.mmap.close()
             self.mmap = None
             self.mmap_size = 0
+            self.mmap_allocator = None
         self.stop_sending_sound()
         if self.protocol:
             self.protocol.close()
@@ -606,6 +617,9 @@ class ServerSource(object):
                 self.mmap, self.mmap_size = init_server_mmap(mmap_filename, mmap_token, new_token)
                 if self.mmap_size>0:
                     self.mmap_client_token = new_token
+                    if c.boolget("mmap_slots"):
+                        from xpra.net.mmap_pipe import MmapAllocator
+                        self.mmap_allocator = MmapAllocator(self.mmap, self.mmap_size)
 
         if self.mmap_size>0:
             log.info("mmap is enabled using %sB area in %s", std_unit(self.mmap_size, unit=1024), mmap_filename)
@@ -1039,6 +1053,8 @@ class ServerSource(object):
             cv("encoding.%s" % k, v)
         for k,v in self.encoding_options.items():
             cv("encoding.%s" % k, v)
+        if self.mmap_allocator:
+            self.mmap_allocator.add_stats(info, "client.mmap.", suffix)
         def get_sound_info(supported, prop):
             if not supported:
                 return {"state" : "disabled"}
@@ -1288,6 +1304,7 @@ class ServerSource(object):
         if ws:
             del self.window_sources[wid]
             ws.cleanup()
+        self.encode_workers.remove(wid)
 
     def add_stats(self, info, window_ids=[], suffix=""):
         """
@@ -1295,7 +1312,8 @@ class ServerSource(object):
             This is used by server.py to provide those statistics to clients
             via the 'xpra info' command.
         """
-        info["damage.data_queue.size%s.current" % suffix] = self.damage_data_queue.qsize()
+        info["damage.data_queue.size%s.current" % suffix] = self.encode_workers.qsize()
+        self.encode_workers.add_stats(info, "damage.encoding.", suffix)
         info["damage.packet_queue.size%s.current" % suffix] = len(self.damage_packet_queue)
         qpixels = [x[2] for x in list(self.damage_packet_queue)]
         add_list_stats(info, "damage_packet_queue_pixels"+suffix,  qpixels)
@@ -1384,7 +1402,7 @@ class ServerSource(object):
                               self.server_core_encodings, self.server_encodings,
                               self.encoding, self.encodings, self.core_encodings, self.encoding_options, self.rgb_formats,
                               self.default_encoding_options,
-                              self.mmap, self.mmap_size)
+                              self.mmap, self.mmap_size, self.mmap_allocator)
             self.window_sources[wid] = ws
         return ws
 
@@ -1418,6 +1436,9 @@ class ServerSource(object):
             return
         if decode_time>0:
             self.statistics.client_decode_time.append((wid, time.time(), width*height, decode_time))
+        if self.mmap_allocator:
+            #the client is done with the mmap slot (if any), even if the window is gone:
+            self.mmap_allocator.release((wid, damage_packet_sequence))
         ws = self.window_sources.get(wid)
         if ws:
             ws.damage_packet_acked(damage_packet_sequence, width, height, decode_time)
@@ -1426,13 +1447,17 @@ class ServerSource(object):
 #
 # Methods used by WindowSource:
 #
-    def queue_damage(self, encode_and_send_cb):
+    def queue_damage(self, encode_and_send_cb, wid):
         """
-            This is used by WindowSource to queue damage processing to be done in the 'data_to_packet' thread.
+            This is used by WindowSource to queue damage processing to be done in the encode worker for this window.
             The 'encode_and_send_cb' will then add the resulting packet to the 'damage_packet_queue' via 'queue_packet'.
         """
-        self.statistics.damage_data_qsizes.append((time.time(), self.damage_data_queue.qsize()))
-        self.damage_data_queue.put(encode_and_send_cb)
+        self.statistics.damage_data_qsizes.append((time.time(), self.encode_workers.qsize()))
+        key = wid
+        if self.mmap_size>0 and not self.mmap_allocator:
+            #all the windows share the mmap ring buffer, so they must use the same worker:
+            key = 0
+        self.encode_workers.add(key, encode_and_send_cb)
 
     def queue_packet(self, packet, wid, pixels, start_send_cb, end_send_cb):
         """
@@ -1447,21 +1472,3 @@ class ServerSource(object):
         p = self.protocol
         if p:
             p.source_has_more()
-
-#
-# The damage packet thread loop:
-#
-    def data_to_packet(self):
-        """
-            This runs in a separate thread and calls all the function callbacks
-            which are added to the 'damage_data_queue'.
-        """
-        while not self.is_closed():
-            encode_and_queue = self.damage_data_queue.get(True)
-            if encode_and_queue is None:
-                return              #empty marker
-            try:
-                encode_and_queue()
-            except Exception, e:
-                log.error("error processing damage data: %s", e, exc_info=True)
-            NOYIELD or time.sleep(0)
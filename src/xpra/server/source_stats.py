@@ -54,6 +54,8 @@ class GlobalPerformanceStatistics(object):
         self.server_ping_latency = maxdeque(NRECS)      #time it took for the client to get a ping_echo back from us:
                                                         #(event_time, elapsed_time_in_seconds)
         self.client_load = None
+        self.link_rate = 0                              #estimated link rate in bytes per second (0 if unknown)
+        self.send_queue_size = 0                        #bytes waiting in the socket send queue
         self.damage_events_count = 0
         self.packet_count = 0
         #these values are calculated from the values above (see update_averages)
@@ -124,6 +126,14 @@ class GlobalPerformanceStatistics(object):
         factors.append(queue_inspect("damage-packet-queue-pixels", qpix_time_values, div=pixel_count, smoothing=sqrt))
         #damage data queue: (This is an important metric since each item will consume a fair amount of memory and each will later on go through the other queues.)
         factors.append(queue_inspect("damage-data-queue", self.damage_data_qsizes))
+        if self.link_rate>0:
+            #how long it will take to drain the socket send queue,
+            #compared to the latency we are aiming for:
+            queue_time = float(self.send_queue_size)/self.link_rate
+            ratio = queue_time/max(0.001, target_latency)
+            info = {"link_rate" : int(self.link_rate),
+                    "queue_size": self.send_queue_size}
+            factors.append(("network-send-queue", info, logp(ratio), min(4.0, ratio)))
         if self.mmap_size>0:
             #full: effective range is 0.0 to ~1.2
             full = 1.0-float(self.mmap_free_size)/self.mmap_size
@@ -135,6 +145,7 @@ class GlobalPerformanceStatistics(object):
         info["damage.events%s" % suffix] = self.damage_events_count
         info["damage.packets_sent%s" % suffix] = self.packet_count
         info["client.connection.mmap_bytecount%s" % suffix] = self.mmap_bytes_sent
+        info["client.connection.link_rate%s" % suffix] = int(self.link_rate)
         if self.min_client_latency is not None:
             info["client.latency%s.absmin" % suffix] = int(self.min_client_latency*1000)
         qsizes = [x for _,x in list(self.damage_data_qsizes)]
@@ -0,0 +1,173 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Keeps the checksums of the tiles of a window which the client already has,
+so we can skip the tiles which have been damaged without changing
+(blinking cursors redrawn identically, toolkits repainting whole widgets, etc).
+The tiles are aligned on a fixed grid in window coordinates,
+for tiles which are only partially covered by an update
+we record the area covered as well as its checksum.
+When the tiles keep changing (video, animations), we stop calculating
+the checksums and only probe now and again to see if they have become useful again.
+"""
+
+import os
+import zlib
+from threading import Lock
+
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_TILE_CACHE_DEBUG")
+from xpra.deque import maxdeque
+try:
+    from xpra.codecs.argb.checksum import tile_checksums     #@UnresolvedImport
+except Exception, e:
+    debug("cannot load the tile checksum module, using the slow python version: %s", e)
+    tile_checksums = None
+
+TILE_CACHE = os.environ.get("XPRA_TILE_CACHE", "1")=="1"
+TILE_SIZE = int(os.environ.get("XPRA_TILE_SIZE", "64"))
+#the cache is cleared when it grows beyond this many tiles (256MPixels with 64x64 tiles):
+MAX_TILES = int(os.environ.get("XPRA_MAX_TILES", "65536"))
+#we stop calculating the checksums when fewer than this percentage of the cached tiles are unchanged:
+MIN_HIT_RATE = int(os.environ.get("XPRA_TILE_CACHE_MIN_HIT_RATE", "5"))
+#but we still probe two updates in a row every N updates, to see if the hit rate has gone up:
+PROBE_INTERVAL = 20
+
+
+def get_tile_checksums(image, tile_size=TILE_SIZE):
+    """
+        Returns a dictionary with the checksum of each tile the image covers:
+        (column, row) : (x, y, w, h, checksum)
+        The geometry is the part of the tile covered by the image, in window coordinates.
+    """
+    ix, iy, iw, ih = image.get_geometry()[:4]
+    pixels = image.get_pixels()
+    rowstride = image.get_rowstride()
+    Bpp = len(image.get_pixel_format())
+    if tile_checksums:
+        return tile_checksums(pixels, rowstride, Bpp, ix, iy, iw, ih, tile_size)
+    tiles = {}
+    for row in range(iy//tile_size, (iy+ih-1)//tile_size+1):
+        y1 = max(iy, row*tile_size)
+        y2 = min(iy+ih, (row+1)*tile_size)
+        for col in range(ix//tile_size, (ix+iw-1)//tile_size+1):
+            x1 = max(ix, col*tile_size)
+            x2 = min(ix+iw, (col+1)*tile_size)
+            offset = (y1-iy)*rowstride + (x1-ix)*Bpp
+            size = (x2-x1)*Bpp
+            checksum = 0
+            for _ in range(y2-y1):
+                checksum = zlib.crc32(buffer(pixels, offset, size), checksum)
+                offset += rowstride
+            tiles[(col, row)] = (x1, y1, x2-x1, y2-y1, checksum)
+    return tiles
+
+
+class TileChecksumCache(object):
+
+    def __init__(self, tile_size=TILE_SIZE, max_tiles=MAX_TILES):
+        self.lock = Lock()
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.tiles = {}
+        self.checked_pixels = 0
+        self.skipped_pixels = 0
+        self.invalidations = 0
+        #(pixels of the cached tiles checked, pixels unchanged) for the recent updates:
+        self.hits = maxdeque(10)
+        self.low_hit_updates = 0
+        self.skipped_updates = 0
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.tiles = {}
+        finally:
+            self.lock.release()
+
+    def get_hit_rate(self):
+        """ the percentage of the cached tiles which were unchanged in the recent updates """
+        hits = list(self.hits)
+        cached = sum([x for x,_ in hits])
+        if cached==0:
+            return 100
+        return 100*sum([x for _,x in hits])//cached
+
+    def should_checksum(self):
+        """ returns False when calculating the checksums for the next update is unlikely to save anything """
+        if self.get_hit_rate()>=MIN_HIT_RATE:
+            self.low_hit_updates = 0
+            return True
+        self.low_hit_updates += 1
+        #the second update of a probe can find the tiles recorded by the first one:
+        if self.low_hit_updates % PROBE_INTERVAL<2:
+            return True
+        self.skipped_updates += 1
+        return False
+
+    def get_changed(self, tiles):
+        """ returns the list of tiles which do not match what the client has """
+        changed = []
+        cached = 0
+        unchanged = 0
+        self.lock.acquire()
+        try:
+            for key, value in tiles.items():
+                pixels = value[2]*value[3]
+                v = self.tiles.get(key)
+                if v!=value:
+                    changed.append(key)
+                else:
+                    unchanged += pixels
+                if v is not None:
+                    cached += pixels
+                self.checked_pixels += pixels
+            self.skipped_pixels += unchanged
+            #tiles which are not in the cache don't tell us anything about the hit rate:
+            if cached>0:
+                self.hits.append((cached, unchanged))
+        finally:
+            self.lock.release()
+        return changed
+
+    def update(self, tiles):
+        """ records the tiles we have sent to the client """
+        self.lock.acquire()
+        try:
+            if len(self.tiles)+len(tiles)>self.max_tiles:
+                debug("tile cache is full (%s tiles), clearing it", len(self.tiles))
+                self.tiles = {}
+            self.tiles.update(tiles)
+        finally:
+            self.lock.release()
+
+    def invalidate(self, x, y, w, h):
+        """ the client's pixels for this area may not match the checksums we have """
+        ts = self.tile_size
+        self.lock.acquire()
+        try:
+            if not self.tiles:
+                return
+            self.invalidations += 1
+            for row in range(y//ts, (y+h-1)//ts+1):
+                for col in range(x//ts, (x+w-1)//ts+1):
+                    try:
+                        del self.tiles[(col, row)]
+                    except KeyError:
+                        pass
+        finally:
+            self.lock.release()
+
+    def add_stats(self, info, prefix="", suffix=""):
+        info[prefix+"tiles" + suffix] = len(self.tiles)
+        info[prefix+"tile_size" + suffix] = self.tile_size
+        info[prefix+"checked_pixels" + suffix] = self.checked_pixels
+        info[prefix+"skipped_pixels" + suffix] = self.skipped_pixels
+        info[prefix+"invalidations" + suffix] = self.invalidations
+        info[prefix+"hit_rate" + suffix] = self.get_hit_rate()
+        info[prefix+"skipped_updates" + suffix] = self.skipped_updates
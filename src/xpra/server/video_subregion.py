@@ -0,0 +1,108 @@
+# coding=utf8
+# This file is part of Xpra.
+# Copyright (C) 2013 Antoine Martin <antoine@devloop.org.uk>
+# Xpra is released under the terms of the GNU GPL v2, or, at your option, any
+# later version. See the file COPYING for details.
+
+"""
+Finds the area of a window which is showing a video (ie: a video playing in a browser tab),
+so we can use a video encoder for that area only and send the rest of the window
+using the regular (non-video) encodings.
+We record the damage events and look for a rectangle which is damaged many times per second
+and which contains most of the damage events around it.
+See WindowVideoSource.send_delayed_regions
+"""
+
+import os
+import time
+
+from xpra.deque import maxdeque
+from xpra.server.region import rectangle
+from xpra.log import Logger, debug_if_env
+log = Logger()
+debug = debug_if_env(log, "XPRA_SUBREGION_DEBUG")
+
+VIDEO_SUBREGION = os.environ.get("XPRA_VIDEO_SUBREGION", "1")=="1"
+#how far back we look (in seconds):
+SUBREGION_TIME = float(os.environ.get("XPRA_SUBREGION_TIME", "2"))
+#the region must be updated at least this often (per second):
+SUBREGION_MIN_FPS = int(os.environ.get("XPRA_SUBREGION_MIN_FPS", "10"))
+#smaller areas are not worth a video encoder:
+SUBREGION_MIN_PIXELS = 128*128
+#larger areas are encoded as a full window video (as before):
+SUBREGION_MAX_RATIO = 0.8
+#how many damage events we keep:
+MAX_EVENTS = 250
+
+
+class VideoSubregion(object):
+
+    def __init__(self):
+        self.damage_events = maxdeque(MAX_EVENTS)       #(time, x, y, w, h)
+        self.rectangle = None
+        self.set_at = 0
+        self.changes = 0
+
+    def reset(self):
+        self.damage_events = maxdeque(MAX_EVENTS)
+        self.set_region(None)
+
+    def set_region(self, rect):
+        if self.rectangle!=rect:
+            debug("VideoSubregion.set_region(%s) was %s", rect, self.rectangle)
+            self.rectangle = rect
+            self.set_at = time.time()
+            self.changes += 1
+
+    def record(self, x, y, w, h):
+        self.damage_events.append((time.time(), x, y, w, h))
+
+    def identify(self, ww, wh):
+        """
+            Returns the rectangle we should encode as video for a window of this size,
+            or None if there isn't one.
+        """
+        now = time.time()
+        cutoff = now-SUBREGION_TIME
+        events = [x[1:] for x in list(self.damage_events) if x[0]>=cutoff]
+        min_count = SUBREGION_MIN_FPS*SUBREGION_TIME
+
+        def inside_count(x, y, w, h):
+            return len([True for ex, ey, ew, eh in events if ex>=x and ey>=y and ex+ew<=x+w and ey+eh<=y+h])
+
+        def valid(x, y, w, h):
+            if w*h<SUBREGION_MIN_PIXELS or w*h>ww*wh*SUBREGION_MAX_RATIO:
+                return False
+            return x>=0 and y>=0 and x+w<=ww and y+h<=wh
+
+        #keep the current region whilst it is still busy, changing it restarts the video stream:
+        r = self.rectangle
+        if r and valid(r.x, r.y, r.width, r.height) and inside_count(r.x, r.y, r.width, r.height)>=min_count/2:
+            return r
+        best = None
+        best_count = 0
+        if len(events)>=min_count:
+            #the candidates: the rectangles which are damaged repeatedly
+            counts = {}
+            for e in events:
+                counts[e] = counts.get(e, 0)+1
+            for (x, y, w, h), count in counts.items():
+                if count<min_count/2 or not valid(x, y, w, h):
+                    continue
+                inside = inside_count(x, y, w, h)
+                if inside>=min_count and inside>best_count:
+                    best = rectangle(x, y, w, h)
+                    best_count = inside
+        self.set_region(best)
+        return best
+
+    def add_stats(self, info, prefix="", suffix=""):
+        r = self.rectangle
+        info[prefix+"active" + suffix] = r is not None
+        info[prefix+"changes" + suffix] = self.changes
+        if r:
+            info[prefix+"x" + suffix] = r.x
+            info[prefix+"y" + suffix] = r.y
+            info[prefix+"width" + suffix] = r.width
+            info[prefix+"height" + suffix] = r.height
+            info[prefix+"elapsed" + suffix] = int(1000*(time.time()-self.set_at))
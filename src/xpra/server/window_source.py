@@ -23,6 +23,11 @@ AUTO_SWITCH_TO_RGB = False
 
 DELTA = os.environ.get("XPRA_DELTA", "1")=="1"
 MAX_DELTA_SIZE = int(os.environ.get("XPRA_MAX_DELTA_SIZE", "10000"))
+SCROLL_DETECTION = os.environ.get("XPRA_SCROLL_DETECTION", "1")=="1"
+#encodings which do not keep any state on the client,
+#so we can send arbitrary sub-areas of a frame with them:
+STATELESS_ENCODINGS = ("png", "png/P", "png/L", "rgb24", "rgb32", "jpeg", "webp")
+MIN_SCROLL_HEIGHT = 64
 PIL_CAN_OPTIMIZE = os.environ.get("XPRA_PIL_OPTIMIZE", "1")=="1"
 HAS_ALPHA = os.environ.get("XPRA_ALPHA", "1")=="1"
 
@@ -43,7 +48,14 @@ from xpra.server.window_stats import WindowPerformanceStatistics
 from xpra.simple_stats import add_list_stats
 from xpra.server.batch_delay_calculator import calculate_batch_delay, get_target_speed, get_target_quality
 from xpra.server.stats.maths import time_weighted_average
-from xpra.server.region import new_region, add_rectangle, get_rectangles
+from xpra.server.region import new_region, add_rectangle, get_rectangles, intersect_rectangle, merge_rectangles
+from xpra.server.frame_cache import get_frame_cache, pixels_checksum, CACHEABLE_ENCODINGS, QUALITY_BUCKET
+from xpra.server.scroll_detect import ScrollStats, get_row_checksums, detect_scroll
+from xpra.server.tile_cache import TileChecksumCache, get_tile_checksums, TILE_CACHE
+from xpra.codecs.image_wrapper import get_sub_image
+from xpra.server.content_classifier import ContentClassifier, CONTENT_CLASSIFIER, FLAT, TEXT, PHOTO
+from xpra.codecs.delta_cache import DeltaCache, DELTA_CACHE_SIZE, DELTA_CACHE_SLOTS
+from xpra.codecs.buffer_pool import get_buffer_pool
 try:
     from xpra.codecs.xor import xor_str        #@UnresolvedImport
 except Exception, e:
@@ -54,6 +66,11 @@ try:
 except Exception, e:
     log("cannot load argb module: %s", e)
     bgra_to_rgb, bgra_to_rgba, argb_to_rgb, argb_to_rgba = (None,)*4
+try:
+    from xpra.codecs.argb.convert import convert as rgb_convert    #@UnresolvedImport
+except Exception, e:
+    log("cannot load pixel format conversion module: %s", e)
+    rgb_convert = None
 from xpra.os_util import StringIOClass
 from xpra.codecs.loader import get_codec, has_codec, NEW_ENCODING_NAMES_TO_OLD
 from xpra.codecs.codec_constants import LOSSY_PIXEL_FORMATS
@@ -76,7 +93,7 @@ class WindowSource(object):
                     server_core_encodings, server_encodings,
                     encoding, encodings, core_encodings, encoding_options, rgb_formats,
                     default_encoding_options,
-                    mmap, mmap_size):
+                    mmap, mmap_size, mmap_allocator=None):
         #scheduling stuff (gobject wrapped):
         self.idle_add = idle_add
         self.timeout_add = timeout_add
@@ -111,7 +128,28 @@ class WindowSource(object):
         self.supports_delta = []
         if xor_str is not None and not window.is_tray():
             self.supports_delta = [x for x in encoding_options.strlistget("supports_delta", []) if x in ("png", "rgb24", "rgb32")]
-        self.last_pixmap_data = None
+        #the pixels the client has stored for delta encoding, one slot per geometry and encoding:
+        client_delta_cache_size = encoding_options.intget("delta_cache_size", 0)
+        if client_delta_cache_size>0:
+            client_delta_cache_slots = encoding_options.intget("delta_cache_slots", 1)
+            self.delta_cache = DeltaCache(min(DELTA_CACHE_SIZE, client_delta_cache_size), min(DELTA_CACHE_SLOTS, client_delta_cache_slots))
+        else:
+            #older clients only keep the last pixmap stored:
+            self.delta_cache = DeltaCache(DELTA_CACHE_SIZE, 1)
+        #the client can copy areas of the window when it scrolls:
+        self.supports_scrolling = SCROLL_DETECTION and encoding_options.boolget("scrolling") and not window.is_tray()
+        self.scroll_data = None                         #(x, y, w, h, row checksums) of the pixels the client has
+        self.scroll_stats = ScrollStats()
+        #checksums of the tiles the client has, so we can skip the ones which have not changed:
+        self.tile_cache_enabled = TILE_CACHE and not window.is_tray()
+        self.tile_cache = None
+        self.init_tile_cache()
+        #guesses what the window is showing from the frames we send:
+        self.content_classifier = None
+        if CONTENT_CLASSIFIER and not window.is_tray():
+            self.content_classifier = ContentClassifier()
+        #encoded frames shared with other clients showing this window:
+        self.frame_cache = get_frame_cache()
         self.batch_config = batch_config
         self.suspended = False
         #auto-refresh:
@@ -134,6 +172,7 @@ class WindowSource(object):
         # mmap:
         self._mmap = mmap
         self._mmap_size = mmap_size
+        self._mmap_allocator = mmap_allocator       #shared by all the windows of this client
 
         # general encoding tunables (mostly used by video encoders):
         self._encoding_quality = maxdeque(100)   #keep track of the target encoding_quality: (event time, info, encoding speed)
@@ -194,7 +233,8 @@ class WindowSource(object):
         if self.encoding==encoding:
             return
         self.statistics.reset()
-        self.last_pixmap_data = None
+        self.delta_cache.clear()
+        self.scroll_data = None
         self.encoding = encoding
 
     def _scaling_changed(self, window, *args):
@@ -211,10 +251,18 @@ class WindowSource(object):
         debug("window fullscreen state changed: %s", self.fullscreen)
         self.reconfigure(False)
 
+    def init_tile_cache(self):
+        #the tiles are sent as sub-rectangles, which clients that need full frames cannot handle:
+        if not self.tile_cache_enabled or self.full_frames_only:
+            self.tile_cache = None
+        elif self.tile_cache is None:
+            self.tile_cache = TileChecksumCache()
+
     def set_client_properties(self, properties):
         debug("set_client_properties(%s)", properties)
         self.maximized = properties.get("maximized", False)
         self.full_frames_only = properties.get("encoding.full_frames_only", self.full_frames_only)
+        self.init_tile_cache()
         self.supports_transparency = HAS_ALPHA and properties.get("encoding.transparency", self.supports_transparency)
         self.encodings = properties.get("encodings", self.encodings)
         self.core_encodings = properties.get("encodings.core", self.core_encodings)
@@ -243,7 +291,10 @@ class WindowSource(object):
         #if a region was delayed, we can just drop it now:
         self._damage_delayed = None
         self._damage_delayed_expired = False
-        self.last_pixmap_data = None
+        self.delta_cache.clear()
+        self.scroll_data = None
+        if self.tile_cache:
+            self.tile_cache.clear()
         #make sure we don't account for those as they will get dropped
         #(generally before encoding - only one may still get encoded):
         for sequence in self.statistics.encoding_pending.keys():
@@ -289,6 +340,14 @@ class WindowSource(object):
         info[prefix+"property.scaling"+suffix] = self.scaling or (1, 1)
         info[prefix+"property.fullscreen"+suffix] = self.fullscreen or False
         self.statistics.add_stats(info, prefix, suffix)
+        if self.tile_cache:
+            self.tile_cache.add_stats(info, prefix+"tile_cache.", suffix)
+        if self.supports_scrolling:
+            self.scroll_stats.add_stats(info, prefix+"scroll.", suffix)
+        if self.supports_delta:
+            self.delta_cache.add_stats(info, prefix+"delta_cache.", suffix)
+        if self.content_classifier:
+            self.content_classifier.add_stats(info, prefix+"classifier.", suffix)
 
         #batch delay stats:
         self.batch_config.add_stats(info, "", suffix)
@@ -328,7 +387,7 @@ class WindowSource(object):
         if speed<0:
             min_speed = self.get_min_speed()
             #make a copy to work on (and discard "info")
-            speed_data = [(event_time, speed) for event_time, _, speed in list(self._encoding_speed)]
+            speed_data = [(x[0], x[2]) for x in list(self._encoding_speed)]
             info, target_speed = get_target_speed(self.wid, self.window_dimensions, self.batch_config, self.global_statistics, self.statistics, min_speed, speed_data)
             speed_data.append((time.time(), target_speed))
             speed = max(min_speed, time_weighted_average(speed_data, min_offset=0.1, rpow=1.2))
@@ -428,6 +487,9 @@ class WindowSource(object):
         self.statistics.damage_events_count += 1
         self.statistics.last_damage_event_time = now
         ww, wh = window.get_dimensions()
+        if self.tile_cache and self.window_dimensions!=(ww, wh):
+            #the client's pixels may have moved:
+            self.tile_cache.clear()
         self.window_dimensions = ww, wh
         if self.full_frames_only:
             x, y, w, h = 0, 0, ww, wh
@@ -597,6 +659,14 @@ class WindowSource(object):
                 #so favour large screen updates over many small packets
                 pixels_threshold = ww*wh/2
                 packet_cost = 4096
+            #clip to the window and send the bounding box of rectangles
+            #when the extra pixels cost less than sending another packet:
+            intersect_rectangle(damage, 0, 0, ww, wh)
+            if len(get_rectangles(damage))>count_threshold*4:
+                #too many to bother merging them
+                send_full_window_update()
+                return
+            merge_rectangles(damage, packet_cost)
             pixel_count = 0
             for rect in get_rectangles(damage):
                 pixel_count += rect.width*rect.height
@@ -649,6 +719,9 @@ class WindowSource(object):
             coding = self.find_common_lossless_encoder(has_alpha, current_encoding, ww*wh)
             debug("do_get_best_encoding(..) using %s encoder for %s tray pixels", coding, pixel_count)
             return coding
+        coding = self.get_content_encoding(has_alpha, pixel_count, current_encoding)
+        if coding:
+            return coding
         if AUTO_SWITCH_TO_RGB and not batching and pixel_count<MAX_PIXELS_PREFER_RGB and current_encoding in ("png", "webp"):
             if has_alpha and self.supports_transparency:
                 return self.pick_encoding(["rgb32"])
@@ -656,6 +729,34 @@ class WindowSource(object):
                 return self.pick_encoding(["rgb24"])
         return None
 
+    def get_content_encoding(self, has_alpha, pixel_count, current_encoding):
+        """
+            Uses the content classifier to pick a better encoding than the current one:
+            lossless for text and flat areas when the current encoding is lossy,
+            rgb with lz4 rather than png for pictures.
+            We never switch a lossless encoding to a lossy one:
+            there would be no auto-refresh to fix the artifacts.
+            webp is left to the existing logic (see get_best_encoding).
+        """
+        if not self.content_classifier:
+            return None
+        content = self.content_classifier.get_content()
+        coding = None
+        if content in (FLAT, TEXT) and current_encoding not in ("png", "png/P", "png/L", "rgb", "rgb24", "rgb32", "webp"):
+            if content==FLAT and not (has_alpha and self.supports_transparency):
+                coding = self.pick_encoding(["png/P"])
+            if coding is None:
+                coding = self.find_common_lossless_encoder(has_alpha, None, pixel_count)
+        elif content==PHOTO and current_encoding in ("png", "png/P", "png/L") and use_lz4 and self.rgb_lz4:
+            #png is slow and does not compress pictures well:
+            if has_alpha and self.supports_transparency:
+                coding = self.pick_encoding(["rgb32"])
+            else:
+                coding = self.pick_encoding(["rgb24"])
+        if coding:
+            debug("get_content_encoding(%s, %s, %s) using %s for %s content", has_alpha, pixel_count, current_encoding, coding, content)
+        return coding
+
     def get_transparent_encoding(self, current_encoding):
         if current_encoding in ("png", "png/P", "png/L", "rgb32", "webp"):
             return current_encoding
@@ -759,7 +860,7 @@ class WindowSource(object):
                     client_options = packet[10]     #info about this packet from the encoder
                     self.idle_add(self.schedule_auto_refresh, window, w, h, coding, options, client_options)
         self.statistics.encoding_pending[sequence] = (damage_time, w, h)
-        self.queue_damage(make_data_packet_cb)
+        self.queue_damage(make_data_packet_cb, self.wid)
 
     def schedule_auto_refresh(self, window, w, h, coding, damage_options, client_options):
         """ Must be called from the UI thread: this makes it easier
@@ -825,7 +926,7 @@ class WindowSource(object):
     def queue_damage_packet(self, packet, damage_time, process_damage_time):
         """
             Adds the given packet to the damage_packet_queue,
-            (warning: this runs from the non-UI thread 'data_to_packet')
+            (warning: this runs from the non-UI encode worker thread)
             we also record a number of statistics:
             - damage packet queue size
             - number of pixels in damage packet queue
@@ -873,15 +974,18 @@ class WindowSource(object):
             self.global_statistics.record_latency(self.wid, decode_time, start_send_at, end_send_at, pixels, bytecount)
         else:
             #something failed client-side, so we can't rely on the delta being available
-            self.last_pixmap_data = None
+            self.delta_cache.clear()
+            self.scroll_data = None
+            if self.tile_cache:
+                self.tile_cache.clear()
         if self._damage_delayed is not None and self._damage_delayed_expired:
             self.idle_add(self.may_send_delayed)
 
     def make_data_packet(self, damage_time, process_damage_time, wid, image, coding, sequence, options):
         """
             Picture encoding - non-UI thread.
-            Converts a damage item picked from the 'damage_data_queue'
-            by the 'data_to_packet' thread and returns a packet
+            Converts a damage item picked by the encode worker thread
+            assigned to this window and returns a packet
             ready for sending by the network layer.
 
             * 'mmap' will use 'mmap_send' + 'mmap_encode' - always if available, otherwise:
@@ -889,6 +993,9 @@ class WindowSource(object):
             * 'webp' uses 'webp_encode'
             * 'h264' and 'vp8' use 'video_encode'
             * 'rgb24' and 'rgb32' use 'rgb_encode'
+            * when the window scrolls, 'make_scroll_packets' sends the rows which have moved
+              as a 'scroll' packet and only encodes the rows which have changed
+            * 'make_tile_packets' only encodes the tiles which the client does not have already
         """
         if self.is_cancelled(sequence) or self.suspended:
             debug("make_data_packet: dropping data packet for window %s with sequence=%s", wid, sequence)
@@ -899,6 +1006,26 @@ class WindowSource(object):
         assert w>0 and h>0, "invalid dimensions: %sx%s" % (w, h)
         debug("make_data_packet: image=%s, damage data: %s", image, (wid, x, y, w, h, coding))
         start = time.time()
+        if self.content_classifier and options.get("classify", True):
+            self.content_classifier.update(image)
+        row_checksums = None
+        if self.supports_scrolling and coding in STATELESS_ENCODINGS and not (self._mmap and self._mmap_size>0) and self.scroll_stats.should_checksum():
+            row_checksums = get_row_checksums(image)
+            #the auto-refresh must always be sent, the client may have lossy pixels for those rows:
+            if options.get("optimize", True) and options.get("scroll", True):
+                scroll = self.get_scroll(x, y, w, h, row_checksums)
+                if scroll:
+                    return self.make_scroll_packets(damage_time, process_damage_time, wid, image, coding, sequence, options, scroll, row_checksums)
+        tiles = None
+        #(may be changed from the UI thread, see set_client_properties)
+        tile_cache = self.tile_cache
+        if tile_cache and coding in STATELESS_ENCODINGS and not (self._mmap and self._mmap_size>0) and tile_cache.should_checksum():
+            tiles = get_tile_checksums(image, tile_cache.tile_size)
+            #the auto-refresh must always be sent:
+            if options.get("optimize", True) and options.get("tiles", True):
+                changed = tile_cache.get_changed(tiles)
+                if len(changed)<len(tiles):
+                    return self.make_tile_packets(damage_time, process_damage_time, wid, image, coding, sequence, options, [tiles[k] for k in changed])
         if self._mmap and self._mmap_size>0 and isize>256:
             data = self.mmap_send(image)
             if data:
@@ -912,13 +1039,16 @@ class WindowSource(object):
         if DELTA and coding in self.supports_delta and self.max_delta_size>=0 and image.get_size()<self.max_delta_size:
             #we need to copy the pixels because some delta encodings
             #will modify the pixel array in-place!
-            dpixels = image.get_pixels()[:]
-            store = sequence
-            lpd = self.last_pixmap_data
+            dbuf, dsize = get_buffer_pool().copy(image.get_pixels())
+            dpixels = buffer(dbuf, 0, dsize)
+            #the damage sequence is shared by all the sub-image packets (scroll bands, tiles),
+            #the client needs a unique id for each pixmap it stores:
+            store = self._damage_packet_sequence
+            lpd = self.delta_cache.get((w, h, coding))
             if lpd is not None:
-                lw, lh, lcoding, lsequence, ldata = lpd
-                if lw==w and lh==h and lcoding==coding and len(ldata)==len(dpixels):
-                    #xor with the last frame:
+                lsequence, ldata = lpd[:2]
+                if len(ldata)==len(dpixels):
+                    #xor with the last frame of the same size:
                     delta = lsequence
                     data = xor_str(dpixels, ldata)
                     image.set_pixels(data)
@@ -926,7 +1056,17 @@ class WindowSource(object):
         #by default, don't set rowstride (the container format will take care of providing it):
         encoder = self._encoders.get(coding)
         assert encoder is not None, "encoder not found for %s" % coding
-        encoder_type, data, client_options, outw, outh, outstride, bpp = encoder(coding, image, options)
+        key = None
+        if delta<0:
+            key = self.get_frame_cache_key(coding, image, options)
+        if key:
+            def encode():
+                return encoder(coding, image, options)
+            encoder_type, data, client_options, outw, outh, outstride, bpp = self.frame_cache.get_or_encode(key, encode)
+            #the options are modified below, don't touch the shared copy:
+            client_options = client_options.copy()
+        else:
+            encoder_type, data, client_options, outw, outh, outstride, bpp = encoder(coding, image, options)
         #check cancellation list again since the code above may take some time:
         #but always send mmap data so we can reclaim the space!
         if coding!="mmap" and (self.is_cancelled(sequence)  or self.suspended):
@@ -939,8 +1079,17 @@ class WindowSource(object):
         if delta>=0:
             client_options["delta"] = delta
         if store>0:
-            self.last_pixmap_data = w, h, coding, store, dpixels
+            removed = self.delta_cache.add((w, h, coding), (store, dpixels, dbuf), len(dpixels))
             client_options["store"] = store
+            #tell the client which slots it can drop
+            #(the one we xored with is replaced by this one):
+            evict = []
+            pool = get_buffer_pool()
+            for _, value in removed:
+                evict.append(value[0])
+                pool.release(value[2])
+            if evict:
+                client_options["evict"] = evict
         encoding = coding
         if not self.generic_encodings:
             #old clients use non-generic encoding names:
@@ -960,9 +1109,133 @@ class WindowSource(object):
         totals[1] = totals[1] + w*h
         self._last_sequence_queued = sequence
         self.encoding_last_used = coding
+        if self.supports_scrolling:
+            self.update_scroll_data(x, y, w, h, row_checksums)
+        if tile_cache:
+            lossy = coding=="jpeg" or client_options.get("quality", 100)<100 or client_options.get("csc") in LOSSY_PIXEL_FORMATS
+            if tiles is None or lossy:
+                tile_cache.invalidate(x, y, w, h)
+            else:
+                tile_cache.update(tiles)
         #debug("make_data_packet: returning packet=%s", packet[:7]+[".."]+packet[8:])
         return packet
 
+    def get_scroll(self, x, y, w, h, row_checksums):
+        """ returns the scroll information if the client has the previous frame for this area """
+        sd = self.scroll_data
+        if sd is None or h<MIN_SCROLL_HEIGHT or sd[:4]!=(x, y, w, h):
+            return None
+        scroll = detect_scroll(sd[4], row_checksums)
+        self.scroll_stats.record(scroll)
+        return scroll
+
+    def update_scroll_data(self, x, y, w, h, row_checksums):
+        """
+            Keeps track of the row checksums of the pixels the client is showing,
+            the rows we don't know about are set to None.
+        """
+        sd = self.scroll_data
+        if row_checksums is not None and (sd is None or w*h>=sd[2]*sd[3]):
+            self.scroll_data = x, y, w, h, row_checksums
+            return
+        if sd is None:
+            return
+        sx, sy, sw, sh, checksums = sd
+        if x>=sx+sw or x+w<=sx or y>=sy+sh or y+h<=sy:
+            return
+        same_columns = row_checksums is not None and x==sx and w==sw
+        for row in range(max(y, sy), min(y+h, sy+sh)):
+            if same_columns:
+                checksums[row-sy] = row_checksums[row-y]
+            else:
+                checksums[row-sy] = None
+
+    def make_scroll_packets(self, damage_time, process_damage_time, wid, image, coding, sequence, options, scroll, row_checksums):
+        """
+            Sends a 'scroll' packet telling the client which rows it can copy from the previous frame,
+            followed by the bands of rows which have changed.
+            The last packet is returned so the caller can queue it like any other.
+        """
+        x, y, w, h, _ = image.get_geometry()
+        dy, copies, bands = scroll
+        start = time.time()
+        #the client applies the copies in order,
+        #so we must not overwrite rows which have yet to be copied:
+        copies = sorted(copies, reverse=dy>0)
+        scrolls = [(x, y+cstart-dy, w, cend-cstart, 0, dy) for cstart, cend in copies]
+        packet = ["draw", wid, x, y, w, h, "scroll", scrolls, self._damage_packet_sequence, 0, {}]
+        self._damage_packet_sequence += 1
+        self.global_statistics.packet_count += 1
+        self.statistics.packet_count += 1
+        scrolled = sum([cend-cstart for cstart, cend in copies])*w
+        self.statistics.encoding_stats.append(("scroll", scrolled, 0, 0, time.time()-start))
+        totals = self.statistics.encoding_totals.setdefault("scroll", [0, 0])
+        totals[0] = totals[0] + 1
+        totals[1] = totals[1] + scrolled
+        self.scroll_data = x, y, w, h, row_checksums
+        tile_cache = self.tile_cache
+        if tile_cache:
+            tile_cache.invalidate(x, y, w, h)
+        debug("make_scroll_packets: scrolling by %s, copies=%s, sending bands=%s", dy, copies, bands)
+        if not bands:
+            return packet
+        self.queue_damage_packet(packet, damage_time, process_damage_time)
+        return self.make_sub_image_packets(damage_time, process_damage_time, wid, image, coding, sequence, options,
+                                           [(x, y+bstart, w, bend-bstart) for bstart, bend in bands])
+
+    def make_tile_packets(self, damage_time, process_damage_time, wid, image, coding, sequence, options, changed):
+        """
+            Only encodes the tiles which have changed,
+            merged into as few rectangles as is worth it.
+            Returns the last packet (or None if nothing has changed).
+        """
+        if not changed:
+            debug("make_tile_packets: no changes in %s", image)
+            return None
+        region = new_region()
+        for tx, ty, tw, th, _ in changed:
+            add_rectangle(region, tx, ty, tw, th)
+        merge_rectangles(region, 1024)
+        rects = [(r.x, r.y, r.width, r.height) for r in get_rectangles(region)]
+        debug("make_tile_packets: %s tiles changed in %s, sending %s", len(changed), image, rects)
+        return self.make_sub_image_packets(damage_time, process_damage_time, wid, image, coding, sequence, options, rects)
+
+    def make_sub_image_packets(self, damage_time, process_damage_time, wid, image, coding, sequence, options, rects):
+        """ encodes each area of the image separately, queues all the packets but the last one which is returned """
+        sub_options = options.copy()
+        sub_options["scroll"] = False
+        sub_options["tiles"] = False
+        sub_options["classify"] = False
+        packet = None
+        for i, (sx, sy, sw, sh) in enumerate(rects):
+            sub = get_sub_image(image, sx, sy, sw, sh)
+            try:
+                packet = self.make_data_packet(damage_time, process_damage_time, wid, sub, coding, sequence, sub_options.copy())
+            finally:
+                sub.free()
+            if packet and i<len(rects)-1:
+                self.queue_damage_packet(packet, damage_time, process_damage_time)
+        return packet
+
+
+    def get_frame_cache_key(self, coding, image, options):
+        """
+            Frames can be shared with other clients if they use the same
+            encoding, quality bucket and the same client capabilities for this encoding.
+            Returns None if this frame should not be shared.
+        """
+        cache = self.frame_cache
+        if cache is None or not cache.is_active() or coding not in CACHEABLE_ENCODINGS:
+            return None
+        q = 0
+        if coding in ("jpeg", "webp"):
+            q = self.get_current_quality()
+            if options:
+                q = options.get("quality", q)
+            q = int(q)//QUALITY_BUCKET
+        x, y, w, h, _ = image.get_geometry()
+        caps = (self.supports_transparency, tuple(self.rgb_formats or ()), self.rgb_zlib, self.rgb_lz4, self.supports_rgb24zlib)
+        return (self.wid, x, y, w, h, image.get_rowstride(), image.get_pixel_format(), pixels_checksum(image), coding, q, caps)
 
     def mmap_encode(self, coding, image, options):
         data = options["mmap_data"]
@@ -1194,18 +1467,20 @@ class WindowSource(object):
         #need to convert to a supported format!
         pixel_format = image.get_pixel_format()
         pixels = image.get_pixels()
-        PIL = get_codec("PIL")
-        if not PIL:
-            #try to fallback to argb module
-            return self.argb_swap(image)
         modes = {
                  #source  : [(PIL input format, output format), ..]
                  "XRGB"   : [("XRGB", "RGB")],
                  "BGRX"   : [("BGRX", "RGB"), ("BGRX", "RGBX")],
                  #try with alpha first:
                  "BGRA"   : [("BGRA", "RGBA"), ("BGRX", "RGB"), ("BGRX", "RGBX")]
-                 }.get(pixel_format)
+                 }.get(pixel_format, [])
         target_rgb = [(im,om) for (im,om) in modes if om in self.rgb_formats]
+        if rgb_convert and target_rgb:
+            return self.convert_pixels(image, target_rgb[0][1])
+        PIL = get_codec("PIL")
+        if not PIL:
+            #try to fallback to argb module
+            return self.argb_swap(image)
         if len(target_rgb)==0:
             #try argb module:
             if self.argb_swap(image):
@@ -1228,16 +1503,42 @@ class WindowSource(object):
         debug("rgb_reformat(%s) converted from %s (%s bytes) to %s (%s bytes) in %.1fms, rowstride=%s", image, pixel_format, len(pixels), target_format, len(data), (end-start)*1000.0, rowstride)
         return True
 
+    def convert_pixels(self, image, target_format):
+        """
+            convert the pixels using the conversion module,
+            the output buffer comes from the buffer pool,
+            the image gives it back when it is freed
+        """
+        start = time.time()
+        pixel_format = image.get_pixel_format()
+        w = image.get_width()
+        h = image.get_height()
+        rowstride = w*len(target_format)
+        size = rowstride*h
+        buf = get_buffer_pool().get(size)
+        rgb_convert(image.get_pixels(), w, h, image.get_rowstride(), pixel_format, target_format, buf, rowstride)
+        image.set_pixels(buffer(buf, 0, size), buf)
+        image.set_rowstride(rowstride)
+        image.set_pixel_format(target_format)
+        end = time.time()
+        debug("convert_pixels(%s, %s) converted from %s in %.1fms", image, target_format, pixel_format, (end-start)*1000.0)
+        return True
+
     def mmap_send(self, image):
         if image.get_pixel_format() not in self.rgb_formats:
             if not self.rgb_reformat(image):
                 warning_key = "mmap_send(%s)" % image.get_pixel_format()
                 self.warn_encoding_once(warning_key, "cannot use mmap to send %s" % image.get_pixel_format())
                 return None
-        from xpra.net.mmap_pipe import mmap_write
         start = time.time()
         data = image.get_pixels()
-        mmap_data, mmap_free_size = mmap_write(self._mmap, self._mmap_size, data)
+        if self._mmap_allocator:
+            #the slot is tagged with the sequence of the packet we are about to create,
+            #so the client's ack for this packet can release it:
+            mmap_data, mmap_free_size = self._mmap_allocator.write(data, (self.wid, self._damage_packet_sequence))
+        else:
+            from xpra.net.mmap_pipe import mmap_write
+            mmap_data, mmap_free_size = mmap_write(self._mmap, self._mmap_size, data)
         self.global_statistics.mmap_free_size = mmap_free_size
         elapsed = time.time()-start+0.000000001 #make sure never zero!
         debug("%s MBytes/s - %s bytes written to mmap in %.1f ms", int(len(data)/elapsed/1024/1024), len(data), 1000*elapsed)
@@ -91,7 +91,16 @@ class WindowPerformanceStatistics(object):
                  self.avg_damage_out_latency, self.recent_damage_out_latency]
         self.max_latency = max(all_l)
 
-    def get_factors(self, pixel_count, delay):
+    def get_frame_send_time(self, link_rate):
+        """ how long it takes to send an average frame at the given link rate, or None if unknown """
+        if link_rate<=0:
+            return None
+        sizes = [compressed_size for _, _, _, compressed_size, _ in list(self.encoding_stats) if compressed_size>0]
+        if len(sizes)==0:
+            return None
+        return float(sum(sizes))/len(sizes)/link_rate
+
+    def get_factors(self, pixel_count, delay, link_rate=0):
         factors = []
         #ratio of "in" and "out" latency indicates network bottleneck:
         #(the difference between the two is the time it takes to send)
@@ -115,6 +124,14 @@ class WindowPerformanceStatistics(object):
             metric = "network-send-speed"
             #info: avg=%s, recent=%s (KBytes/s), div=%s" % (int(self.avg_send_speed/1024), int(self.recent_send_speed/1024), div)
             factors.append(calculate_for_average(metric, avg1MB, recent1MB, weight_offset=1.0, weight_div=div))
+        #link rate: we can't send frames faster than the link can carry them
+        send_time = self.get_frame_send_time(link_rate)
+        if send_time is not None:
+            ratio = 1000.0*send_time/max(1, delay)
+            metric = "link-rate"
+            info = {"link_rate"     : int(link_rate),
+                    "frame_send_ms" : int(1000.0*send_time)}
+            factors.append((metric, info, logp(ratio), min(2.0, ratio)))
         #client decode time:
         if self.avg_decode_speed is not None and self.recent_decode_speed is not None:
             metric = "client-decode-speed"
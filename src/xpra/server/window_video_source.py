@@ -13,6 +13,10 @@ from xpra.codecs.codec_constants import get_avutil_enum_from_colorspace, get_sub
 from xpra.codecs.video_helper import getVideoHelper
 from xpra.server.window_source import WindowSource, log
 from xpra.server.background_worker import add_work_item
+from xpra.server.codec_pool import get_codec_pool, get_context_size, CODEC_POOL
+from xpra.server.video_subregion import VideoSubregion, VIDEO_SUBREGION
+from xpra.server.region import new_region, add_rectangle, get_rectangles, subtract_rectangle
+from xpra.server.content_classifier import VIDEO
 from xpra.log import debug_if_env
 
 debug = debug_if_env(log, "XPRA_VIDEO_DEBUG")
@@ -25,6 +29,11 @@ def envint(name, d):
         return d
 
 MAX_NONVIDEO_PIXELS = envint("XPRA_MAX_NONVIDEO_PIXELS", 1024*4)
+#the pipeline options are re-used for similar dimensions, quality and speed:
+PIPELINE_CACHE_SIZE = envint("XPRA_PIPELINE_CACHE_SIZE", 64)
+PIPELINE_CACHE_TTL = envint("XPRA_PIPELINE_CACHE_TTL", 10)
+PIPELINE_DIMENSION_BUCKET = envint("XPRA_PIPELINE_DIMENSION_BUCKET", 32)
+PIPELINE_QS_BAND = envint("XPRA_PIPELINE_QS_BAND", 5)
 
 ENCODER_TYPE = os.environ.get("XPRA_ENCODER_TYPE", "")  #ie: "x264" or "nvenc"
 CSC_TYPE = os.environ.get("XPRA_CSC_TYPE", "")          #ie: "swscale" or "opencl"
@@ -83,10 +92,18 @@ class WindowVideoSource(WindowSource):
 
         self._csc_encoder = None
         self._video_encoder = None
+        #the codec pool key and size of the current contexts (if they can be re-used):
+        self._csc_pool_entry = None
+        self._video_pool_entry = None
         self._lock = Lock()               #to ensure we serialize access to the encoder and its internals
 
         self.last_pipeline_params = None
         self.last_pipeline_scores = []
+        self.pipeline_cache = {}                    #key -> (time, scores)
+        self.pipeline_cache_generation = -1         #the video helper generation the cache is valid for
+        self.pipeline_cache_hits = 0
+        self.pipeline_cache_misses = 0
+        self.pipeline_rebuilds = 0
         self.video_helper = getVideoHelper()
         if self.encoding_options.get("proxy.video", False):
             #if we "proxy video", we will modify the video helper to add
@@ -97,6 +114,12 @@ class WindowVideoSource(WindowSource):
                 self.parse_proxy_video()
             except:
                 log.error("failed to parse proxy video", exc_info=True)
+        #the client can paint video at an offset within the window,
+        #(but the proxy encoders only handle full windows):
+        self.supports_video_subregion = VIDEO_SUBREGION and self.encoding_options.get("video_subregion", False) \
+                                        and not self.encoding_options.get("proxy.video", False)
+        self.video_subregion = VideoSubregion()
+        self.video_subregion_changes = 0
 
     def parse_proxy_video(self):
         from xpra.codecs.enc_proxy.encoder import Encoder
@@ -119,7 +142,9 @@ class WindowVideoSource(WindowSource):
         info[prefix+"client.uses_swscale"] = self.uses_swscale
         info[prefix+"client.uses_csc_atoms"] = self.uses_csc_atoms
         info[prefix+"client.supports_scaling"] = self.video_scaling
+        info[prefix+"client.supports_video_subregion"] = self.supports_video_subregion
         info[prefix+"scaling"] = self.actual_scaling
+        self.video_subregion.add_stats(info, prefix+"video_subregion.", suffix)
         if self._csc_encoder:
             info[prefix+"csc"+suffix] = self._csc_encoder.get_type()
             ci = self._csc_encoder.get_info()
@@ -143,6 +168,10 @@ class WindowVideoSource(WindowSource):
                 info[prefix+("encoding.pipeline_option[%s].format" % i)+suffix] = str(enc_in_format)
                 info[prefix+("encoding.pipeline_option[%s].encoder" % i)+suffix] = repr(encoder_spec)
                 i += 1
+        info[prefix+"encoding.pipeline_cache.size"+suffix] = len(self.pipeline_cache)
+        info[prefix+"encoding.pipeline_cache.hits"+suffix] = self.pipeline_cache_hits
+        info[prefix+"encoding.pipeline_cache.misses"+suffix] = self.pipeline_cache_misses
+        info[prefix+"encoding.pipeline_rebuilds"+suffix] = self.pipeline_rebuilds
 
     def cleanup(self):
         WindowSource.cleanup(self)
@@ -166,15 +195,30 @@ class WindowVideoSource(WindowSource):
         #MUST be called with video lock held!
         if self._csc_encoder is None:
             return
-        add_work_item(self._csc_encoder.clean)
+        self.release_codec(self._csc_encoder, self._csc_pool_entry)
         self._csc_encoder = None
+        self._csc_pool_entry = None
 
     def do_video_encoder_cleanup(self):
         #MUST be called with video lock held!
         if self._video_encoder is None:
             return
-        add_work_item(self._video_encoder.clean)
+        self.release_codec(self._video_encoder, self._video_pool_entry)
         self._video_encoder = None
+        self._video_pool_entry = None
+
+    def release_codec(self, codec, pool_entry):
+        """ gives the codec back to the pool if we can, or frees it in the worker thread """
+        if pool_entry is None or not CODEC_POOL:
+            add_work_item(codec.clean)
+            return
+        key, size = pool_entry
+        get_codec_pool().release(key, codec, size)
+
+    def get_encoder_options_key(self, codec_type):
+        #the client options which may be used by this type of encoder (ie: "x264.YUV420P.profile"):
+        prefix = codec_type+"."
+        return repr(sorted((k,v) for k,v in self.encoding_options.items() if k.startswith(prefix)))
 
     def set_new_encoding(self, encoding):
         if self.encoding!=encoding:
@@ -193,6 +237,7 @@ class WindowVideoSource(WindowSource):
     def unmap(self):
         WindowSource.cancel_damage(self)
         self.cleanup_codecs()
+        self.video_subregion.reset()
 
     def cancel_damage(self):
         WindowSource.cancel_damage(self)
@@ -202,7 +247,64 @@ class WindowVideoSource(WindowSource):
             #drop a frame which is being processed
             self.cleanup_codecs()
 
+    def damage(self, window, x, y, w, h, options={}):
+        if self.supports_video_subregion:
+            self.video_subregion.record(x, y, w, h)
+        WindowSource.damage(self, window, x, y, w, h, options)
+
+    def get_video_subregion(self, window):
+        """ returns the area of the window we should encode as video, or None to use the whole window """
+        if not self.supports_video_subregion or self.full_frames_only or window.is_tray():
+            return None
+        if self.encoding not in self.video_encodings:
+            return None
+        ww, wh = window.get_dimensions()
+        return self.video_subregion.identify(ww, wh)
+
+    def get_non_video_encoding(self, window, pixel_count):
+        return self.find_common_lossless_encoder(window.has_alpha(), None, pixel_count)
+
+    def send_delayed_regions(self, damage_time, window, damage, coding, options):
+        vr = None
+        if coding in self.video_encodings:
+            vr = self.get_video_subregion(window)
+        if vr is None or not self.send_video_subregion(damage_time, window, damage, coding, options, vr):
+            WindowSource.send_delayed_regions(self, damage_time, window, damage, coding, options)
+
+    def send_video_subregion(self, damage_time, window, damage, coding, options, vr):
+        """
+            Sends the video subregion using the video encoder if it has been damaged,
+            and the rest of the damage with a non-video encoding.
+            Returns False if we cannot do that.
+        """
+        ww, wh = window.get_dimensions()
+        non_video = self.get_non_video_encoding(window, ww*wh)
+        if non_video is None:
+            return False
+        if self.video_subregion.changes!=self.video_subregion_changes:
+            #the rest of the window may have been sent as (lossy) full window video frames until now:
+            self.video_subregion_changes = self.video_subregion.changes
+            add_rectangle(damage, 0, 0, ww, wh)
+        x, y, w, h = vr.get_geometry()
+        if len([r for r in get_rectangles(damage) if r.intersects(x, y, w, h)])>0:
+            actual_encoding = self.get_best_encoding(True, window, w*h, w, h, coding)
+            debug("send_video_subregion: sending video region %s using %s", vr, actual_encoding)
+            self.process_damage_region(damage_time, window, x, y, w, h, actual_encoding, options)
+        subtract_rectangle(damage, x, y, w, h)
+        if get_rectangles(damage):
+            #the rest goes through the regular path:
+            WindowSource.send_delayed_regions(self, damage_time, window, damage, non_video, options)
+        return True
+
     def process_damage_region(self, damage_time, window, x, y, w, h, coding, options):
+        if coding in self.video_encodings:
+            vr = self.get_video_subregion(window)
+            if vr and vr.get_geometry()!=(x, y, w, h):
+                #the video encoder only handles the video subregion:
+                damage = new_region()
+                add_rectangle(damage, x, y, w, h)
+                if self.send_video_subregion(damage_time, window, damage, coding, options, vr):
+                    return
         WindowSource.process_damage_region(self, damage_time, window, x, y, w, h, coding, options)
         #now figure out if we need to send edges separately:
         dw = w - (w & self.width_mask)
@@ -213,11 +315,16 @@ class WindowVideoSource(WindowSource):
                 WindowSource.process_damage_region(self, damage_time, window, x+w-dw, y, dw, h, lossless, options)
             if dh>0:
                 lossless = self.find_common_lossless_encoder(window.has_alpha(), coding, w*dh)
-                WindowSource.process_damage_region(self, damage_time, window, x, y+h-dh, x+w, dh, lossless, options)
+                WindowSource.process_damage_region(self, damage_time, window, x, y+h-dh, w, dh, lossless, options)
 
 
     def must_encode_full_frame(self, window, encoding):
-        return WindowSource.must_encode_full_frame(self, window, encoding) or (encoding in self.video_encodings)
+        if WindowSource.must_encode_full_frame(self, window, encoding):
+            return True
+        if encoding not in self.video_encodings:
+            return False
+        #with a video subregion, process_damage_region splits the damage:
+        return self.get_video_subregion(window) is None
 
     def do_get_best_encoding(self, batching, has_alpha, is_tray, is_OR, pixel_count, ww, wh, current_encoding):
         """
@@ -263,6 +370,9 @@ class WindowVideoSource(WindowSource):
         if self._video_encoder:
             #if we have a video encoder already, make it more likely we'll use it:
             max_nvp /= 2
+        if self.content_classifier and self.content_classifier.get_content()==VIDEO:
+            #the pixels keep changing, this looks like a video:
+            max_nvp /= 2
 
         if pixel_count<=max_nvp:
             #below threshold
@@ -338,7 +448,58 @@ class WindowVideoSource(WindowSource):
             self._lock.release()
 
 
+    def get_pipeline_cache_key(self, encoding, width, height, src_format):
+        """
+            The pipeline scores depend on the input format,
+            the current quality and speed settings and the pipeline we are currently using
+            (which has a lower setup cost).
+            The dimensions, quality and speed are bucketed so that resizing windows
+            and small adjustments of the encoding settings can re-use the scores.
+        """
+        pipeline = None
+        ve = self._video_encoder
+        if ve:
+            pipeline = ve.get_type(), ve.get_src_format(), ve.get_width(), ve.get_height()
+            csc = self._csc_encoder
+            if csc:
+                pipeline += (type(csc), csc.get_dst_format(), csc.get_src_width(), csc.get_src_height())
+                src_size = csc.get_src_width(), csc.get_src_height()
+            else:
+                src_size = ve.get_width(), ve.get_height()
+            #re-using the current pipeline scores higher, so this must not be bucketed:
+            pipeline += (src_size==(width, height), )
+        return (encoding, src_format,
+                width//PIPELINE_DIMENSION_BUCKET, height//PIPELINE_DIMENSION_BUCKET,
+                int(self.get_current_quality())//PIPELINE_QS_BAND, int(self.get_current_speed())//PIPELINE_QS_BAND,
+                self.get_min_quality(), self.get_min_speed(),
+                #the scaling thresholds are not aligned with the buckets:
+                self.calculate_scaling(width, height),
+                pipeline)
+
     def get_video_pipeline_options(self, encoding, width, height, src_format):
+        """
+            Returns the pipeline options from the cache if we can,
+            see do_get_video_pipeline_options
+        """
+        now = time.time()
+        generation = self.video_helper.get_generation()
+        if generation!=self.pipeline_cache_generation:
+            #the codecs have changed:
+            self.pipeline_cache = {}
+            self.pipeline_cache_generation = generation
+        key = self.get_pipeline_cache_key(encoding, width, height, src_format)
+        cached = self.pipeline_cache.get(key)
+        if cached and cached[0]>now-PIPELINE_CACHE_TTL:
+            self.pipeline_cache_hits += 1
+            return cached[1]
+        self.pipeline_cache_misses += 1
+        scores = self.do_get_video_pipeline_options(encoding, width, height, src_format)
+        if len(self.pipeline_cache)>=PIPELINE_CACHE_SIZE:
+            self.pipeline_cache = {}
+        self.pipeline_cache[key] = now, scores
+        return scores
+
+    def do_get_video_pipeline_options(self, encoding, width, height, src_format):
         """
             Given a picture format (width, height and src pixel format),
             we find all the pipeline options that will allow us to compress
@@ -579,6 +740,7 @@ class WindowVideoSource(WindowSource):
         if self._video_encoder:
             self.do_video_encoder_cleanup()
         #and make a new one:
+        self.pipeline_rebuilds += 1
         self.last_pipeline_params = encoding, width, height, src_format
         self.last_pipeline_scores = self.get_video_pipeline_options(encoding, width, height, src_format)
         return self.setup_pipeline(self.last_pipeline_scores, width, height, src_format)
@@ -670,9 +832,16 @@ class WindowVideoSource(WindowSource):
                     #so make sure it never degrades quality
                     csc_speed = min(speed, 100-quality/2.0)
                     csc_start = time.time()
-                    self._csc_encoder = csc_spec.codec_class()
-                    self._csc_encoder.init_context(csc_width, csc_height, src_format,
+                    csc_key = ("csc", csc_spec.codec_type, csc_width, csc_height, src_format, enc_width, enc_height, enc_in_format, int(csc_speed)//10)
+                    csc = None
+                    if CODEC_POOL:
+                        csc = get_codec_pool().get(csc_key)
+                    if csc is None:
+                        csc = csc_spec.codec_class()
+                        csc.init_context(csc_width, csc_height, src_format,
                                                           enc_width, enc_height, enc_in_format, csc_speed)
+                    self._csc_encoder = csc
+                    self._csc_pool_entry = csc_key, get_context_size(csc_width, csc_height, False)
                     csc_end = time.time()
                     debug("setup_pipeline: csc=%s, info=%s, setup took %.2fms",
                           self._csc_encoder, self._csc_encoder.get_info(), (csc_end-csc_start)*1000.0)
@@ -694,8 +863,14 @@ class WindowVideoSource(WindowSource):
                     #log.warn("skipping invalid dimensions..")
                     continue
                 enc_start = time.time()
-                self._video_encoder = encoder_spec.codec_class()
-                self._video_encoder.init_context(enc_width, enc_height, enc_in_format, encoder_spec.encoding, quality, speed, encoder_scaling, self.encoding_options)
+                self._video_encoder = self.get_pooled_encoder(encoder_spec, enc_width, enc_height, enc_in_format, encoder_scaling, quality, speed)
+                if self._video_encoder is None:
+                    self._video_encoder = encoder_spec.codec_class()
+                    self._video_encoder.init_context(enc_width, enc_height, enc_in_format, encoder_spec.encoding, quality, speed, encoder_scaling, self.encoding_options)
+                if hasattr(self._video_encoder, "restart"):
+                    #encoders can only be re-used if they can start a new stream:
+                    enc_key = self.get_encoder_pool_key(encoder_spec, enc_width, enc_height, enc_in_format, encoder_scaling)
+                    self._video_pool_entry = enc_key, get_context_size(enc_width, enc_height, True)
                 #record new actual limits:
                 self.actual_scaling = scaling
                 self.min_w = min_w
@@ -717,18 +892,44 @@ class WindowVideoSource(WindowSource):
         return False
 
 
+    def get_encoder_pool_key(self, encoder_spec, width, height, src_format, scaling):
+        return ("encoder", encoder_spec.codec_type, encoder_spec.encoding, width, height, src_format, scaling,
+                self.get_encoder_options_key(encoder_spec.codec_type))
+
+    def get_pooled_encoder(self, encoder_spec, width, height, src_format, scaling, quality, speed):
+        """
+            Returns an encoder from the codec pool (restarted and with our quality and speed settings),
+            or None if there aren't any we can use.
+        """
+        if not CODEC_POOL or not hasattr(encoder_spec.codec_class, "restart"):
+            return None
+        key = self.get_encoder_pool_key(encoder_spec, width, height, src_format, scaling)
+        encoder = get_codec_pool().get(key)
+        if encoder is None:
+            return None
+        try:
+            encoder.restart()
+            encoder.set_encoding_speed(speed)
+            encoder.set_encoding_quality(quality)
+            return encoder
+        except Exception, e:
+            log.warn("cannot re-use pooled encoder %s: %s", encoder, e)
+            add_work_item(encoder.clean)
+            return None
+
     def video_encode(self, encoding, image, options):
         """
             This method is used by make_data_packet to encode frames using video encoders.
             Video encoders only deal with fixed dimensions,
             so we must clean and reinitialize the encoder if the window dimensions
             has changed.
-            Since this runs in the non-UI thread 'data_to_packet', we must
+            Since this runs in the non-UI encode worker thread, we must
             use the '_lock' to prevent races.
         """
         debug("video_encode%s", (encoding, image, options))
         x, y, w, h = image.get_geometry()[:4]
-        assert x==0 and y==0, "invalid position: %s,%s" % (x,y)
+        if x!=0 or y!=0:
+            assert self.supports_video_subregion, "invalid position: %s,%s" % (x,y)
         src_format = image.get_pixel_format()
         try:
             self._lock.acquire()
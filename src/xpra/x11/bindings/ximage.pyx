@@ -8,6 +8,7 @@ import os
 import time
 
 from xpra.util import dump_exc, AdHocStruct
+from xpra.codecs.buffer_pool import get_buffer_pool
 import errno as pyerrno
 
 from xpra.log import Logger
@@ -35,9 +36,6 @@ cdef extern from "Python.h":
     object PyBuffer_FromReadWriteMemory(void *ptr, Py_ssize_t size)
     int PyObject_AsReadBuffer(object obj, void ** buffer, Py_ssize_t * buffer_len) except -1
 
-cdef extern from "string.h":
-    void * memcpy( void * destination, void * source, size_t num )
-
 cdef extern from "sys/ipc.h":
     ctypedef struct key_t:
         pass
@@ -56,10 +54,6 @@ cdef extern from "sys/shm.h":
 cdef extern from "errno.h" nogil:
     int errno
 
-cdef extern from "stdlib.h":
-    void* malloc(size_t __size)
-    void free(void* mem)
-
 cdef extern from "X11/Xutil.h":
     pass
 
@@ -223,6 +217,8 @@ cdef class XImageWrapper:
     cdef int planes
     cdef char *pixel_format
     cdef char *pixels
+    cdef object pixels_object                       #the object holding the memory 'pixels' points to
+    cdef object pool_buffer
     cdef object del_callback
 
     def __cinit__(self, int x, int y, int width, int height):
@@ -310,18 +306,24 @@ cdef class XImageWrapper:
         assert RGB_FORMATS[i]!=NULL, "invalid pixel format: %s" % pixel_format
         self.pixel_format = RGB_FORMATS[i]
 
-    def set_pixels(self, pixels):
+    def set_pixels(self, pixels, pool_buffer=None):
+        """
+            The pixels are copied to a buffer from the buffer pool,
+            unless pool_buffer is the buffer pool bytearray backing them:
+            then we take ownership of it and use the pixels as they are.
+        """
         cdef const unsigned char * buf = NULL
         cdef Py_ssize_t buf_len = 0
-        if self.pixels!=NULL:
-            free(self.pixels)
-            self.pixels = NULL
+        self.free_pixels()
         #Note: we can't free the XImage, because it may
         #still be used somewhere else (see XShmWrapper)
+        if pool_buffer is None:
+            pool_buffer, size = get_buffer_pool().copy(pixels)
+            pixels = buffer(pool_buffer, 0, size)
         assert PyObject_AsReadBuffer(pixels, <const void**> &buf, &buf_len)==0
-        self.pixels = <char *> malloc(buf_len)
-        assert self.pixels!=NULL
-        memcpy(self.pixels, buf, buf_len)
+        self.pixels = <char *> buf
+        self.pixels_object = pixels
+        self.pool_buffer = pool_buffer
 
     def free(self):                                     #@DuplicatedSignature
         debug("XImageWrapper.free()")
@@ -336,9 +338,11 @@ cdef class XImageWrapper:
 
     def free_pixels(self):
         debug("XImageWrapper.free_pixels() pixels=%s", self.pixels!=NULL)
-        if self.pixels!=NULL:
-            free(self.pixels)
-            self.pixels = NULL
+        self.pixels = NULL
+        self.pixels_object = None
+        if self.pool_buffer is not None:
+            get_buffer_pool().release(self.pool_buffer)
+            self.pool_buffer = None
 
 
 cdef class XShmWrapper(object):
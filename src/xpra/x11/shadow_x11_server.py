@@ -39,5 +39,6 @@ class ShadowX11Server(ShadowServerBase, X11ServerBase):
     def get_info(self, proto):
         info = X11ServerBase.get_info(self, proto)
         info["features.shadow"] = True
+        self.add_refresh_info(info)
         info["server.type"] = "Python/gtk2/x11-shadow"
         return info